@@ -3,24 +3,40 @@ import os
 import sys
 import json
 import glob
-import torch
-import torchaudio
+import time
+import shutil
+import wave
 import datetime
 import logging
+import argparse
 import threading
+import numpy as np
+
+try:
+    import torch
+    import torchaudio
+except ImportError:
+    # The recording lookup and the stub backend of the enhancement service work without PyTorch
+    torch = torchaudio = None
 
-# Configure logging for errors only
-logging.basicConfig(
-    level=logging.ERROR,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='audio_enhancer_errors.log'
-)
 logger = logging.getLogger('audio_enhancer')
 
+
+def configure_error_log(filename='audio_enhancer_errors.log'):
+    """Log errors only, to a file; called by the entry points, not on import.
+    The file is only created once an error is actually logged."""
+    handler = logging.FileHandler(filename, delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logging.basicConfig(level=logging.ERROR, handlers=[handler])
+
 # Path to the denoiser project
 DENOISER_PATH = "/home/gpi-16-ssd/Documents/denoiser"
 OUTPUT_DIR = os.path.join(os.getcwd(), "after_process")
 
+# Streaming enhancement: model window and hop in seconds, the difference is cross-faded
+WINDOW_SECONDS = 4.0
+HOP_SECONDS = 3.0
+
 # Create a thread lock for PyTorch operations
 torch_thread_lock = threading.Lock()
 
@@ -37,6 +53,18 @@ def setup_paths():
 
 def get_latest_recording(recording_dir):
     """Find the latest audio recording and its associated info file"""
+    # The recording index answers without scanning the directory
+    from recording_index import open_index
+    index = open_index(recording_dir)
+    if index is not None:
+        try:
+            row = index.newest()
+        finally:
+            index.close()
+        if row and row['audio_path'] and os.path.exists(row['audio_path']):
+            info = json.loads(row['info']) if row['info'] else {}
+            return row['audio_path'], info or None
+    
     audio_files = glob.glob(os.path.join(recording_dir, "audio_*.wav"))
     if not audio_files:
         print("WARNING: No audio recordings found")
@@ -44,30 +72,30 @@ def get_latest_recording(recording_dir):
     
     # Sort files by timestamp (newest first)
     latest_audio = max(audio_files, key=os.path.getctime)
-    basename = os.path.basename(latest_audio)
+    info = load_recording_info(latest_audio)
+    if info is None:
+        print(f"WARNING: No info file found for {latest_audio}")
+    return latest_audio, info
+
+def load_recording_info(audio_path):
+    """The info_<timestamp>.json written next to audio_<timestamp>.wav, or None"""
+    basename = os.path.basename(audio_path)
     timestamp = basename.replace("audio_", "").replace(".wav", "")
-    
-    # Look for the corresponding info file
-    info_filename = os.path.join(recording_dir, f"info_{timestamp}.json")
+    info_filename = os.path.join(os.path.dirname(audio_path), f"info_{timestamp}.json")
     if not os.path.exists(info_filename):
-        print(f"WARNING: No info file found for {latest_audio}")
-        return latest_audio, None
-    
-    # Read the info file
+        return None
     with open(info_filename, 'r') as f:
-        info = json.load(f)
-    
-    return latest_audio, info
+        return json.load(f)
 
-def load_denoiser_model():
-    """Load the denoiser model"""
+def load_denoiser_model(name='dns48'):
+    """Load a pretrained denoiser model (dns48, dns64 or master64)"""
     try:
         # Import the denoiser modules
-        from denoiser.pretrained import dns48
+        from denoiser import pretrained
         
         # Load the model
-        print("Loading DNS-48 model...")
-        model = dns48()
+        print(f"Loading {name} model...")
+        model = getattr(pretrained, name)()
         
         # Move to CPU (or GPU if available)
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -113,16 +141,25 @@ def enhance_audio(model, device, audio_path):
         print(f"ERROR: Audio enhancement failed: {str(e)}")
         raise
 
+def enhanced_output_path(original_path, info):
+    """Output path for an enhanced recording, with the enhancement mode in the name"""
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    orig_name = os.path.basename(original_path).replace(".wav", "")
+    mode_code = info['mode_code'] if info else -1
+    return os.path.join(OUTPUT_DIR, f"{orig_name}_enhanced_mode{mode_code}_{timestamp}.wav")
+
+def save_enhancement_info(output_path, info):
+    """Save the enhancement info alongside the enhanced audio"""
+    if info:
+        info_filename = output_path.replace(".wav", "_info.json")
+        with open(info_filename, 'w') as f:
+            json.dump(info, f, indent=4)
+        print(f"Enhancement info saved to: {info_filename}")
+
 def save_enhanced_audio(enhanced_waveform, original_path, info, sample_rate=16000):
     """Save the enhanced audio to the output directory"""
     try:
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        orig_name = os.path.basename(original_path).replace(".wav", "")
-        
-        # Create output filename with enhancement mode info
-        mode_code = info['mode_code'] if info else -1
-        output_filename = f"{orig_name}_enhanced_mode{mode_code}_{timestamp}.wav"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
+        output_path = enhanced_output_path(original_path, info)
         
         # Normalize audio if it prevents clipping
         enhanced_waveform = enhanced_waveform / max(enhanced_waveform.abs().max().item(), 1)
@@ -132,11 +169,8 @@ def save_enhanced_audio(enhanced_waveform, original_path, info, sample_rate=1600
         print(f"Enhanced audio saved to: {output_path}")
         
         # Also save enhancement info alongside the audio
-        if info:
-            info_filename = output_path.replace(".wav", "_info.json")
-            with open(info_filename, 'w') as f:
-                json.dump(info, f, indent=4)
-            print(f"Enhancement info saved to: {info_filename}")
+        save_enhancement_info(output_path, info)
+        record_enhancement(original_path, output_path, info)
         
         return output_path
     
@@ -145,7 +179,198 @@ def save_enhanced_audio(enhanced_waveform, original_path, info, sample_rate=1600
         print(f"ERROR: Failed to save enhanced audio: {str(e)}")
         raise
 
-def enhance_latest_recording(recording_dir):
+def save_passthrough(original_path, info):
+    """Mode 0 (no enhancement): the recording is copied unchanged as its enhanced output"""
+    output_path = enhanced_output_path(original_path, info)
+    shutil.copyfile(original_path, output_path)
+    print(f"No enhancement for this mode, copied to: {output_path}")
+    save_enhancement_info(output_path, info)
+    record_enhancement(original_path, output_path, info)
+    return output_path
+
+def crossfade_weights(overlap):
+    """Raised-cosine fade-in over the overlap; the matching fade-out is 1 - fade-in"""
+    fade_in = 0.5 - 0.5 * np.cos(np.pi * (np.arange(overlap) + 0.5) / max(overlap, 1))
+    return fade_in.astype(np.float32)
+
+def read_wav_frames(reader, count):
+    """Up to count mono float32 frames from an open 16-bit wave reader"""
+    samples = np.frombuffer(reader.readframes(count), dtype='<i2').astype(np.float32) / 32768.0
+    channels = reader.getnchannels()
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
+
+def write_wav_frames(writer, samples):
+    writer.writeframes((np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes())
+
+def enhance_stream(process, audio_path, output_path, window_seconds=WINDOW_SECONDS, hop_seconds=HOP_SECONDS,
+                   progress=None):
+    """Enhance a WAV window by window, writing the output as it goes
+
+    process(samples) -> enhanced samples of the same length, on one window at
+    a time. Windows start every hop; where two overlap, the end of the earlier
+    one is faded out while the start of the later one is faded in, which hides
+    the model's edge effects at window boundaries. Only one window and one
+    overlap are held in memory, whatever the length of the file.
+
+    Returns (frames written, sample rate)
+    """
+    with wave.open(audio_path, 'rb') as reader, wave.open(output_path, 'wb') as writer:
+        if reader.getsampwidth() != 2:
+            raise ValueError(f"{audio_path}: only 16-bit PCM is supported")
+        rate = reader.getframerate()
+        total = max(reader.getnframes(), 1)
+        window = max(int(window_seconds * rate), 1)
+        hop = min(max(int(hop_seconds * rate), 1), window)
+        fade_in = crossfade_weights(window - hop)
+        fade_out = 1.0 - fade_in
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(rate)
+
+        block = read_wav_frames(reader, window)
+        pending = None
+        written = 0
+        while len(block):
+            enhanced = np.array(process(block), dtype=np.float32).reshape(-1)[:len(block)]
+            if len(enhanced) != len(block):
+                # A short window would shift every later hop and misalign the cross-fades
+                raise ValueError(f"process() returned {len(enhanced)} samples for a window of {len(block)}")
+            if pending is not None:
+                # 重叠部分: 上一窗口淡出 + 本窗口淡入
+                n = min(len(enhanced), len(pending))
+                enhanced[:n] = enhanced[:n] * fade_in[:n] + pending[:n]
+            following = read_wav_frames(reader, hop)
+            if not len(following):
+                write_wav_frames(writer, enhanced)
+                written += len(enhanced)
+                break
+            write_wav_frames(writer, enhanced[:hop])
+            written += hop
+            pending = enhanced[hop:] * fade_out
+            block = np.concatenate((block[hop:], following))
+            if progress:
+                progress(min(written / total, 1.0))
+    if progress:
+        progress(1.0)
+    return written, rate
+
+def model_block_processor(model, device):
+    """process() for enhance_stream around the denoiser model"""
+    def process(samples):
+        waveform = torch.from_numpy(samples).unsqueeze(0).to(device)
+        with torch_thread_lock, torch.no_grad():
+            enhanced = model(waveform)
+        return enhanced.reshape(-1).cpu().numpy()
+    return process
+
+def enhance_audio_streaming(model, device, audio_path, info, window_seconds=WINDOW_SECONDS,
+                            hop_seconds=HOP_SECONDS, progress=None):
+    """Streaming counterpart of enhance_audio + save_enhanced_audio
+
+    device None means model takes numpy samples directly (the stub model of
+    the enhancement service). The output is clipped rather than normalised,
+    since the peak of the whole file is not known while writing.
+    """
+    try:
+        print(f"Processing audio file (streaming): {audio_path}")
+        with wave.open(audio_path, 'rb') as reader:
+            sample_rate = reader.getframerate()
+        if sample_rate != model.sample_rate:
+            # Resampling needs the whole signal; such files go through the regular path
+            print(f"Sample rate {sample_rate} != {model.sample_rate}, enhancing the whole file instead")
+            enhanced_waveform = enhance_audio(model, device, audio_path)
+            return save_enhanced_audio(enhanced_waveform, audio_path, info, model.sample_rate)
+
+        process = model if device is None else model_block_processor(model, device)
+        output_path = enhanced_output_path(audio_path, info)
+        print("Enhancing audio...")
+        enhance_stream(process, audio_path, output_path, window_seconds, hop_seconds, progress)
+        print(f"Enhanced audio saved to: {output_path}")
+        save_enhancement_info(output_path, info)
+        record_enhancement(audio_path, output_path, info)
+        return output_path
+
+    except Exception as e:
+        logger.error(f"Error in streaming enhancement: {str(e)}")
+        print(f"ERROR: Streaming enhancement failed: {str(e)}")
+        raise
+
+def write_test_wav(path, seconds, sample_rate=16000, chunk_seconds=10):
+    """Noisy tone written in chunks, so long test files never sit in memory"""
+    rng = np.random.default_rng(0)
+    with wave.open(path, 'wb') as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(sample_rate)
+        total = int(seconds * sample_rate)
+        for start in range(0, total, chunk_seconds * sample_rate):
+            t = np.arange(start, min(start + chunk_seconds * sample_rate, total)) / sample_rate
+            write_wav_frames(writer, 0.3 * np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(t.size))
+
+def _benchmark_case(mode, audio_path, output_path, window_seconds, hop_seconds, results):
+    """One benchmark run in a fresh process, so the peak RSS belongs to this run alone"""
+    from enhancement_service import StubModel, read_wav, write_wav
+    from process_memory import rss_bytes, peak_rss_bytes
+    model = StubModel(load_seconds=0)
+    baseline = rss_bytes()
+    started = time.perf_counter()
+    if mode == 'streaming':
+        enhance_stream(model, audio_path, output_path, window_seconds, hop_seconds)
+    else:
+        samples, rate = read_wav(audio_path)
+        write_wav(output_path, model(samples), rate)
+    results.put({'seconds': time.perf_counter() - started, 'baseline': baseline, 'peak': peak_rss_bytes()})
+
+def benchmark_streaming(durations=(30, 120, 600, 1800), window_seconds=WINDOW_SECONDS, hop_seconds=HOP_SECONDS):
+    """Peak RSS and real-time factor of whole-file vs streaming enhancement against input length (stub model)"""
+    import tempfile
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+    print(f"Stub model, window {window_seconds} s, hop {hop_seconds} s; RTF = processing time / audio duration")
+    print(f"{'audio':>8} {'mode':>10} {'time':>8} {'RTF':>8} {'peak RSS':>10} {'growth':>9}")
+    growth = {}
+    with tempfile.TemporaryDirectory(prefix="enhance_benchmark_") as directory:
+        for seconds in durations:
+            audio_path = os.path.join(directory, f"audio_{seconds}.wav")
+            write_test_wav(audio_path, seconds)
+            for mode in ('whole', 'streaming'):
+                results = context.Queue()
+                output_path = os.path.join(directory, f"{mode}_{seconds}.wav")
+                worker = context.Process(target=_benchmark_case, args=(
+                    mode, audio_path, output_path, window_seconds, hop_seconds, results))
+                worker.start()
+                result = results.get(timeout=600)
+                worker.join()
+                growth[seconds, mode] = (result['peak'] - result['baseline']) / 2**20
+                print(f"{seconds:>7}s {mode:>10} {result['seconds']:>7.2f}s {result['seconds'] / seconds:>8.4f} "
+                      f"{result['peak'] / 2**20:>8.0f}MB {growth[seconds, mode]:>7.1f}MB")
+
+            with wave.open(os.path.join(directory, f"whole_{seconds}.wav"), 'rb') as whole, \
+                    wave.open(os.path.join(directory, f"streaming_{seconds}.wav"), 'rb') as streamed:
+                lengths_match = whole.getnframes() == streamed.getnframes()
+                if seconds == durations[0]:
+                    difference = np.abs(read_wav_frames(whole, whole.getnframes()) -
+                                        read_wav_frames(streamed, streamed.getnframes())).max()
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            if not lengths_match:
+                print(f"  output length mismatch at {seconds} s")
+                return False
+
+    # Streaming memory must not follow the input length
+    streaming = [growth[seconds, 'streaming'] for seconds in durations]
+    bounded = max(streaming) - min(streaming) < 16
+    print(f"Max |whole - streaming| on the {durations[0]} s file: {difference:.5f}; streaming peak growth "
+          f"{min(streaming):.1f}-{max(streaming):.1f} MB over {durations[0]}-{durations[-1]} s of audio")
+    ok = bounded and difference < 0.01
+    print("OK" if ok else "MISMATCH")
+    return ok
+
+def enhance_latest_recording(recording_dir, streaming=False, window_seconds=WINDOW_SECONDS,
+                             hop_seconds=HOP_SECONDS):
     """Main function to enhance the latest recorded audio file"""
     try:
         setup_paths()
@@ -160,14 +385,23 @@ def enhance_latest_recording(recording_dir):
         if info:
             print(f"Enhancement mode: {info['mode']} (code: {info['mode_code']})")
         
-        # Load the model
-        model, device = load_denoiser_model()
-        
-        # Enhance the audio
-        enhanced_waveform = enhance_audio(model, device, audio_path)
+        # Load the model of the recording's mode; without a decision, the light audio-only model
+        from model_registry import ModelRegistry, recording_mode
+        mode_code = recording_mode(info)
+        warm = ModelRegistry(prefetch=False).get(mode_code)
+        if warm is None:
+            return save_passthrough(audio_path, info), info
+        model, device = warm.model, warm.device
         
-        # Save the enhanced audio
-        output_path = save_enhanced_audio(enhanced_waveform, audio_path, info, model.sample_rate)
+        if streaming:
+            # Window by window, written as it goes: bounded memory for long recordings
+            output_path = enhance_audio_streaming(model, device, audio_path, info, window_seconds, hop_seconds)
+        else:
+            # Enhance the audio
+            enhanced_waveform = enhance_audio(model, device, audio_path)
+            
+            # Save the enhanced audio
+            output_path = save_enhanced_audio(enhanced_waveform, audio_path, info, model.sample_rate)
         
         print(f"Audio enhancement completed successfully!")
         return output_path, info
@@ -177,19 +411,316 @@ def enhance_latest_recording(recording_dir):
         print(f"ERROR: Enhancement process failed: {str(e)}")
         return None
 
+def record_enhancement(audio_path, output_path, info):
+    """Mark the recording as enhanced in the recording index, if its directory has one"""
+    from recording_index import open_index
+    try:
+        index = open_index(os.path.dirname(os.path.abspath(audio_path)))
+        if index is not None:
+            index.mark_enhanced(audio_path, output_path, info['mode_code'] if info else None)
+            index.close()
+    except Exception as e:
+        # The enhanced file is written; a stale index entry only means it is offered again
+        logger.error(f"Error updating the recording index: {str(e)}")
+
+def find_unprocessed_recordings(recording_dir):
+    """Recordings without an enhanced output in OUTPUT_DIR, shortest first
+
+    With a recording index this is one indexed query; otherwise any
+    <orig>_enhanced_mode*.wav counts as done, whatever mode it was made with.
+    """
+    from recording_index import open_index
+    index = open_index(recording_dir)
+    if index is not None:
+        try:
+            rows = index.unenhanced(limit=-1)
+            skipped = index.count(enhanced=True)
+        finally:
+            index.close()
+        recordings = [{'audio_path': row['audio_path'], 'info': json.loads(row['info'] or '{}') or None,
+                       'duration': row['duration'] or 0.0}
+                      for row in rows if row['audio_path'] and os.path.exists(row['audio_path'])]
+        recordings.sort(key=lambda r: r['duration'])
+        return recordings, skipped
+
+    done = set()
+    if os.path.isdir(OUTPUT_DIR):
+        for name in os.listdir(OUTPUT_DIR):
+            if "_enhanced_mode" in name and name.endswith(".wav"):
+                done.add(name[:name.index("_enhanced_mode")])
+    recordings = []
+    skipped = 0
+    for audio_path in glob.glob(os.path.join(recording_dir, "audio_*.wav")):
+        if os.path.basename(audio_path)[:-len(".wav")] in done:
+            skipped += 1
+            continue
+        try:
+            with wave.open(audio_path, 'rb') as reader:
+                duration = reader.getnframes() / reader.getframerate()
+        except (wave.Error, EOFError, OSError) as e:
+            # Still being written, or not a PCM WAV
+            print(f"WARNING: Skipping {audio_path}: {str(e)}")
+            continue
+        recordings.append({'audio_path': audio_path, 'info': load_recording_info(audio_path), 'duration': duration})
+    recordings.sort(key=lambda r: r['duration'])
+    return recordings, skipped
+
+def bucket_recordings(recordings, registry, batch_size=8, length_ratio=1.25):
+    """Group recordings by model, then into batches of similar length (longest at most length_ratio x shortest)"""
+    from model_registry import recording_mode
+    for recording in recordings:
+        recording['mode_code'] = recording_mode(recording['info'])
+        recording['model'] = registry.resolve(recording['mode_code'])
+    ordered = sorted(recordings, key=lambda r: (r['model'] or "", r['duration']))
+    buckets = []
+    for recording in ordered:
+        bucket = buckets[-1] if buckets else None
+        if (bucket is None or bucket[0]['model'] != recording['model'] or len(bucket) >= batch_size
+                or recording['duration'] > bucket[0]['duration'] * length_ratio):
+            buckets.append([recording])
+        else:
+            bucket.append(recording)
+    return buckets
+
+def load_audio(audio_path, sample_rate):
+    """Decode to mono float32 at the model's sample rate"""
+    from enhancement_service import read_wav
+    samples, rate = read_wav(audio_path)
+    if rate != sample_rate:
+        if torchaudio is not None:
+            samples = torchaudio.functional.resample(torch.from_numpy(samples), rate, sample_rate).numpy()
+        else:
+            positions = np.arange(int(len(samples) * sample_rate / rate)) * rate / sample_rate
+            samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+def enhance_batch_arrays(warm, arrays):
+    """Enhance a batch of signals with one model call per group of equal length
+
+    Signals are never zero-padded to a common length: Demucs divides each
+    input by its standard deviation, so padding would change what the model
+    sees and the output would differ from enhancing the file on its own.
+    """
+    if warm.device is None:
+        # numpy models (stub, fakes) take one signal at a time
+        return [np.asarray(warm.model(samples), dtype=np.float32) for samples in arrays]
+    groups = {}
+    for index, samples in enumerate(arrays):
+        groups.setdefault(len(samples), []).append(index)
+    outputs = [None] * len(arrays)
+    for length, indices in groups.items():
+        batch = np.stack([np.asarray(arrays[index], dtype=np.float32) for index in indices])[:, None, :]
+        with torch_thread_lock, torch.no_grad():
+            enhanced = warm.model(torch.from_numpy(batch).to(warm.device)).cpu().numpy()
+        for row, index in enumerate(indices):
+            outputs[index] = enhanced[row].reshape(-1)[:length]
+    return outputs
+
+def batch_mismatch(warm, arrays):
+    """Largest difference between enhancing arrays as one batch and one by one"""
+    batched = enhance_batch_arrays(warm, arrays)
+    alone = [enhance_batch_arrays(warm, [samples])[0] for samples in arrays]
+    return max(float(np.abs(b - a).max(initial=0)) if len(b) == len(a) else float('inf')
+               for b, a in zip(batched, alone))
+
+def save_batch_output(samples, recording, sample_rate):
+    from enhancement_service import write_wav
+    output_path = enhanced_output_path(recording['audio_path'], recording['info'])
+    # Same normalisation as save_enhanced_audio
+    write_wav(output_path, samples / max(float(np.abs(samples).max(initial=0)), 1.0), sample_rate)
+    save_enhancement_info(output_path, recording['info'])
+    record_enhancement(recording['audio_path'], output_path, recording['info'])
+    return output_path
+
+def enhance_batch(recording_dir, registry=None, io_workers=4, batch_size=8, length_ratio=1.25, lookahead=2):
+    """Enhance every unprocessed recording in recording_dir with warm models
+
+    Decoding and saving run on a pool of io_workers threads; the next
+    lookahead batches are decoded while the current one is in the model.
+    Returns a summary with the throughput in audio-seconds per wall-second.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from model_registry import ModelRegistry
+
+    setup_paths()
+    started = time.perf_counter()
+    registry = registry or ModelRegistry(prefetch=False)
+    recordings, skipped = find_unprocessed_recordings(recording_dir)
+    buckets = bucket_recordings(recordings, registry, batch_size, length_ratio)
+    print(f"{len(recordings)} recordings to enhance ({sum(r['duration'] for r in recordings):.1f} s of audio) "
+          f"in {len(buckets)} batches; {skipped} already enhanced")
+
+    summary = {'enhanced': 0, 'failed': 0, 'skipped': skipped, 'audio_seconds': 0.0,
+               'inference_seconds': 0.0, 'io_wait_seconds': 0.0, 'outputs': []}
+    with ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="enhance-io") as pool:
+        pending = iter(buckets)
+        loading = []
+        saving = []
+
+        def schedule():
+            while len(loading) <= lookahead:
+                bucket = next(pending, None)
+                if bucket is None:
+                    return
+                warm = registry.get(bucket[0]['mode_code'])
+                if warm is None:
+                    loads = [pool.submit(save_passthrough, r['audio_path'], r['info']) for r in bucket]
+                else:
+                    loads = [pool.submit(load_audio, r['audio_path'], warm.model.sample_rate) for r in bucket]
+                loading.append((bucket, warm, loads))
+
+        schedule()
+        while loading:
+            bucket, warm, loads = loading.pop(0)
+            schedule()
+            if warm is None:
+                saving.extend(zip(bucket, loads))
+                continue
+            waited = time.perf_counter()
+            arrays, ready = [], []
+            for recording, load in zip(bucket, loads):
+                try:
+                    arrays.append(load.result())
+                    ready.append(recording)
+                except Exception as e:
+                    logger.error(f"Error reading {recording['audio_path']}: {str(e)}")
+                    print(f"ERROR: Failed to read {recording['audio_path']}: {str(e)}")
+                    summary['failed'] += 1
+            summary['io_wait_seconds'] += time.perf_counter() - waited
+            if not arrays:
+                continue
+            inference = time.perf_counter()
+            outputs = enhance_batch_arrays(warm, arrays)
+            summary['inference_seconds'] += time.perf_counter() - inference
+            for recording, enhanced in zip(ready, outputs):
+                saving.append((recording, pool.submit(save_batch_output, enhanced, recording, warm.model.sample_rate)))
+            print(f"  {warm.name}: batch of {len(arrays)}, {bucket[0]['duration']:.1f}-{bucket[-1]['duration']:.1f} s")
+
+        for recording, save in saving:
+            try:
+                summary['outputs'].append(save.result())
+                summary['enhanced'] += 1
+                summary['audio_seconds'] += recording['duration']
+            except Exception as e:
+                logger.error(f"Error saving {recording['audio_path']}: {str(e)}")
+                print(f"ERROR: Failed to save {recording['audio_path']}: {str(e)}")
+                summary['failed'] += 1
+
+    summary['wall_seconds'] = time.perf_counter() - started
+    summary['throughput'] = summary['audio_seconds'] / summary['wall_seconds']
+    print(f"Enhanced {summary['enhanced']} recordings ({summary['audio_seconds']:.1f} s of audio) in "
+          f"{summary['wall_seconds']:.2f} s: {summary['throughput']:.1f} audio-seconds per wall-second; "
+          f"inference {summary['inference_seconds']:.2f} s, waiting for I/O {summary['io_wait_seconds']:.2f} s; "
+          f"{summary['failed']} failed, {summary['skipped']} skipped")
+    return summary
+
+def benchmark_batch(count=40, load_seconds=1.0, io_workers=4):
+    """One process and model load per file (the old way) against enhance_batch, with the stub model"""
+    import tempfile
+    from enhancement_service import StubModel
+    from model_registry import ModelRegistry, ModelSpec
+
+    global OUTPUT_DIR
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory(prefix="enhance_batch_") as directory:
+        recording_dir = os.path.join(directory, "recording")
+        os.makedirs(recording_dir)
+        for index in range(count):
+            seconds = float(rng.choice([3, 3, 3, 10, 30, 60]))
+            write_test_wav(os.path.join(recording_dir, f"audio_20250101_{index:06d}.wav"), seconds)
+            with open(os.path.join(recording_dir, f"info_20250101_{index:06d}.json"), 'w') as f:
+                json.dump({'mode': "Audio-Only Enhancement Mode", 'mode_code': int(rng.choice([0, 1, 2]))}, f)
+
+        def registry():
+            # DNS-48 / DNS-64 replaced by the stub, each with its load time
+            return ModelRegistry([ModelSpec(name, lambda: (StubModel(load_seconds), None), 150)
+                                  for name in ('dns48', 'dns64')], prefetch=False, log=lambda message: None)
+
+        # Old way: a fresh model per file, everything sequential (launching the process not counted)
+        OUTPUT_DIR = os.path.join(directory, "sequential")
+        os.makedirs(OUTPUT_DIR)
+        recordings, _ = find_unprocessed_recordings(recording_dir)
+        sampled = recordings[::5]
+        started = time.perf_counter()
+        for recording in sampled:
+            warm = registry().get(recording['info']['mode_code'])
+            if warm is None:
+                save_passthrough(recording['audio_path'], recording['info'])
+                continue
+            samples = load_audio(recording['audio_path'], warm.model.sample_rate)
+            save_batch_output(warm.model(samples), recording, warm.model.sample_rate)
+        sequential = sum(r['duration'] for r in sampled) / (time.perf_counter() - started)
+
+        OUTPUT_DIR = os.path.join(directory, "after_process")
+        batch = enhance_batch(recording_dir, registry(), io_workers=io_workers)
+        again = enhance_batch(recording_dir, registry(), io_workers=io_workers)
+
+    print(f"Sequential, one model load per file: {sequential:.1f} audio-seconds per wall-second "
+          f"({len(sampled)} of the files); batch: {batch['throughput']:.1f}")
+
+    # Batched output must equal per-file output; the torch path is checked with a model that
+    # normalises each input by its standard deviation, as Demucs does
+    mismatch = 0.0
+    if torch is not None:
+        from model_registry import WarmModel
+
+        class NormalisingModel(torch.nn.Module):
+            sample_rate = 16000
+
+            def forward(self, x):
+                std = x.std(dim=-1, keepdim=True)
+                return torch.tanh(x / (1e-3 + std)) * std
+
+        signals = [rng.standard_normal(n).astype(np.float32) * scale
+                   for n, scale in ((16000, 0.1), (16000, 0.5), (20000, 0.2), (16000, 0.3))]
+        mismatch = batch_mismatch(WarmModel('normalising', NormalisingModel(), torch.device('cpu')), signals)
+        print(f"Batched against per-file output: max difference {mismatch:.2e}")
+    else:
+        print("Batched against per-file output: torch path skipped (PyTorch not installed)")
+    ok = batch['enhanced'] == count and again['enhanced'] == 0 and again['skipped'] == count \
+        and batch['throughput'] > sequential and mismatch < 1e-5
+    print("OK" if ok else "MISMATCH")
+    return ok
+
 if __name__ == "__main__":
+    configure_error_log()
     # Use a try/except block to catch and report any errors
+    parser = argparse.ArgumentParser(description="Enhance the latest recording, or all unprocessed ones")
+    parser.add_argument("recording_dir", nargs="?", default=os.path.join(os.getcwd(), "recording"))
+    parser.add_argument("--streaming", action="store_true",
+                        help="enhance window by window with bounded memory")
+    parser.add_argument("--window", type=float, default=WINDOW_SECONDS, help="streaming window in seconds")
+    parser.add_argument("--hop", type=float, default=HOP_SECONDS, help="streaming hop in seconds")
+    parser.add_argument("--benchmark-streaming", action="store_true",
+                        help="compare whole-file and streaming enhancement with the stub model")
+    parser.add_argument("--batch", action="store_true",
+                        help="enhance every recording that has no enhanced output yet")
+    parser.add_argument("--io-workers", type=int, default=4, help="threads decoding and saving in batch mode")
+    parser.add_argument("--batch-size", type=int, default=8, help="recordings per model call in batch mode")
+    parser.add_argument("--benchmark-batch", action="store_true",
+                        help="compare batch mode with one model load per file, with the stub model")
+    args = parser.parse_args()
+    if args.benchmark_streaming:
+        sys.exit(0 if benchmark_streaming(window_seconds=args.window, hop_seconds=args.hop) else 1)
+    if args.benchmark_batch:
+        sys.exit(0 if benchmark_batch(io_workers=args.io_workers) else 1)
+    if args.batch:
+        if torch is not None and hasattr(torch, 'set_num_threads'):
+            torch.set_num_threads(max((os.cpu_count() or 2) - args.io_workers, 1))
+        summary = enhance_batch(args.recording_dir, io_workers=args.io_workers, batch_size=args.batch_size)
+        sys.exit(1 if summary['failed'] else 0)
+
     try:
         print("======= AUDIO ENHANCER =======")
         # If run as a script, look for recordings in the current directory
-        recording_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), "recording")
+        recording_dir = args.recording_dir
         print(f"Looking for recordings in: {recording_dir}")
         
         # Set number of threads for PyTorch to prevent resource contention
-        if hasattr(torch, 'set_num_threads'):
+        if torch is not None and hasattr(torch, 'set_num_threads'):
             torch.set_num_threads(1)
         
-        result = enhance_latest_recording(recording_dir)
+        result = enhance_latest_recording(recording_dir, args.streaming, args.window, args.hop)
         
         if result:
             output_path, info = result
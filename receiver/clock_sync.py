@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+NTP-style clock offset, drift and RTT estimation over the timestamp port
+
+Each binary timestamp exchange yields four times: client send (t1), sender
+receive (t2), sender send (t3) and client receive (t4). From these
+
+    offset = ((t2 - t1) + (t3 - t4)) / 2     sender clock minus local clock
+    rtt    = (t4 - t1) - (t3 - t2)           network round trip
+
+Queueing delay only ever adds to the RTT and skews the offset of that one
+exchange, so the estimator trusts the lowest-RTT samples in a sliding
+window and fits a line through them to track drift between the clocks.
+"""
+
+import sys
+import time
+import socket
+import threading
+from collections import deque, namedtuple
+import timestamp_protocol
+
+# One binary timestamp exchange; all times in epoch nanoseconds
+TimestampExchange = namedtuple('TimestampExchange', ['status', 'frame_id', 'frame_ns', 't1', 't2', 't3', 't4'])
+
+
+def exchange(sock, addr, version=timestamp_protocol.VERSION, frame_id=timestamp_protocol.LATEST_FRAME):
+    """Send one FRAME_REQUEST and wait for its reply on a socket with a timeout set
+
+    Replies to earlier requests (identified by the echoed client time) are
+    skipped. Raises socket.timeout when no matching reply arrives.
+    """
+    t1 = time.time_ns()
+    sock.sendto(timestamp_protocol.pack_frame_request(frame_id, t1, version=version), addr)
+    while True:
+        data, _ = sock.recvfrom(1024)
+        t4 = time.time_ns()
+        if not timestamp_protocol.is_binary(data):
+            continue
+        try:
+            _, msg_type, fields = timestamp_protocol.unpack(data)
+        except ValueError:
+            continue
+        if msg_type != timestamp_protocol.MSG_FRAME_RESPONSE:
+            continue
+        status, reply_frame_id, frame_ns, echoed_ns, t2, t3 = fields
+        if echoed_ns != t1:
+            # Late reply to an earlier request that already timed out
+            continue
+        return TimestampExchange(status, reply_frame_id, frame_ns, t1, t2, t3, t4)
+
+
+class ClockSync:
+    """Sliding-window min-RTT clock offset and drift estimator (thread-safe)"""
+
+    def __init__(self, window=64, best_fraction=0.25, max_age=300.0):
+        """
+        Args:
+            window: number of recent exchanges kept
+            best_fraction: share of lowest-RTT samples used for the drift fit
+            max_age: seconds after which samples are discarded
+        """
+        self.samples = deque(maxlen=window)
+        self.best_fraction = best_fraction
+        self.max_age_ns = int(max_age * 1e9)
+        self.lock = threading.Lock()
+
+        self.offset_ns = None       # offset at reference_ns
+        self.drift = 0.0            # d(offset)/d(local time), dimensionless (1e-6 = 1 ppm)
+        self.reference_ns = 0
+        self.min_rtt_ns = None
+
+    def add(self, sample):
+        """Feed one TimestampExchange (or any object with t1..t4)"""
+        offset = ((sample.t2 - sample.t1) + (sample.t3 - sample.t4)) / 2
+        rtt = (sample.t4 - sample.t1) - (sample.t3 - sample.t2)
+        if rtt < 0:
+            # Only possible with a broken server clock; ignore the sample
+            return
+        with self.lock:
+            self.samples.append((sample.t4, offset, rtt))
+            while self.samples and sample.t4 - self.samples[0][0] > self.max_age_ns:
+                self.samples.popleft()
+            self._update()
+
+    def _update(self):
+        best = min(self.samples, key=lambda s: s[2])
+        self.min_rtt_ns = best[2]
+
+        # Least-squares line through the lowest-RTT samples for drift
+        count = max(2, int(len(self.samples) * self.best_fraction))
+        chosen = sorted(self.samples, key=lambda s: s[2])[:count]
+        if len(chosen) >= 2:
+            t0 = chosen[0][0]
+            xs = [s[0] - t0 for s in chosen]
+            ys = [s[1] for s in chosen]
+            mean_x = sum(xs) / len(xs)
+            mean_y = sum(ys) / len(ys)
+            var_x = sum((x - mean_x) ** 2 for x in xs)
+            if var_x > 0:
+                self.drift = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+                self.offset_ns = mean_y
+                self.reference_ns = t0 + mean_x
+                return
+
+        self.drift = 0.0
+        self.offset_ns = best[1]
+        self.reference_ns = best[0]
+
+    @property
+    def synchronized(self):
+        return self.offset_ns is not None
+
+    def offset_at(self, local_ns=None):
+        """Estimated sender-minus-local offset in ns at the given local time"""
+        with self.lock:
+            if self.offset_ns is None:
+                return 0.0
+            local_ns = time.time_ns() if local_ns is None else local_ns
+            return self.offset_ns + self.drift * (local_ns - self.reference_ns)
+
+    def to_local_ns(self, sender_ns, local_hint_ns=None):
+        """Convert a sender clock time to the local clock"""
+        return sender_ns - self.offset_at(local_hint_ns)
+
+    def one_way_latency_ms(self, sender_ns, local_ns=None):
+        """Latency from a sender timestamp to local_ns (default: now), corrected for clock offset"""
+        local_ns = time.time_ns() if local_ns is None else local_ns
+        return (local_ns - self.to_local_ns(sender_ns, local_ns)) / 1e6
+
+
+class SkewedSender:
+    """Localhost stand-in for the sender's timestamp service with an offset, drifting clock"""
+
+    def __init__(self, port, offset_s=3.5, drift_ppm=200.0, max_delay_s=0.004):
+        import random
+        self.random = random.Random(0)
+        self.offset_ns = int(offset_s * 1e9)
+        self.drift = drift_ppm * 1e-6
+        self.max_delay_s = max_delay_s
+        self.start_ns = time.time_ns()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        self.sock.settimeout(0.5)
+        self.running = True
+
+    def clock_ns(self, local_ns=None):
+        local_ns = time.time_ns() if local_ns is None else local_ns
+        return local_ns + self.offset_ns + int(self.drift * (local_ns - self.start_ns))
+
+    def serve(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            t2 = self.clock_ns()
+            if not timestamp_protocol.is_binary(data):
+                # Legacy text commands are not answered, as by a sender that is not running
+                continue
+            version, msg_type, fields = timestamp_protocol.unpack(data)
+            if msg_type == timestamp_protocol.MSG_HELLO:
+                self.sock.sendto(timestamp_protocol.pack_hello_ack(timestamp_protocol.negotiate(version)), addr)
+                continue
+            # Random queueing delay on the way in, before the reply is stamped
+            time.sleep(self.random.uniform(0, self.max_delay_s))
+            frame_id, t1 = fields
+            frame_ns = self.clock_ns() - 20_000_000   # pretend the frame was captured 20 ms ago
+            reply = timestamp_protocol.pack_frame_response(
+                timestamp_protocol.STATUS_OK, 1, frame_ns, t1, t2, self.clock_ns(), version=version)
+            # ...and on the way out, after it was stamped
+            time.sleep(self.random.uniform(0, self.max_delay_s))
+            self.sock.sendto(reply, addr)
+
+
+def demo(duration=10.0, port=15122):
+    """Estimate the offset of a skewed stand-in sender and compare with the truth"""
+    sender = SkewedSender(port)
+    threading.Thread(target=sender.serve, daemon=True).start()
+
+    sync = ClockSync()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1.0)
+    started = time.time()
+    try:
+        while time.time() - started < duration:
+            sample = exchange(sock, ('127.0.0.1', port))
+            sync.add(sample)
+            naive_ms = (sample.t4 - sample.frame_ns) / 1e6
+            time.sleep(0.1)
+
+        now = time.time_ns()
+        true_offset = sender.clock_ns(now) - now
+        estimated = sync.offset_at(now)
+        print(f"True offset:      {true_offset / 1e6:10.3f} ms (drift {sender.drift * 1e6:.0f} ppm)")
+        print(f"Estimated offset: {estimated / 1e6:10.3f} ms (drift {sync.drift * 1e6:.0f} ppm), "
+              f"error {abs(estimated - true_offset) / 1e6:.3f} ms, min RTT {sync.min_rtt_ns / 1e6:.3f} ms")
+        print(f"Frame latency: naive {naive_ms:.1f} ms, corrected "
+              f"{sync.one_way_latency_ms(sample.frame_ns, sample.t4):.1f} ms (true >= 20 ms)")
+    finally:
+        sender.running = False
+        sock.close()
+
+
+if __name__ == "__main__":
+    demo(float(sys.argv[1]) if len(sys.argv) > 1 else 10.0)
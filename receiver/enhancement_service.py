@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Long-lived enhancement worker process with a warm model
+
+"Enhance Audio" used to run python audio_enhancer.py for every click, so
+every run paid for importing torch/torchaudio and rebuilding DNS-48 before
+a few seconds of inference. EnhancementService starts one worker process
+that loads the model once and then takes jobs over a multiprocessing pipe.
+The protocol is plain dicts:
+
+    client -> worker  {'op': 'enhance', 'job', 'recording_dir' | 'audio_path', 'info'}
+                      {'op': 'ping'}, {'op': 'shutdown'}
+    worker -> client  {'event': 'ready', 'pid', 'backend', 'load_seconds', 'rss'}
+                      {'event': 'progress', 'job', 'stage', 'fraction', 'message'}
+                      {'event': 'result', 'job', 'audio_path', 'output_path', 'info', 'seconds', 'rss', 'recycle'}
+                      {'event': 'error', 'job', 'error', 'recycle'}
+                      {'event': 'pong', 'rss'}
+
+One job is in flight at a time; submit() queues the rest and returns a
+concurrent.futures.Future. After a job the worker compares its RSS with the
+level right after loading the model; if it grew by more than
+max_rss_growth_mb (or after max_jobs jobs) it says so in the job's reply
+('recycle' is the reason) and exits, and the client starts a fresh worker
+before sending the next job.
+A worker that dies is restarted the same way and its job fails.
+
+The 'stub' backend replaces DNS-48 with a fixed filter that has a
+configurable load time and per-job memory leak, so the service can be
+exercised on a CPU-only machine without PyTorch:
+    python enhancement_service.py
+"""
+
+import os
+import sys
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+from process_memory import rss_bytes
+
+
+def read_wav(path):
+    """Mono float32 samples in [-1, 1] and the sample rate of a 16-bit PCM WAV"""
+    import wave
+    import numpy as np
+    with wave.open(path, 'rb') as f:
+        channels, rate = f.getnchannels(), f.getframerate()
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2').astype(np.float32) / 32768.0
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def write_wav(path, samples, sample_rate):
+    import wave
+    import numpy as np
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+class StubModel:
+    """Stand-in for DNS-48: a 3-tap smoothing filter with a simulated load time"""
+
+    sample_rate = 16000
+
+    def __init__(self, load_seconds=2.0):
+        time.sleep(load_seconds)
+
+    def __call__(self, samples):
+        import numpy as np
+        return np.convolve(samples, np.ones(3, dtype=np.float32) / 3, mode='same')
+
+
+class StubBackend:
+    name = 'stub'
+
+    def __init__(self, load_seconds=2.0, leak_mb=0, window_seconds=0.5, hop_seconds=0.4):
+        """
+        Args:
+            leak_mb: memory kept after every job, to exercise recycling
+        """
+        import audio_enhancer
+        self.enhancer = audio_enhancer
+        audio_enhancer.setup_paths()
+        self.model = StubModel(load_seconds)
+        self.window_seconds = window_seconds
+        self.hop_seconds = hop_seconds
+        self.leak_mb = leak_mb
+        self.leaked = []
+
+    def enhance_file(self, audio_path, info, progress):
+        import numpy as np
+        if self.leak_mb:
+            # Touch the pages so the leak shows up in the RSS
+            self.leaked.append(np.ones(self.leak_mb << 20, dtype=np.uint8))
+        return self.enhancer.enhance_audio_streaming(
+            self.model, None, audio_path, info, self.window_seconds, self.hop_seconds,
+            lambda fraction: progress('enhancing', fraction))
+
+
+class DenoiserBackend:
+    name = 'dns48'
+
+    def __init__(self, streaming=False, window_seconds=None, hop_seconds=None):
+        """
+        Args:
+            streaming: enhance window by window (audio_enhancer.enhance_audio_streaming)
+        """
+        import audio_enhancer
+        self.enhancer = audio_enhancer
+        audio_enhancer.setup_paths()
+        if audio_enhancer.torch is not None and hasattr(audio_enhancer.torch, 'set_num_threads'):
+            audio_enhancer.torch.set_num_threads(1)
+        self.model, self.device = audio_enhancer.load_denoiser_model()
+        self.streaming = streaming
+        self.window_seconds = window_seconds or audio_enhancer.WINDOW_SECONDS
+        self.hop_seconds = hop_seconds or audio_enhancer.HOP_SECONDS
+
+    def enhance_file(self, audio_path, info, progress):
+        progress('enhancing', 0.0)
+        if self.streaming:
+            return self.enhancer.enhance_audio_streaming(
+                self.model, self.device, audio_path, info, self.window_seconds, self.hop_seconds,
+                lambda fraction: progress('enhancing', fraction))
+        enhanced_waveform = self.enhancer.enhance_audio(self.model, self.device, audio_path)
+        progress('saving', 0.9)
+        return self.enhancer.save_enhanced_audio(enhanced_waveform, audio_path, info, self.model.sample_rate)
+
+
+class RegistryBackend:
+    """Picks the model from the recording's mode_code through a ModelRegistry of warm models"""
+
+    name = 'registry'
+
+    def __init__(self, memory_budget_mb=600, streaming=False, window_seconds=None, hop_seconds=None, specs=None):
+        import audio_enhancer
+        from model_registry import ModelRegistry, recording_mode
+        self.recording_mode = recording_mode
+        self.enhancer = audio_enhancer
+        audio_enhancer.setup_paths()
+        if audio_enhancer.torch is not None and hasattr(audio_enhancer.torch, 'set_num_threads'):
+            audio_enhancer.torch.set_num_threads(1)
+        self.registry = ModelRegistry(specs, memory_budget_mb=memory_budget_mb, prefetch=False)
+        # Warm the light audio-only model, used for recordings without an info file
+        if self.registry.get(1) is None:
+            raise RuntimeError("no enhancement model could be loaded")
+        self.streaming = streaming
+        self.window_seconds = window_seconds or audio_enhancer.WINDOW_SECONDS
+        self.hop_seconds = hop_seconds or audio_enhancer.HOP_SECONDS
+
+    def enhance_file(self, audio_path, info, progress):
+        mode_code = self.recording_mode(info)
+        progress('loading', 0.0, f"Model for mode {mode_code}")
+        warm = self.registry.get(mode_code)
+        if warm is None:
+            return self.enhancer.save_passthrough(audio_path, info)
+        progress('enhancing', 0.0, f"{warm.name} for mode {mode_code}")
+        if self.streaming or warm.device is None:
+            return self.enhancer.enhance_audio_streaming(
+                warm.model, warm.device, audio_path, info, self.window_seconds, self.hop_seconds,
+                lambda fraction: progress('enhancing', fraction))
+        enhanced_waveform = self.enhancer.enhance_audio(warm.model, warm.device, audio_path)
+        progress('saving', 0.9)
+        return self.enhancer.save_enhanced_audio(enhanced_waveform, audio_path, info, warm.model.sample_rate)
+
+
+BACKENDS = {'dns48': DenoiserBackend, 'registry': RegistryBackend, 'stub': StubBackend}
+
+
+def serve(conn, backend='dns48', backend_options=None, max_rss_growth_mb=1024, max_jobs=0):
+    """Worker process main loop"""
+    import audio_enhancer
+    audio_enhancer.configure_error_log()
+    started = time.perf_counter()
+    try:
+        model = BACKENDS[backend](**(backend_options or {}))
+    except Exception as e:
+        conn.send({'event': 'error', 'job': None, 'error': f"model load failed: {str(e)}"})
+        conn.close()
+        return
+    baseline = rss_bytes()
+    conn.send({'event': 'ready', 'pid': os.getpid(), 'backend': backend,
+               'load_seconds': time.perf_counter() - started, 'rss': baseline})
+
+    jobs = 0
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        op = request.get('op')
+        if op == 'shutdown':
+            break
+        if op == 'ping':
+            conn.send({'event': 'pong', 'rss': rss_bytes()})
+            continue
+        job = request.get('job')
+        if op != 'enhance':
+            conn.send({'event': 'error', 'job': job, 'error': f"unknown op {op!r}"})
+            continue
+
+        def progress(stage, fraction, message=""):
+            conn.send({'event': 'progress', 'job': job, 'stage': stage, 'fraction': fraction, 'message': message})
+
+        job_started = time.perf_counter()
+        try:
+            audio_path, info = request.get('audio_path'), request.get('info')
+            if not audio_path:
+                audio_path, info = audio_enhancer.get_latest_recording(request['recording_dir'])
+                if not audio_path:
+                    raise FileNotFoundError("No audio recordings found")
+            progress('reading', 0.0, f"Enhancing {os.path.basename(audio_path)}")
+            output_path = model.enhance_file(audio_path, info, progress)
+            reply = {'event': 'result', 'job': job, 'audio_path': audio_path, 'output_path': output_path,
+                     'info': info, 'seconds': time.perf_counter() - job_started}
+        except Exception as e:
+            audio_enhancer.logger.exception(f"Enhancement job {job} failed")
+            reply = {'event': 'error', 'job': job, 'error': str(e)}
+
+        # Decided before replying, so the client never sends another job to a worker that is leaving
+        jobs += 1
+        reply['rss'] = rss_bytes()
+        growth_mb = (reply['rss'] - baseline) / 2**20
+        reply['recycle'] = None
+        if growth_mb > max_rss_growth_mb:
+            reply['recycle'] = f"RSS grew by {growth_mb:.0f} MB"
+        elif max_jobs and jobs >= max_jobs:
+            reply['recycle'] = f"{jobs} jobs done"
+        conn.send(reply)
+        if reply['recycle']:
+            break
+    conn.close()
+
+
+class EnhancementService:
+    def __init__(self, backend='dns48', backend_options=None, max_rss_growth_mb=1024, max_jobs=0, log=print):
+        """
+        Args:
+            backend: 'registry' (model by mode), 'dns48' or 'stub'
+            max_rss_growth_mb: recycle the worker when its RSS grows this much past the loaded model
+            max_jobs: also recycle after this many jobs (0: never)
+        """
+        self.backend = backend
+        self.backend_options = backend_options or {}
+        self.max_rss_growth_mb = max_rss_growth_mb
+        self.max_jobs = max_jobs
+        self.log = log
+        # spawn on every platform, so the worker never inherits the GUI's threads
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+        self.pending = deque()      # (job, request, future, on_progress)
+        self.current = None
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.recycling = False
+        self.running = False
+        self.next_job = 1
+        self.workers_started = 0
+        self.restarts = 0
+        self.worker_info = {}
+
+    def start(self):
+        """Start the worker; the model loads in the background"""
+        with self.lock:
+            self.running = True
+            if self.process is None:
+                self._spawn()
+
+    def _spawn(self):
+        parent, child = self.context.Pipe()
+        self.process = self.context.Process(
+            target=serve, args=(child, self.backend, self.backend_options, self.max_rss_growth_mb, self.max_jobs),
+            name="enhancement-service", daemon=True)
+        self.process.start()
+        child.close()
+        self.conn = parent
+        self.ready = False
+        self.recycling = False
+        self.workers_started += 1
+        threading.Thread(target=self._read, args=(parent, self.process), daemon=True).start()
+
+    def submit(self, recording_dir=None, audio_path=None, info=None, on_progress=None):
+        """Queue a job for the latest recording in recording_dir, or for audio_path; returns a Future
+
+        on_progress(message) and the Future's callbacks run on the service's reader thread.
+        """
+        future = Future()
+        with self.lock:
+            job = self.next_job
+            self.next_job += 1
+            future.job = job
+            request = {'op': 'enhance', 'job': job, 'recording_dir': recording_dir, 'audio_path': audio_path,
+                       'info': info}
+            self.pending.append((job, request, future, on_progress))
+            if self.process is None:
+                self.running = True
+                self._spawn()
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        while self.ready and not self.recycling and self.current is None and self.pending:
+            entry = self.pending.popleft()
+            if not entry[2].set_running_or_notify_cancel():
+                continue
+            self.current = entry
+            self.conn.send(entry[1])
+
+    def _read(self, conn, process):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            self._handle(message)
+        process.join(timeout=5)
+
+        failed = None
+        with self.lock:
+            if conn is not self.conn:
+                return
+            if self.current:
+                failed, self.current = self.current, None
+            if not self.running:
+                self.process = None
+            elif self.worker_info.get('load_error'):
+                # Do not respawn in a loop on a model that cannot load; the next submit() retries
+                self.process = None
+            else:
+                if not self.recycling:
+                    self.restarts += 1
+                    self.log(f"Enhancement worker exited with code {process.exitcode}; restarting")
+                self._spawn()
+        if failed:
+            failed[2].set_exception(RuntimeError(f"enhancement worker exited with code {process.exitcode}"))
+
+    def _handle(self, message):
+        event = message.get('event')
+        if event == 'ready':
+            with self.lock:
+                self.worker_info = message
+                self.ready = True
+                self._dispatch()
+            self.log(f"Enhancement worker {message['pid']} ready: {message['backend']} loaded in "
+                     f"{message['load_seconds']:.1f} s, RSS {message['rss'] / 2**20:.0f} MB")
+        elif event == 'progress':
+            current = self.current
+            if current and current[0] == message['job'] and current[3]:
+                try:
+                    current[3](message)
+                except Exception as e:
+                    self.log(f"Enhancement progress callback error: {str(e)}")
+        elif event in ('result', 'error'):
+            finished = None
+            with self.lock:
+                if message.get('recycle'):
+                    self.recycling = True
+                    self.ready = False
+                if message.get('job') is None:
+                    # Model load failed: nothing can run until the next submit()
+                    self.worker_info = {'load_error': message['error']}
+                    failed = list(self.pending)
+                    self.pending.clear()
+                else:
+                    failed = []
+                    if self.current and self.current[0] == message['job']:
+                        finished, self.current = self.current, None
+            if message.get('recycle'):
+                self.log(f"Recycling enhancement worker: {message['recycle']}")
+            for _, _, future, _ in failed:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(RuntimeError(message['error']))
+            if finished:
+                if event == 'result':
+                    finished[2].set_result(message)
+                else:
+                    finished[2].set_exception(RuntimeError(message['error']))
+            with self.lock:
+                self._dispatch()
+
+    def stop(self, timeout=5):
+        with self.lock:
+            self.running = False
+            process, conn = self.process, self.conn
+            pending = list(self.pending)
+            self.pending.clear()
+        for _, _, future, _ in pending:
+            future.cancel()
+        if process is None:
+            return
+        try:
+            conn.send({'op': 'shutdown'})
+        except (OSError, ValueError):
+            pass
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+
+    def stats(self):
+        return {'workers_started': self.workers_started, 'restarts': self.restarts, 'queued': len(self.pending),
+                'busy': self.current is not None, 'worker': dict(self.worker_info)}
+
+
+def demo(jobs=8, load_seconds=1.5, leak_mb=20, max_rss_growth_mb=100):
+    import tempfile
+    import numpy as np
+
+    directory = tempfile.mkdtemp(prefix="enhancement_service_")
+    os.chdir(directory)
+    recording_dir = os.path.join(directory, "recording")
+    os.makedirs(recording_dir)
+    rng = np.random.default_rng(0)
+    paths = []
+    for index in range(jobs):
+        path = os.path.join(recording_dir, f"audio_20250101_00000{index}.wav")
+        tone = 0.3 * np.sin(2 * np.pi * 440 * np.arange(3 * 16000) / 16000)
+        write_wav(path, tone + 0.05 * rng.standard_normal(tone.size), 16000)
+        paths.append(path)
+
+    def cold(path):
+        """What a click used to cost: a fresh process that loads the model for one job"""
+        service = EnhancementService('stub', {'load_seconds': load_seconds}, log=lambda message: None)
+        started = time.perf_counter()
+        service.submit(audio_path=path).result(timeout=60)
+        elapsed = time.perf_counter() - started
+        service.stop()
+        return elapsed
+
+    cold_seconds = [cold(path) for path in paths[:2]]
+
+    service = EnhancementService('stub', {'load_seconds': load_seconds, 'leak_mb': leak_mb},
+                                 max_rss_growth_mb=max_rss_growth_mb)
+    service.start()
+    service.submit(audio_path=paths[0]).result(timeout=60)
+    warm_seconds = []
+    outputs = []
+    stages = []
+    for path in paths:
+        started = time.perf_counter()
+        result = service.submit(audio_path=path, on_progress=lambda m: stages.append(m['stage'])).result(timeout=60)
+        warm_seconds.append(time.perf_counter() - started)
+        outputs.append(result['output_path'])
+        print(f"  {os.path.basename(path)} -> {os.path.basename(result['output_path'])} in {warm_seconds[-1]:.3f} s "
+              f"(worker RSS {result['rss'] / 2**20:.0f} MB)")
+    stats = service.stats()
+    service.stop()
+
+    print(f"Cold (new process per job): {sum(cold_seconds) / len(cold_seconds):.2f} s/job; warm service: "
+          f"median {sorted(warm_seconds)[len(warm_seconds) // 2]:.3f} s/job, max {max(warm_seconds):.2f} s "
+          f"(includes reloads after recycling); workers started {stats['workers_started']}, "
+          f"crash restarts {stats['restarts']}; progress stages {sorted(set(stages))}")
+    ok = all(os.path.exists(path) for path in outputs) and stats['workers_started'] > 1 and stats['restarts'] == 0
+    print("OK" if ok else "MISMATCH")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if demo() else 1)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Per-frame video latency from the SEI timestamps embedded by the sender
+
+FrameLatencyMonitor joins the video multicast group alongside ffplay, splits
+the H.264 stream into NAL units and reads the frame id / sender time SEI in
+front of every frame (see h264_sei.py). The latency of a frame is its
+arrival time minus the sender time converted to the local clock with
+ClockSync, so it measures encoder output to network arrival on the receiver.
+StreamReceiver feeds handle_datagram() from its StreamSniffer instead of
+letting the monitor open its own socket.
+
+Run against a synthetic stream replayed on localhost:
+    python frame_latency.py --port 15100 --unicast
+    (sender) python video_passthrough.py --synthetic 300 --dest 127.0.0.1:15100
+"""
+
+import sys
+import time
+import socket
+import argparse
+import threading
+from collections import deque
+from h264_sei import NALSplitter, NAL_SEI, nal_type, parse_sei
+
+
+class LatencyHistogram:
+    """Fixed-bin latency histogram plus a window of recent samples"""
+
+    def __init__(self, bin_ms=1.0, max_ms=1000.0, recent=300):
+        self.bin_ms = bin_ms
+        self.max_ms = max_ms
+        self.recent = deque(maxlen=recent)
+        self.reset()
+
+    def reset(self):
+        # The last bin collects everything at or above max_ms
+        self.counts = [0] * (int(self.max_ms / self.bin_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.recent.clear()
+
+    def add(self, latency_ms):
+        index = min(max(int(latency_ms / self.bin_ms), 0), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += latency_ms
+        self.min = latency_ms if self.min is None else min(self.min, latency_ms)
+        self.max = latency_ms if self.max is None else max(self.max, latency_ms)
+        self.recent.append(latency_ms)
+
+    def percentile(self, p):
+        """p-th percentile of all samples, interpolated within its bin"""
+        if not self.count:
+            return 0.0
+        target = p / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                value = (index + (target - seen) / count) * self.bin_ms
+                return min(max(value, self.min), self.max)
+            seen += count
+        return self.max
+
+    def recent_percentile(self, p):
+        """Exact percentile of the recent window"""
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(int(p / 100.0 * len(ordered)), len(ordered) - 1)]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'min': self.min or 0.0,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max or 0.0,
+        }
+
+    def format(self, width=40):
+        """Text rendering of the non-empty bins"""
+        lines = []
+        peak = max(self.counts) or 1
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            low = index * self.bin_ms
+            label = f">= {low:.0f}" if index == len(self.counts) - 1 else f"{low:.0f}-{low + self.bin_ms:.0f}"
+            lines.append(f"{label:>12} ms {count:>7} {'#' * max(1, int(count / peak * width))}")
+        return "\n".join(lines)
+
+
+class FrameLatencyMonitor:
+    def __init__(self, multicast_addr='239.0.0.1', port=5100, clock_sync=None, log=print, multicast=True):
+        """
+        Args:
+            clock_sync: ClockSync used to map sender times to the local clock; None assumes synchronized clocks
+            multicast: False to listen on a plain UDP port (localhost replay)
+        """
+        self.multicast_addr = multicast_addr
+        self.port = port
+        self.clock_sync = clock_sync
+        self.log = log
+        self.multicast = multicast
+        self.histogram = LatencyHistogram()
+        self.splitter = NALSplitter()
+        self.running = False
+        self.thread = None
+        self.frames = 0
+        self.lost_frames = 0
+        self.last_frame_id = None
+        self.last_frame_time = 0
+
+    def handle_datagram(self, data, received_ns):
+        for nal in self.splitter.feed(data):
+            if nal_type(nal) == NAL_SEI:
+                info = parse_sei(nal)
+                if info:
+                    self.handle_frame(info[0], info[1], received_ns)
+
+    def handle_frame(self, frame_id, sender_ns, received_ns):
+        if self.last_frame_id is not None:
+            if frame_id <= self.last_frame_id:
+                # Sender restarted its frame counter
+                self.last_frame_id = None
+            elif frame_id > self.last_frame_id + 1:
+                self.lost_frames += frame_id - self.last_frame_id - 1
+        self.last_frame_id = frame_id
+
+        if self.clock_sync is not None:
+            latency_ms = self.clock_sync.one_way_latency_ms(sender_ns, received_ns)
+        else:
+            latency_ms = (received_ns - sender_ns) / 1e6
+        self.histogram.add(latency_ms)
+        self.frames += 1
+        self.last_frame_time = time.time()
+
+    def fresh(self, max_age=2.0):
+        """True while SEI-tagged frames are arriving"""
+        return time.time() - self.last_frame_time < max_age
+
+    def run(self):
+        sock = None
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            if self.multicast:
+                sock.bind(('', self.port))
+                mreq = socket.inet_aton(self.multicast_addr) + socket.inet_aton('0.0.0.0')
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            else:
+                sock.bind(('127.0.0.1', self.port))
+            sock.settimeout(1.0)
+
+            while self.running:
+                try:
+                    data, _ = sock.recvfrom(65536)
+                except socket.timeout:
+                    continue
+                self.handle_datagram(data, time.time_ns())
+        except Exception as e:
+            self.log(f"Frame latency monitor error: {str(e)}")
+        finally:
+            if sock:
+                sock.close()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-frame latency histogram from SEI frame timestamps")
+    parser.add_argument('--group', default='239.0.0.1')
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--unicast', action='store_true', help="listen on 127.0.0.1 instead of the multicast group")
+    parser.add_argument('--duration', type=float, default=0, help="stop after this many seconds (default: until Ctrl+C)")
+    args = parser.parse_args(argv)
+
+    monitor = FrameLatencyMonitor(args.group, args.port, multicast=not args.unicast)
+    monitor.start()
+    started = time.time()
+    try:
+        while not args.duration or time.time() - started < args.duration:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    monitor.stop()
+
+    summary = monitor.histogram.summary()
+    print(f"{monitor.frames} frames, {monitor.lost_frames} lost; latency ms: min {summary['min']:.2f} "
+          f"mean {summary['mean']:.2f} p50 {summary['p50']:.1f} p95 {summary['p95']:.1f} "
+          f"p99 {summary['p99']:.1f} max {summary['max']:.2f}")
+    print(monitor.histogram.format())
+    return 0 if monitor.frames else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
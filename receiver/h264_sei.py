@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Frame id / capture time carried in the H.264 stream as SEI user data
+
+Identical copies live in sender/ and receiver/; keep them in sync.
+
+The sender inserts one user_data_unregistered SEI NAL unit (payload type 5)
+in front of the first slice of every frame. Its payload is a fixed UUID
+followed by the frame id and the capture time in nanoseconds since the
+epoch, both big-endian uint64. Decoders ignore SEI with an unknown UUID, so
+the stream stays playable by ffplay/ffmpeg.
+
+SEIInjector works on the raw Annex-B byte stream as it comes out of the
+encoder and forwards bytes as soon as they arrive; NALSplitter reassembles
+complete NAL units on the receiving side.
+"""
+
+import struct
+
+START_CODE = b'\x00\x00\x00\x01'
+
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+SEI_USER_DATA_UNREGISTERED = 5
+SEI_UUID = bytes.fromhex('5a1e5c0de7a34b1e9f6c2d8e4b7a1c30')
+SEI_FRAME_INFO = struct.Struct('!QQ')
+
+
+def escape_rbsp(rbsp):
+    """Insert emulation prevention bytes (00 00 0x -> 00 00 03 0x for x <= 3)"""
+    out = bytearray()
+    zeros = 0
+    for byte in rbsp:
+        if zeros >= 2 and byte <= 3:
+            out.append(3)
+            zeros = 0
+        out.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+    return bytes(out)
+
+
+def unescape_rbsp(data):
+    """Remove emulation prevention bytes"""
+    if b'\x00\x00\x03' not in data:
+        return bytes(data)
+    out = bytearray()
+    zeros = 0
+    for byte in data:
+        if zeros >= 2 and byte == 3:
+            zeros = 0
+            continue
+        out.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+    return bytes(out)
+
+
+def build_sei(frame_id, capture_ns):
+    """Complete SEI NAL unit, with a 4-byte start code, for one frame"""
+    payload = SEI_UUID + SEI_FRAME_INFO.pack(frame_id, capture_ns)
+    rbsp = bytes([SEI_USER_DATA_UNREGISTERED, len(payload)]) + payload + b'\x80'
+    return START_CODE + bytes([NAL_SEI]) + escape_rbsp(rbsp)
+
+
+def nal_header_offset(nal):
+    """Index of the NAL header byte after the start code"""
+    return 4 if nal[2] == 0 else 3
+
+
+def nal_type(nal):
+    """nal_unit_type of a NAL unit that starts with its start code"""
+    return nal[nal_header_offset(nal)] & 0x1F
+
+
+def is_first_slice(nal_header, first_payload_byte):
+    """True for a coded slice with first_mb_in_slice == 0 (ue(v) '1')"""
+    return (nal_header & 0x1F) in (NAL_SLICE, NAL_IDR) and first_payload_byte & 0x80
+
+
+def parse_sei(nal):
+    """(frame_id, capture_ns) from a SEI NAL unit written by build_sei, else None"""
+    if len(nal) < 5 or nal_type(nal) != NAL_SEI:
+        return None
+    rbsp = unescape_rbsp(nal[nal_header_offset(nal) + 1:])
+    pos = 0
+    while pos < len(rbsp) and rbsp[pos] != 0x80:
+        payload_type = 0
+        while pos < len(rbsp) and rbsp[pos] == 0xFF:
+            payload_type += 255
+            pos += 1
+        if pos >= len(rbsp):
+            return None
+        payload_type += rbsp[pos]
+        pos += 1
+        payload_size = 0
+        while pos < len(rbsp) and rbsp[pos] == 0xFF:
+            payload_size += 255
+            pos += 1
+        if pos >= len(rbsp):
+            return None
+        payload_size += rbsp[pos]
+        pos += 1
+        payload = rbsp[pos:pos + payload_size]
+        pos += payload_size
+        if (payload_type == SEI_USER_DATA_UNREGISTERED and len(payload) >= 16 + SEI_FRAME_INFO.size
+                and payload[:16] == SEI_UUID):
+            return SEI_FRAME_INFO.unpack_from(payload, 16)
+    return None
+
+
+class NALSplitter:
+    """Incremental Annex-B splitter: feed arbitrary chunks, get complete NAL units
+
+    Each returned NAL unit includes its start code; concatenating everything
+    returned (plus flush()) reproduces the input after the first start code.
+    A NAL unit is complete once the next start code has been seen.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.synced = False
+        self._scan = 0
+
+    def feed(self, data):
+        self.buffer += data
+        if not self.synced:
+            start = self.buffer.find(b'\x00\x00\x01')
+            if start < 0:
+                # Keep at most the two bytes that could begin a start code
+                del self.buffer[:max(len(self.buffer) - 2, 0)]
+                return []
+            if start > 0 and self.buffer[start - 1] == 0:
+                start -= 1
+            del self.buffer[:start]
+            self.synced = True
+            self._scan = 3
+
+        nals = []
+        while True:
+            i = self.buffer.find(b'\x00\x00\x01', max(self._scan, 3))
+            if i < 0:
+                # A start code may straddle the next chunk
+                self._scan = max(len(self.buffer) - 2, 3)
+                return nals
+            end = i - 1 if self.buffer[i - 1] == 0 else i
+            nals.append(bytes(self.buffer[:end]))
+            del self.buffer[:end]
+            self._scan = 3
+
+    def flush(self):
+        """Return whatever is buffered as a final NAL unit"""
+        nal = bytes(self.buffer) if self.synced and len(self.buffer) > 3 else None
+        self.buffer.clear()
+        self._scan = 3
+        return nal
+
+
+class SEIInjector:
+    """Stream transform that inserts a frame SEI before the first slice of every frame
+
+    `on_frame(frame_id)` must return the capture time in ns to embed; it is
+    called once per frame, in order. Bytes are passed through as soon as
+    they are known not to precede a new frame, so the transform adds no
+    frame-level buffering.
+    """
+
+    def __init__(self, on_frame, first_frame_id=1):
+        self.on_frame = on_frame
+        self.next_frame_id = first_frame_id
+        self.pending = b''
+
+    def feed(self, chunk):
+        data = self.pending + chunk
+        out = bytearray()
+        pos = 0
+        search = 0
+        hold = len(data)
+        while True:
+            i = data.find(b'\x00\x00\x01', search)
+            if i < 0:
+                # Trailing zeros may be the beginning of the next start code
+                hold = len(data)
+                while hold > pos and len(data) - hold < 3 and data[hold - 1] == 0:
+                    hold -= 1
+                break
+            if i + 4 >= len(data):
+                # Need the NAL header and the first slice byte to decide
+                hold = i - 1 if i > pos and data[i - 1] == 0 else i
+                break
+            if is_first_slice(data[i + 3], data[i + 4]):
+                start = i - 1 if i > pos and data[i - 1] == 0 else i
+                out += data[pos:start]
+                frame_id = self.next_frame_id
+                self.next_frame_id += 1
+                out += build_sei(frame_id, self.on_frame(frame_id))
+                pos = start
+            search = i + 3
+        out += data[pos:hold]
+        self.pending = data[hold:]
+        return bytes(out)
+
+    def flush(self):
+        data, self.pending = self.pending, b''
+        return data
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Live enhancement of the received audio multicast
+
+Enhancement used to run only offline, on recorded WAVs, while the live
+audio went straight from the multicast into ffplay. LiveEnhancer puts the
+enhancer between the two:
+
+    fanout 'audio' -> FFmpegAudioDecoder -> LiveEnhancer -> PlayerSink
+                      (one persistent ffmpeg,  (blocks of     (ffplay reading
+                       16 kHz mono s16le)       block_ms)      a WAV stream)
+
+The decoder is an ffmpeg subscribed to the stream fanout, so the multicast
+is still received once; its PCM output is read back in fixed blocks. Each
+block goes through a processor that runs causally with a bounded
+look-ahead:
+
+- ContextProcessor wraps any model that enhances a whole window (the stub
+  model, offline models): it keeps history_ms of past input and waits for
+  lookahead_ms of future input, runs the model on history + block +
+  look-ahead and emits only the block, so the output lags the input by the
+  look-ahead;
+- DemucsStreamProcessor uses the denoiser's own DemucsStreamer for DNS-48;
+- no processor is passthrough.
+
+The processor can be swapped between blocks (set_processor), e.g. on a
+mode change. Every block is timed; stats() reports the processing time per
+block and the real-time factor (processing time / audio duration, below 1
+keeps up). A block that takes longer than its duration backs up into the
+decoder pipe and the fanout queue, which drops the oldest datagrams rather
+than growing.
+
+WavFileSink and SyntheticSource let the pipeline run headless:
+    python live_enhancer.py                  # synthetic input, stub model, WAV sink
+    python live_enhancer.py --group 239.0.0.1 --port 5101 --seconds 10 --output live.wav
+"""
+
+import sys
+import time
+import wave
+import struct
+import argparse
+import threading
+import subprocess
+from collections import deque
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def to_pcm(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+def from_pcm(data):
+    return np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2').astype(np.float32) / 32768.0
+
+
+class FFmpegAudioDecoder:
+    """Persistent ffmpeg decoding the audio stream of a StreamFanout to mono s16le PCM"""
+
+    def __init__(self, fanout, sample_rate=SAMPLE_RATE, log=print):
+        self.fanout = fanout
+        self.sample_rate = sample_rate
+        self.log = log
+        self.subscriber = None
+
+    def start(self):
+        cmd = [
+            'ffmpeg',
+            '-hide_banner',
+            '-loglevel', 'error',
+            '-fflags', 'nobuffer',
+            '-flags', 'low_delay',
+            '-f', 'mpegts',
+            '-i', 'pipe:0',
+            '-vn',
+            '-ac', '1',
+            '-ar', str(self.sample_rate),
+            '-f', 's16le',
+            'pipe:1'
+        ]
+        self.subscriber = self.fanout.attach_pipe('audio', 'live decoder', cmd,
+                                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        threading.Thread(target=self.log_errors, daemon=True).start()
+        return self
+
+    def log_errors(self):
+        for line in iter(self.subscriber.process.stderr.readline, b''):
+            line = line.decode(errors='replace').strip()
+            if line:
+                self.log(f"Live decoder: {line}")
+
+    def read(self, count):
+        """Up to count samples, blocking; fewer only when the decoder has exited"""
+        return from_pcm(self.subscriber.process.stdout.read(count * 2))
+
+    def stop(self):
+        if self.subscriber:
+            self.fanout.detach('audio', self.subscriber)
+            self.subscriber.stop()
+
+
+class SyntheticSource:
+    """Noisy 440 Hz tone, paced in real time unless realtime=False"""
+
+    def __init__(self, seconds, sample_rate=SAMPLE_RATE, realtime=True, seed=0):
+        self.total = int(seconds * sample_rate)
+        self.sample_rate = sample_rate
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+        self.position = 0
+        self.started = None
+
+    def read(self, count):
+        if self.started is None:
+            self.started = time.perf_counter()
+        count = min(count, self.total - self.position)
+        t = np.arange(self.position, self.position + count) / self.sample_rate
+        self.position += count
+        if self.realtime:
+            # 模拟解码器按实时速率输出
+            delay = self.started + self.position / self.sample_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return (0.3 * np.sin(2 * np.pi * 440 * t) + 0.05 * self.rng.standard_normal(count)).astype(np.float32)
+
+    def stop(self):
+        pass
+
+
+class WavFileSink:
+    def __init__(self, path, sample_rate=SAMPLE_RATE):
+        self.path = path
+        self.writer = wave.open(path, 'wb')
+        self.writer.setnchannels(1)
+        self.writer.setsampwidth(2)
+        self.writer.setframerate(sample_rate)
+
+    def write(self, samples):
+        self.writer.writeframes(to_pcm(samples))
+
+    def close(self):
+        self.writer.close()
+
+
+class PlayerSink:
+    """ffplay reading a WAV stream on stdin; the header is written once with an open-ended length"""
+
+    def __init__(self, sample_rate=SAMPLE_RATE, log=print):
+        self.log = log
+        cmd = [
+            'ffplay',
+            '-fflags', 'nobuffer',
+            '-flags', 'low_delay',
+            '-nodisp',
+            '-autoexit',
+            '-loglevel', 'warning',
+            '-f', 'wav',
+            'pipe:0'
+        ]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        # 流式 WAV 头: 长度字段填最大值
+        self.process.stdin.write(b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVEfmt ' +
+                                 struct.pack('<IHHIIHH', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16) +
+                                 b'data' + struct.pack('<I', 0xFFFFFFFF))
+
+    def write(self, samples):
+        try:
+            self.process.stdin.write(to_pcm(samples))
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError):
+            # Player window closed; keep enhancing so the stats stay live
+            pass
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        if self.process.poll() is None:
+            self.process.terminate()
+
+
+class ContextProcessor:
+    """Runs a window model causally: history_ms of context behind, lookahead_ms ahead"""
+
+    def __init__(self, model, name='model', sample_rate=SAMPLE_RATE, history_ms=256, lookahead_ms=16):
+        self.model = model
+        self.name = name
+        self.history_size = int(history_ms * sample_rate / 1000)
+        self.lookahead = int(lookahead_ms * sample_rate / 1000)
+        self.history = np.zeros(0, dtype=np.float32)
+        self.pending = np.zeros(0, dtype=np.float32)
+
+    def feed(self, block):
+        self.pending = np.concatenate((self.pending, block))
+        count = len(self.pending) - self.lookahead
+        if count <= 0:
+            return np.zeros(0, dtype=np.float32)
+        window = np.concatenate((self.history, self.pending))
+        start = len(self.history)
+        enhanced = np.asarray(self.model(window), dtype=np.float32)[start:start + count]
+        self.history = np.concatenate((self.history, self.pending[:count]))[-self.history_size:]
+        self.pending = self.pending[count:]
+        return enhanced
+
+    def flush(self):
+        """Output for the look-ahead still held back, as if the input continued in silence"""
+        held = len(self.pending)
+        return self.feed(np.zeros(self.lookahead, dtype=np.float32))[:held]
+
+
+class DemucsStreamProcessor:
+    """DNS-48 through denoiser.demucs.DemucsStreamer, which handles its own look-ahead"""
+
+    def __init__(self, model, device, name='dns48'):
+        import torch
+        from denoiser.demucs import DemucsStreamer
+        self.torch = torch
+        self.device = device
+        self.name = name
+        self.streamer = DemucsStreamer(model, num_frames=1)
+
+    def feed(self, block):
+        waveform = self.torch.from_numpy(np.ascontiguousarray(block)).unsqueeze(0).to(self.device)
+        with self.torch.no_grad():
+            enhanced = self.streamer.feed(waveform)
+        return enhanced.reshape(-1).cpu().numpy()
+
+    def flush(self):
+        with self.torch.no_grad():
+            return self.streamer.flush().reshape(-1).cpu().numpy()
+
+
+def processor_for(warm, sample_rate=SAMPLE_RATE):
+    """Processor for a model_registry.WarmModel; None (passthrough) stays None"""
+    if warm is None:
+        return None
+    if warm.device is None:
+        return ContextProcessor(warm.model, warm.name, sample_rate)
+    return DemucsStreamProcessor(warm.model, warm.device, warm.name)
+
+
+def load_processor(name, sample_rate=SAMPLE_RATE):
+    """'stub', 'dns48', 'dns64', or None / 'passthrough' (returns None)"""
+    if name in (None, 'passthrough'):
+        return None
+    if name == 'stub':
+        from enhancement_service import StubModel
+        return ContextProcessor(StubModel(load_seconds=0), 'stub', sample_rate)
+    if name in ('dns48', 'dns64'):
+        import audio_enhancer
+        audio_enhancer.setup_paths()
+        model, device = audio_enhancer.load_denoiser_model(name)
+        return DemucsStreamProcessor(model, device, name)
+    raise ValueError(f"unknown live enhancer {name!r}")
+
+
+class LiveEnhancer:
+    def __init__(self, source, sink, processor=None, sample_rate=SAMPLE_RATE, block_ms=32, log=print):
+        """
+        Args:
+            source: read(count) -> float32 samples, blocking; an empty read ends the stream
+            sink: write(samples), close()
+            processor: feed(block) / flush(), or None for passthrough
+        """
+        self.source = source
+        self.sink = sink
+        self.processor = processor
+        self.sample_rate = sample_rate
+        self.block = int(block_ms * sample_rate / 1000)
+        self.block_seconds = self.block / sample_rate
+        self.log = log
+        self.lock = threading.Lock()
+        self.next_processor = None
+        self.swap = False
+        self.running = False
+        self.thread = None
+        self.timings = deque(maxlen=500)    # seconds per block, recent
+        self.blocks = 0
+        self.late = 0
+        self.samples_in = 0
+        self.samples_out = 0
+        self.busy_seconds = 0.0
+
+    def set_processor(self, processor):
+        """Switch processors before the next block; the old one is flushed first"""
+        with self.lock:
+            self.next_processor = processor
+            self.swap = True
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="live-enhancer", daemon=True)
+        self.thread.start()
+        return self
+
+    def write(self, samples):
+        if len(samples):
+            self.sink.write(samples)
+            self.samples_out += len(samples)
+
+    def run(self):
+        try:
+            while self.running:
+                block = self.source.read(self.block)
+                if not len(block):
+                    break
+                started = time.perf_counter()
+                with self.lock:
+                    if self.swap:
+                        if self.processor:
+                            self.write(self.processor.flush())
+                        self.processor, self.swap = self.next_processor, False
+                processor = self.processor
+                self.write(processor.feed(block) if processor else block)
+                elapsed = time.perf_counter() - started
+
+                self.samples_in += len(block)
+                self.blocks += 1
+                self.busy_seconds += elapsed
+                self.timings.append(elapsed)
+                if elapsed > len(block) / self.sample_rate:
+                    self.late += 1
+            if self.processor:
+                self.write(self.processor.flush())
+        except Exception as e:
+            self.log(f"Live enhancer error: {str(e)}")
+        finally:
+            self.running = False
+            self.sink.close()
+
+    def stop(self, timeout=2):
+        self.running = False
+        self.source.stop()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def stats(self):
+        timings = sorted(self.timings)
+        audio_seconds = self.samples_in / self.sample_rate
+
+        def percentile(p):
+            return timings[min(int(p / 100 * len(timings)), len(timings) - 1)] * 1000 if timings else 0.0
+
+        return {
+            'processor': getattr(self.processor, 'name', 'passthrough'),
+            'blocks': self.blocks,
+            'block_ms': self.block_seconds * 1000,
+            'audio_seconds': audio_seconds,
+            'process_ms': {'p50': percentile(50), 'p95': percentile(95), 'max': percentile(100)},
+            'rtf': self.busy_seconds / audio_seconds if audio_seconds else 0.0,
+            'rtf_max': timings[-1] / self.block_seconds if timings else 0.0,
+            'late_blocks': self.late,
+            # Input not yet played: the look-ahead held by the processor
+            'lag_ms': (self.samples_in - self.samples_out) / self.sample_rate * 1000,
+        }
+
+
+def print_stats(stats):
+    process_ms = stats['process_ms']
+    print(f"{stats['processor']}: {stats['blocks']} blocks of {stats['block_ms']:.0f} ms "
+          f"({stats['audio_seconds']:.1f} s of audio); per block p50 {process_ms['p50']:.3f} ms, "
+          f"p95 {process_ms['p95']:.3f} ms, max {process_ms['max']:.3f} ms; RTF {stats['rtf']:.4f} "
+          f"(worst block {stats['rtf_max']:.3f}); late blocks {stats['late_blocks']}")
+
+
+def self_check(seconds=3.0):
+    """Stub model on a synthetic real-time source into a WAV; compare with the offline result"""
+    import os
+    import tempfile
+    from enhancement_service import StubModel
+
+    directory = tempfile.mkdtemp(prefix="live_enhancer_")
+    path = os.path.join(directory, "live.wav")
+    enhancer = LiveEnhancer(SyntheticSource(seconds), WavFileSink(path), load_processor('stub'))
+    enhancer.start()
+    # Passthrough for a moment in the middle, as on a switch to mode 0
+    time.sleep(seconds / 3)
+    enhancer.set_processor(None)
+    time.sleep(seconds / 3)
+    enhancer.set_processor(load_processor('stub'))
+    enhancer.thread.join()
+    stats = enhancer.stats()
+    print_stats(stats)
+
+    # Same input offline, for the samples enhanced by the stub
+    reference_source = SyntheticSource(seconds, realtime=False)
+    raw = reference_source.read(reference_source.total)
+    offline = StubModel(load_seconds=0)(raw)
+    with wave.open(path, 'rb') as f:
+        live = from_pcm(f.readframes(f.getnframes()))
+    quantization = 1.5 / 32768
+    matches_offline = np.abs(live - offline) <= quantization
+    matches_raw = np.abs(live - raw) <= quantization
+    # At each of the two switches the filter sees silence instead of its neighbour for one sample
+    unexplained = int(np.sum(~(matches_offline | matches_raw)))
+    print(f"Output {len(live)} samples for {len(raw)} in; {np.mean(matches_offline):.1%} equal to the offline stub, "
+          f"the rest passthrough except {unexplained} samples at the switches")
+    ok = len(live) == len(raw) and unexplained <= 2 and stats['late_blocks'] == 0 and stats['lag_ms'] == 0
+    print("OK" if ok else "MISMATCH")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live enhancement of the audio multicast")
+    parser.add_argument("--group", help="multicast group; without it a synthetic source is used")
+    parser.add_argument("--port", type=int, default=5101)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--model", default='stub', help="stub, dns48 or passthrough")
+    parser.add_argument("--output", help="WAV file sink; default plays with ffplay")
+    args = parser.parse_args()
+
+    if not args.group:
+        return self_check()
+
+    from stream_sniffer import StreamSniffer
+    from stream_fanout import StreamFanout
+    sniffer = StreamSniffer(args.group, {'audio': (args.port, True)})
+    fanout = StreamFanout(sniffer)
+    sniffer.start()
+    decoder = FFmpegAudioDecoder(fanout).start()
+    sink = WavFileSink(args.output) if args.output else PlayerSink()
+    enhancer = LiveEnhancer(decoder, sink, load_processor(args.model)).start()
+    deadline = time.time() + args.seconds
+    while enhancer.running and time.time() < deadline:
+        time.sleep(1)
+        print_stats(enhancer.stats())
+    # Stopping the enhancer stops the decoder, its source
+    enhancer.stop()
+    sniffer.stop()
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
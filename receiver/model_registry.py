@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Mode-aware enhancement model registry
+
+The sender's decision picks one of five processing modes, but the
+enhancer only ever loaded DNS-48. ModelRegistry maps each mode code to a
+model:
+
+    0  passthrough        (no model)
+    1  light audio-only   dns48
+    2  audio-only         dns64
+    3  light audio-visual avse_light
+    4  full audio-visual  avse
+
+Models load lazily on first use and stay warm in an LRU bounded by a
+memory budget (each model declares its size); loading one that does not
+fit evicts the least recently used. A mode whose model is not registered
+or fails to load falls back to the next lower mode, so the AV modes use
+DNS-64 until AVSE models are registered with register().
+
+observe() takes the decision stream. It fits a line through the recent
+defuzzified values and, when the value extrapolated horizon seconds ahead
+falls in another mode, loads that mode's model in the background, so the
+switch finds it warm.
+
+Loaders return (model, device) like audio_enhancer.load_denoiser_model;
+device is None for models that take numpy samples.
+
+python model_registry.py checks the LRU, fallback and prefetch with fake
+models that have controllable load times.
+"""
+
+import sys
+import time
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Same thresholds as sender/fuzzy_table.py: lower bound of the defuzzified value, highest mode first
+MODE_THRESHOLDS = [(39, 4), (25, 3), (12, 2), (9, 1)]
+
+MODE_MODELS = {0: None, 1: 'dns48', 2: 'dns64', 3: 'avse_light', 4: 'avse'}
+
+# Recordings without a decision (no info file, or made before the first decision arrived) get DNS-48
+DEFAULT_RECORDING_MODE = 1
+
+ModelSpec = namedtuple('ModelSpec', 'name loader memory_mb')
+WarmModel = namedtuple('WarmModel', 'name model device')
+
+
+def mode_from_value(value):
+    for threshold, code in MODE_THRESHOLDS:
+        if value >= threshold:
+            return code
+    return 0
+
+
+def recording_mode(info):
+    """Mode to enhance a recording with, from its info_*.json contents (None if missing)"""
+    mode_code = info.get('mode_code', -1) if info else -1
+    # -1: no decision had been received when the recording was made
+    return mode_code if mode_code >= 0 else DEFAULT_RECORDING_MODE
+
+
+def denoiser_loader(name):
+    def load():
+        import audio_enhancer
+        audio_enhancer.setup_paths()
+        return audio_enhancer.load_denoiser_model(name)
+    return load
+
+
+def default_specs():
+    return [ModelSpec('dns48', denoiser_loader('dns48'), 150),
+            ModelSpec('dns64', denoiser_loader('dns64'), 250)]
+
+
+class ModeTrend:
+    """Least-squares slope of the defuzzified value over the recent decisions"""
+
+    def __init__(self, window=8, horizon=5.0):
+        self.samples = deque(maxlen=window)
+        self.horizon = horizon
+
+    def add(self, value, now):
+        self.samples.append((now, value))
+
+    def predicted_value(self):
+        if len(self.samples) < 3:
+            return None
+        times = [t for t, _ in self.samples]
+        values = [v for _, v in self.samples]
+        mean_t = sum(times) / len(times)
+        mean_v = sum(values) / len(values)
+        spread = sum((t - mean_t) ** 2 for t in times)
+        if not spread:
+            return None
+        slope = sum((t - mean_t) * (v - mean_v) for t, v in self.samples) / spread
+        return values[-1] + slope * self.horizon
+
+
+class ModelRegistry:
+    def __init__(self, specs=None, mode_models=None, memory_budget_mb=1024, prefetch=True, horizon=5.0,
+                 log=print):
+        """
+        Args:
+            specs: ModelSpecs, default DNS-48 and DNS-64
+            mode_models: {mode_code: model name or None}, default MODE_MODELS
+            memory_budget_mb: total declared size of the warm models
+            prefetch: load the model of the mode the decisions are trending to
+            horizon: seconds ahead the trend is extrapolated
+        """
+        self.specs = {}
+        for spec in specs if specs is not None else default_specs():
+            self.specs[spec.name] = spec
+        self.mode_models = dict(MODE_MODELS if mode_models is None else mode_models)
+        self.memory_budget_mb = memory_budget_mb
+        self.prefetch_enabled = prefetch
+        self.trend = ModeTrend(horizon=horizon)
+        self.log = log
+        self.lock = threading.Lock()
+        self.warm = OrderedDict()       # name -> WarmModel, least recently used first
+        self.loading = {}               # name -> Future
+        self.failed = set()
+        self.prefetched = set()         # loaded ahead of use and not used yet
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-prefetch")
+        self.counters = {'hits': 0, 'misses': 0, 'loads': 0, 'load_seconds': 0.0, 'evictions': 0,
+                         'prefetches': 0, 'prefetch_hits': 0, 'fallbacks': 0}
+
+    def register(self, name, loader, memory_mb, modes=()):
+        """Add a model, optionally as the model of the given modes"""
+        with self.lock:
+            self.specs[name] = ModelSpec(name, loader, memory_mb)
+            self.failed.discard(name)
+            for mode in modes:
+                self.mode_models[mode] = name
+
+    def resolve(self, mode_code):
+        """Name of the model serving mode_code after fallbacks, None for passthrough"""
+        # Negative modes (-1: no decision received yet) are passed through; recordings map them with recording_mode()
+        for mode in range(min(mode_code, max(self.mode_models)), 0, -1):
+            name = self.mode_models.get(mode)
+            if name in self.specs and name not in self.failed:
+                return name
+        return None
+
+    def get(self, mode_code):
+        """WarmModel for mode_code, loading it if needed (blocking); None for passthrough"""
+        while True:
+            name = self.resolve(mode_code)
+            if name is None:
+                return None
+            try:
+                model, device = self._load(name, prefetch=False)
+            except Exception as e:
+                with self.lock:
+                    self.failed.add(name)
+                    self.counters['fallbacks'] += 1
+                self.log(f"Model {name} unavailable for mode {mode_code} ({str(e)}); falling back")
+                continue
+            return WarmModel(name, model, device)
+
+    def get_async(self, mode_code):
+        """Future of get(mode_code) resolved on the prefetch thread"""
+        return self.executor.submit(self.get, mode_code)
+
+    def _load(self, name, prefetch):
+        with self.lock:
+            entry = self.warm.get(name)
+            if entry is not None:
+                self.warm.move_to_end(name)
+                if not prefetch:
+                    self.counters['hits'] += 1
+                    if name in self.prefetched:
+                        self.prefetched.discard(name)
+                        self.counters['prefetch_hits'] += 1
+                return entry.model, entry.device
+            future = self.loading.get(name)
+            owner = future is None
+            if owner:
+                future = self.loading[name] = Future()
+                if prefetch:
+                    self.counters['prefetches'] += 1
+            if not prefetch:
+                self.counters['misses'] += 1
+
+        if not owner:
+            # Another thread (usually the prefetcher) is loading it already
+            return future.result()
+
+        spec = self.specs[name]
+        started = time.perf_counter()
+        try:
+            model, device = spec.loader()
+        except Exception as e:
+            with self.lock:
+                del self.loading[name]
+            future.set_exception(e)
+            raise
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.warm[name] = WarmModel(name, model, device)
+            del self.loading[name]
+            self.counters['loads'] += 1
+            self.counters['load_seconds'] += elapsed
+            if prefetch:
+                self.prefetched.add(name)
+            evicted = self._evict(keep=name)
+        self.log(f"Loaded model {name} in {elapsed:.2f} s{' (prefetch)' if prefetch else ''}"
+                 f"{'; evicted ' + ', '.join(evicted) if evicted else ''}")
+        future.set_result((model, device))
+        return model, device
+
+    def _evict(self, keep):
+        """Drop least recently used models until the declared sizes fit the budget"""
+        evicted = []
+        while self.memory_mb() > self.memory_budget_mb and len(self.warm) > 1:
+            name = next(n for n in self.warm if n != keep)
+            # A live processor may still hold the model; its memory is freed when that lets go
+            del self.warm[name]
+            self.prefetched.discard(name)
+            self.counters['evictions'] += 1
+            evicted.append(name)
+        return evicted
+
+    def memory_mb(self):
+        return sum(self.specs[name].memory_mb for name in self.warm)
+
+    def prefetch(self, mode_code):
+        """Start loading the model of mode_code in the background unless it is warm or loading"""
+        name = self.resolve(mode_code)
+        with self.lock:
+            if name is None or name in self.warm or name in self.loading:
+                return None
+        return self.executor.submit(self._prefetch, name)
+
+    def _prefetch(self, name):
+        try:
+            self._load(name, prefetch=True)
+        except Exception as e:
+            self.log(f"Prefetch of {name} failed: {str(e)}")
+
+    def observe(self, decision, now=None):
+        """Feed one decision; returns the mode being prefetched, if any"""
+        value = decision.get('defuzzified_value')
+        if value is None:
+            return None
+        self.trend.add(value, time.time() if now is None else now)
+        predicted = self.trend.predicted_value()
+        if not self.prefetch_enabled or predicted is None:
+            return None
+        mode = mode_from_value(predicted)
+        if mode == decision.get('mode_code', mode_from_value(value)):
+            return None
+        return mode if self.prefetch(mode) else None
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, warm=list(self.warm), memory_mb=self.memory_mb(),
+                        budget_mb=self.memory_budget_mb, failed=sorted(self.failed))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class FakeModel:
+    """Stand-in model: sleeps load_seconds, holds memory_mb of real memory, scales its input by gain"""
+
+    sample_rate = 16000
+
+    def __init__(self, load_seconds, memory_mb, gain=1.0):
+        import numpy as np
+        time.sleep(load_seconds)
+        self.weights = np.ones(memory_mb << 20, dtype=np.uint8)
+        self.gain = gain
+
+    def __call__(self, samples):
+        return samples * self.gain
+
+
+def fake_spec(name, load_seconds, memory_mb, gain=1.0):
+    return ModelSpec(name, lambda: (FakeModel(load_seconds, memory_mb, gain), None), memory_mb)
+
+
+def self_check():
+    ok = True
+
+    def check(condition, message):
+        nonlocal ok
+        print(f"  {'ok' if condition else 'FAIL'}: {message}")
+        ok = ok and condition
+
+    specs = [fake_spec('light_ao', 0.2, 100), fake_spec('ao', 0.3, 150),
+             fake_spec('light_av', 0.6, 150), fake_spec('av', 0.8, 200)]
+    modes = {0: None, 1: 'light_ao', 2: 'ao', 3: 'light_av', 4: 'av'}
+    quiet = lambda message: None
+
+    print("Lazy loading and LRU")
+    registry = ModelRegistry(specs, modes, memory_budget_mb=300, log=quiet)
+    check(registry.get(0) is None, "mode 0 is passthrough")
+    check(registry.stats()['loads'] == 0, "nothing loaded before first use")
+    started = time.perf_counter()
+    registry.get(1)
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    registry.get(1)
+    warm = time.perf_counter() - started
+    check(cold >= 0.2 and warm < 0.01, f"cold get {cold * 1000:.0f} ms, warm get {warm * 1000:.2f} ms")
+    registry.get(2)
+    registry.get(1)                 # light_ao is now the most recently used
+    registry.get(3)                 # 400 MB > 300: evicts ao, not light_ao
+    stats = registry.stats()
+    check(stats['warm'] == ['light_ao', 'light_av'] and stats['memory_mb'] <= 300,
+          f"LRU evicted the least recently used: warm {stats['warm']}, {stats['memory_mb']} MB of 300")
+    registry.get(4)                 # 200 MB alone fills most of the budget
+    check(registry.stats()['warm'] == ['av'], f"a large model evicts the rest: warm {registry.stats()['warm']}")
+    registry.close()
+
+    print("Fallback")
+    registry = ModelRegistry(specs[:2], modes, memory_budget_mb=300, log=quiet)
+    check(registry.get(4).name == 'ao', "unregistered AV modes fall back to the audio-only model")
+    broken = ModelSpec('broken', lambda: 1 / 0, 10)
+    registry.register('broken', broken.loader, 10, modes=[2])
+    check(registry.get(2).name == 'light_ao' and 'broken' in registry.stats()['failed'],
+          "a model that fails to load falls back to the next lower mode")
+    registry.close()
+
+    print("Prefetch on a trending decision stream")
+    switch_wait = {}
+    for prefetch in (False, True):
+        registry = ModelRegistry(specs, modes, memory_budget_mb=1024, prefetch=prefetch, log=quiet)
+        registry.get(2)
+        # Defuzzified value rising 1.5 per second from mode 2 towards mode 3 (threshold 25)
+        value, now, mode, prefetched_at = 14.0, 0.0, 2, None
+        while True:
+            value += 1.5
+            now += 1.0
+            decision = {'defuzzified_value': value, 'mode_code': mode_from_value(value)}
+            if decision['mode_code'] != mode:
+                break
+            if registry.observe(decision, now) is not None and prefetched_at is None:
+                prefetched_at = value
+            # Decisions arrive every second in stream time; 0.25 s of wall time keeps the check short
+            time.sleep(0.25)
+        started = time.perf_counter()
+        registry.get(decision['mode_code'])
+        switch_wait[prefetch] = time.perf_counter() - started
+        stats = registry.stats()
+        print(f"  prefetch {'on ' if prefetch else 'off'}: switch to mode {decision['mode_code']} waited "
+              f"{switch_wait[prefetch] * 1000:.0f} ms; prefetch started at value "
+              f"{prefetched_at if prefetched_at is not None else '-'}; prefetch hits {stats['prefetch_hits']}")
+        registry.close()
+    check(switch_wait[False] >= 0.6 and switch_wait[True] < 0.05 and stats['prefetch_hits'] == 1,
+          "prefetch made the switch find the model warm")
+
+    print("OK" if ok else "MISMATCH")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if self_check() else 1)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+In-process H.264 Annex-B scanner for frame rate, GOP structure and frame sizes
+
+Replaces the ffprobe frame counter, which decoded every frame of the video
+multicast just to count them. NALScanner only looks at the start codes and
+the one or two bytes after each of them in the datagrams StreamSniffer
+already receives: access units are delimited following H.264 7.4.1.2.3
+(an AUD, SEI, SPS or PPS after a slice, or a new slice with
+first_mb_in_slice == 0), IDR access units start a new GOP, and the bytes
+between boundaries are the frame size. Nothing is decoded; each datagram
+is joined to the few bytes carried over from the previous one and searched
+with bytes.find. That one copy of a datagram is cheaper than searching the
+memoryview in place, which costs more per call than it saves.
+
+python nal_scanner.py file.h264 benchmarks the CPU time against
+ffprobe -show_entries frame=pkt_size on the same file.
+"""
+
+import sys
+import time
+import shutil
+import subprocess
+from collections import deque
+from rate_meter import RateMeter
+
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+# NAL types that start a new access unit when they follow a slice
+AU_PREFIX_TYPES = (NAL_SEI, NAL_SPS, NAL_PPS, NAL_AUD)
+
+
+class NALScanner:
+    def __init__(self, history=300, fps_window=1.0):
+        """
+        Args:
+            history: number of recent frame sizes and GOP lengths kept for statistics
+        """
+        self.carry = b''
+        self.offset = 0             # stream bytes consumed so far
+        self.au_start = None        # stream offset of the current access unit
+        self.au_has_slice = False
+        self.au_idr = False
+
+        self.frames = 0
+        self.idr_frames = 0
+        self.nal_units = 0
+        self.frames_since_idr = None
+        self.gop_lengths = deque(maxlen=history)
+        self.frame_sizes = deque(maxlen=history)
+        self.idr_sizes = deque(maxlen=history)
+        # Stream offsets where recent IDR access units (including their SPS/PPS/SEI) start
+        self.idr_offsets = deque(maxlen=64)
+        self.fps_meter = RateMeter(window=fps_window)
+
+    def feed(self, view, received_ns=None):
+        """Scan one chunk of the Annex-B stream (bytes or memoryview); the chunk is copied once"""
+        data = self.carry + bytes(view)
+        base = self.offset - len(self.carry)
+        self.offset += len(view)
+        length = len(data)
+        i = data.find(b'\x00\x00\x01')
+        while i >= 0:
+            if i + 4 >= length:
+                # Need the NAL header and the first slice byte; finish on the next chunk
+                self.carry = data[i:]
+                return
+            # A 4-byte start code's leading zero belongs to this NAL unit
+            start = i - 1 if i and data[i - 1] == 0 else i
+            self.nal_unit(data[i + 3], data[i + 4], base + start)
+            i = data.find(b'\x00\x00\x01', i + 3)
+        self.carry = data[-4:]
+
+    def nal_unit(self, header, first_byte, position):
+        self.nal_units += 1
+        nal_type = header & 0x1F
+        if nal_type in (NAL_SLICE, NAL_IDR):
+            # first_mb_in_slice == 0 is ue(v) '1'
+            if first_byte & 0x80 and self.au_has_slice:
+                self.end_access_unit(position)
+            if self.au_start is None:
+                self.au_start = position
+            self.au_has_slice = True
+            self.au_idr = self.au_idr or nal_type == NAL_IDR
+        elif nal_type in AU_PREFIX_TYPES:
+            if self.au_has_slice:
+                self.end_access_unit(position)
+            if self.au_start is None:
+                self.au_start = position
+
+    def end_access_unit(self, position):
+        size = position - self.au_start
+        self.frames += 1
+        self.fps_meter.add()
+        if self.au_idr:
+            self.idr_frames += 1
+            self.idr_sizes.append(size)
+            self.idr_offsets.append(self.au_start)
+            if self.frames_since_idr is not None:
+                self.gop_lengths.append(self.frames_since_idr)
+            self.frames_since_idr = 1
+        else:
+            self.frame_sizes.append(size)
+            if self.frames_since_idr is not None:
+                self.frames_since_idr += 1
+        self.au_start = position
+        self.au_has_slice = False
+        self.au_idr = False
+
+    @property
+    def fps(self):
+        return self.fps_meter.count()
+
+    def snapshot(self):
+        def size_stats(sizes):
+            sizes = sorted(sizes)
+            if not sizes:
+                return {'mean': 0, 'p95': 0, 'max': 0}
+            return {'mean': sum(sizes) / len(sizes), 'p95': sizes[min(int(0.95 * len(sizes)), len(sizes) - 1)],
+                    'max': sizes[-1]}
+
+        gops = list(self.gop_lengths)
+        return {
+            'frames': self.frames,
+            'idr_frames': self.idr_frames,
+            'fps': self.fps,
+            'gop_last': gops[-1] if gops else 0,
+            'gop_mean': sum(gops) / len(gops) if gops else 0.0,
+            'idr_size': size_stats(list(self.idr_sizes)),
+            'frame_size': size_stats(list(self.frame_sizes)),
+        }
+
+
+def scan_file(path, chunk_size=1400):
+    """Feed a file through the scanner in datagram-sized chunks; returns (scanner, cpu_seconds)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    view = memoryview(data)
+    scanner = NALScanner(history=100000)
+    started = time.process_time()
+    for offset in range(0, len(data), chunk_size):
+        scanner.feed(view[offset:offset + chunk_size])
+    # Close the last access unit at the end of the file
+    if scanner.au_has_slice:
+        scanner.end_access_unit(scanner.offset)
+    return scanner, time.process_time() - started
+
+
+def ffprobe_file(path):
+    """Frame count and child CPU seconds of the ffprobe frame counter on a file, or None without ffprobe"""
+    if not shutil.which('ffprobe'):
+        return None
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'frame=pkt_size', '-of', 'csv', path]
+    try:
+        import resource
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    except ImportError:
+        # No rusage on Windows; wall time is an upper bound of the CPU time
+        started = time.perf_counter()
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        cpu = time.perf_counter() - started
+    frames = sum(1 for line in result.stdout.splitlines() if line.startswith('frame'))
+    return frames, cpu
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("Usage: python nal_scanner.py recording.h264")
+        return 2
+    path = argv[0]
+
+    scanner, scanner_cpu = scan_file(path)
+    stats = scanner.snapshot()
+    print(f"NAL scanner: {stats['frames']} frames ({stats['idr_frames']} IDR), GOP mean {stats['gop_mean']:.1f}, "
+          f"frame size mean {stats['frame_size']['mean']:.0f} B / IDR {stats['idr_size']['mean']:.0f} B, "
+          f"{scanner.nal_units} NAL units, CPU {scanner_cpu * 1000:.1f} ms "
+          f"({scanner_cpu / max(stats['frames'], 1) * 1e6:.1f} us/frame)")
+
+    probe = ffprobe_file(path)
+    if probe is None:
+        print("ffprobe not found; skipping the comparison")
+        return 0
+    frames, ffprobe_cpu = probe
+    print(f"ffprobe:     {frames} frames, CPU {ffprobe_cpu * 1000:.1f} ms "
+          f"({ffprobe_cpu / max(frames, 1) * 1e6:.1f} us/frame), "
+          f"{ffprobe_cpu / max(scanner_cpu, 1e-9):.0f}x the scanner")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Rolling in-memory pre-record buffer for the media streams
+
+Recording used to start two ffmpeg processes that joined the multicast
+groups and captured the *next* few seconds; process start-up and stream
+probing added latency and the first keyframe was often lost. Instead,
+PreRecordBuffer keeps the raw datagrams of the last N seconds of a stream
+(fed by StreamSniffer), so a recording is a file write of what is already
+in memory:
+
+- video: the buffer is trimmed GOP by GOP and always starts at an IDR
+  access unit (with its SPS/PPS), using the stream offsets NALScanner
+  reports, so a flushed .h264 file is decodable from its first byte;
+- audio: MPEG-TS datagrams, trimmed by time (every datagram holds whole
+  188-byte packets).
+
+flush() writes the requested past seconds immediately and can keep
+appending live datagrams for a while afterwards (follow), without a gap
+between the buffered and the live part.
+
+python prerecord_buffer.py checks alignment, continuity and flush time on a
+synthetic H.264 stream.
+"""
+
+import sys
+import time
+import threading
+from collections import deque
+from stream_fanout import Subscriber
+
+
+class PreRecordBuffer:
+    def __init__(self, name, seconds=10.0, scanner=None, max_bytes=64 << 20, log=print):
+        """
+        Args:
+            seconds: history kept (video keeps up to one GOP more, to start on an IDR)
+            scanner: NALScanner for an H.264 stream; it is fed from here so both agree on stream offsets
+            max_bytes: hard memory cap, whatever the bitrate
+        """
+        self.name = name
+        self.seconds = seconds
+        self.scanner = scanner
+        self.max_bytes = max_bytes
+        self.log = log
+        self.entries = deque()      # (received_ns, stream offset, datagram)
+        self.keyframes = deque()    # (stream offset, received_ns) of IDR access unit starts
+        self.bytes = 0
+        self.offset = 0
+        self.seen_idr = 0
+        self.followers = ()
+        self.lock = threading.Lock()
+
+    def feed(self, view, received_ns):
+        """StreamSniffer handler"""
+        data = bytes(view)
+        with self.lock:
+            offset = self.offset
+            self.offset += len(data)
+            self.entries.append((received_ns, offset, data))
+            self.bytes += len(data)
+            if self.scanner is not None:
+                self.scanner.feed(data, received_ns)
+                new = self.scanner.idr_frames - self.seen_idr
+                if new:
+                    self.seen_idr = self.scanner.idr_frames
+                    for keyframe in list(self.scanner.idr_offsets)[-new:]:
+                        self.keyframes.append((keyframe, self.time_at(keyframe)))
+            for follower in self.followers:
+                follower.put(data, received_ns)
+            self.expire(received_ns)
+
+    def time_at(self, offset):
+        """Arrival time of the datagram holding a stream offset (recent offsets; searched from the end)"""
+        for received_ns, start, _ in reversed(self.entries):
+            if start <= offset:
+                return received_ns
+        return self.entries[0][0]
+
+    def expire(self, now_ns):
+        cutoff = now_ns - int(self.seconds * 1e9)
+        entries = self.entries
+        if self.scanner is not None and self.keyframes:
+            # Keep the newest IDR at or before the cutoff so the window starts on a keyframe
+            keyframes = self.keyframes
+            while len(keyframes) > 1 and keyframes[1][1] <= cutoff:
+                keyframes.popleft()
+            first = keyframes[0][0]
+            while entries and entries[0][1] + len(entries[0][2]) <= first:
+                self.bytes -= len(entries.popleft()[2])
+        else:
+            # Audio, or video before its first IDR
+            while entries and entries[0][0] < cutoff:
+                self.bytes -= len(entries.popleft()[2])
+        while self.bytes > self.max_bytes and len(entries) > 1:
+            self.bytes -= len(entries.popleft()[2])
+            while self.keyframes and self.keyframes[0][0] < entries[0][1]:
+                self.keyframes.popleft()
+
+    def snapshot(self, seconds=None):
+        """Chunks covering at least the last `seconds` (video: from an IDR), and their time span in seconds"""
+        with self.lock:
+            return self._snapshot(seconds)
+
+    def _snapshot(self, seconds):
+        if not self.entries:
+            return [], 0.0
+        newest = self.entries[-1][0]
+        cutoff = newest - int((self.seconds if seconds is None else seconds) * 1e9)
+        if self.scanner is not None:
+            if not self.keyframes:
+                # Nothing decodable buffered yet
+                return [], 0.0
+            start, start_ns = self.keyframes[0]
+            for offset, received_ns in self.keyframes:
+                if received_ns > cutoff:
+                    break
+                start, start_ns = offset, received_ns
+            chunks = []
+            for _, offset, data in self.entries:
+                end = offset + len(data)
+                if end <= start:
+                    continue
+                chunks.append(memoryview(data)[start - offset:] if offset < start else data)
+            return chunks, (newest - start_ns) / 1e9
+        chunks = [data for received_ns, _, data in self.entries if received_ns >= cutoff]
+        start_ns = next(received_ns for received_ns, _, _ in self.entries if received_ns >= cutoff)
+        return chunks, (newest - start_ns) / 1e9
+
+    def flush(self, path, seconds=None, follow=0.0, cancel=None, on_progress=None):
+        """Write the buffered past to `path` now; with follow > 0 keep appending live data for that many seconds
+
+        Returns a dict with the bytes and seconds written (seconds: span of the
+        buffer, then plus the time followed; buffered: span of the buffer only)
+        and the follower thread (None without follow). Setting the `cancel` event
+        ends the follow early; on_progress(result) is called from the follower
+        thread as live data is appended.
+        """
+        f = open(path, 'wb')
+        follower = Subscriber(f"{self.name} recorder") if follow > 0 else None
+        with self.lock:
+            chunks, span = self._snapshot(seconds)
+            if follower:
+                # Registered under the lock, so the next datagram goes to the file and none is missed
+                self.followers = self.followers + (follower,)
+        try:
+            for chunk in chunks:
+                f.write(chunk)
+        except Exception:
+            f.close()
+            self.remove_follower(follower)
+            raise
+        written = sum(len(chunk) for chunk in chunks)
+        result = {'path': path, 'bytes': written, 'seconds': span, 'buffered': span, 'thread': None}
+        if follower is None:
+            f.close()
+            return result
+        result['thread'] = threading.Thread(target=self.follow, args=(f, follower, follow, result, cancel, on_progress),
+                                            daemon=True)
+        result['thread'].start()
+        return result
+
+    def follow(self, f, follower, seconds, result, cancel=None, on_progress=None):
+        started = time.time_ns()
+        deadline = started + int(seconds * 1e9)
+        buffered = result['seconds']
+        try:
+            while not (cancel and cancel.is_set()):
+                for data, received_ns in follower.get_batch(timeout=0.2):
+                    if received_ns <= deadline:
+                        f.write(data)
+                        result['bytes'] += len(data)
+                now = time.time_ns()
+                result['seconds'] = buffered + (min(now, deadline) - started) / 1e9
+                if on_progress:
+                    on_progress(result)
+                if now > deadline:
+                    break
+        except Exception as e:
+            result['error'] = str(e)
+            self.log(f"{self.name} recording error: {str(e)}")
+        finally:
+            self.remove_follower(follower)
+            f.close()
+
+    def remove_follower(self, follower):
+        if follower is None:
+            return
+        with self.lock:
+            self.followers = tuple(f for f in self.followers if f is not follower)
+        follower.close()
+
+    def stats(self):
+        with self.lock:
+            span = (self.entries[-1][0] - self.entries[0][0]) / 1e9 if self.entries else 0.0
+            return {'bytes': self.bytes, 'datagrams': len(self.entries), 'seconds': span,
+                    'keyframes': len(self.keyframes)}
+
+
+def synthetic_h264(frames, gop=30, p_size=3000, idr_size=15000, seed=0):
+    """Frames of a fake but well-formed Annex-B stream: SPS/PPS/IDR every `gop` frames, P slices between"""
+    import random
+    rng = random.Random(seed)
+
+    def payload(n):
+        # No zero bytes, so the payload never contains a start code
+        return bytes(rng.randrange(1, 256) for _ in range(n))
+
+    for index in range(frames):
+        if index % gop == 0:
+            yield (b'\x00\x00\x00\x01\x67' + payload(12) + b'\x00\x00\x00\x01\x68' + payload(4)
+                   + b'\x00\x00\x00\x01\x65\x88' + payload(idr_size)), True
+        else:
+            yield b'\x00\x00\x00\x01\x41\x9a' + payload(p_size), False
+
+
+def self_check(seconds=5.0, fps=30, gop=30, datagram=1400):
+    from nal_scanner import NALScanner
+
+    stream = bytearray()
+    frame_starts = []
+    for frame, idr in synthetic_h264(fps * 20, gop):
+        frame_starts.append((len(stream), idr))
+        stream += frame
+
+    # Feed 20 s of stream time; every datagram gets the arrival time of the frame it starts in
+    buffer = PreRecordBuffer('video', seconds=seconds, scanner=NALScanner())
+    frame_index = 0
+    for offset in range(0, len(stream), datagram):
+        while frame_index + 1 < len(frame_starts) and frame_starts[frame_index + 1][0] <= offset:
+            frame_index += 1
+        buffer.feed(memoryview(stream)[offset:offset + datagram], int(frame_index * 1e9 / fps))
+
+    started = time.perf_counter()
+    chunks, span = buffer.snapshot(3.0)
+    flush_ms = (time.perf_counter() - started) * 1000
+    data = b''.join(chunks)
+    start = len(stream) - len(data)
+    aligned = (start, True) in frame_starts and data.startswith(b'\x00\x00\x00\x01\x67')
+    contiguous = data == bytes(stream[start:])
+    stats = buffer.stats()
+    print(f"Buffered {stats['bytes']} bytes / {stats['seconds']:.2f} s with {stats['keyframes']} keyframes "
+          f"for a {seconds:g} s window")
+    print(f"3 s snapshot: {len(data)} bytes covering {span:.2f} s, starts on an IDR: {aligned}, "
+          f"contiguous with the stream: {contiguous}, taken in {flush_ms:.3f} ms")
+    ok = aligned and contiguous and 3.0 <= span <= 3.0 + gop / fps and stats['seconds'] <= seconds + gop / fps
+    print("OK" if ok else "MISMATCH")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if self_check() else 1)
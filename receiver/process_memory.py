@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Current and peak resident memory of this process, without psutil
+
+Used by the enhancement service to recycle its worker when memory grows,
+and by the enhancement benchmarks. Linux reads /proc/self, Windows asks
+psapi through ctypes, anything else falls back to getrusage (peak only).
+"""
+
+import os
+import sys
+
+
+def _windows_counters():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+    return counters
+
+
+def _rusage_peak():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _proc_status(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def rss_bytes():
+    """Resident set size now"""
+    if sys.platform == 'win32':
+        return _windows_counters().WorkingSetSize
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return _rusage_peak()
+
+
+def peak_rss_bytes():
+    """Highest resident set size so far"""
+    if sys.platform == 'win32':
+        return _windows_counters().PeakWorkingSetSize
+    if os.path.exists('/proc/self/status'):
+        peak = _proc_status('VmHWM')
+        if peak is not None:
+            return peak
+    return _rusage_peak()
+
+
+if __name__ == "__main__":
+    print(f"RSS {rss_bytes() / 2**20:.1f} MB, peak {peak_rss_bytes() / 2**20:.1f} MB")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Sliding-window rate meter for frame, packet, byte and decision rates
+
+Events are kept in a deque of (monotonic time, amount) and expire from the
+left as the window slides, so adding an event and reading the rate are O(1)
+amortized, however high the event rate. This replaces rebuilding a list of
+frame times on every frame. A meter may be written and read from different
+threads.
+
+python rate_meter.py benchmarks it against the list rebuild at 30, 120 and
+1000 events/s.
+"""
+
+import sys
+import time
+import threading
+from collections import deque
+
+
+class RateMeter:
+    def __init__(self, window=1.0, clock=time.monotonic):
+        """
+        Args:
+            window: seconds of history the rate is computed over
+            clock: time source; monotonic so wall-clock steps do not distort rates
+        """
+        self.window = window
+        self.clock = clock
+        self.events = deque()
+        self.total = 0
+        self.started = None
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        events = self.events
+        while events and events[0][0] <= cutoff:
+            self.total -= events.popleft()[1]
+
+    def add(self, amount=1, now=None):
+        """Record `amount` (1 for an event, a byte count for traffic) at `now`"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            if self.started is None:
+                self.started = now
+            self.events.append((now, amount))
+            self.total += amount
+            self._expire(now)
+
+    def count(self, now=None):
+        """Sum of the amounts recorded within the last window"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            self._expire(now)
+            return self.total
+
+    def rate(self, now=None):
+        """Amount per second over the window (or since the first event, if that is shorter)"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            self._expire(now)
+            if self.started is None:
+                return 0.0
+            span = min(self.window, now - self.started)
+            return self.total / span if span > 0 else 0.0
+
+    def reset(self, now=None):
+        """Forget all events; the window restarts at `now` if given, else at the next event"""
+        with self.lock:
+            self.events.clear()
+            self.total = 0
+            self.started = now
+
+
+def list_rebuild_fps(frame_times, now):
+    """What read_frame_data used to do for every frame"""
+    frame_times.append(now)
+    frame_times = [t for t in frame_times if now - t <= 1.0]
+    return frame_times, len(frame_times)
+
+
+def benchmark(rates=(30, 120, 1000), seconds=60):
+    print(f"{'events/s':>9} {'list rebuild':>14} {'RateMeter':>12} {'speedup':>8} {'rate read':>10}")
+    for events_per_s in rates:
+        timestamps = [i / events_per_s for i in range(events_per_s * seconds)]
+
+        frame_times = []
+        started = time.perf_counter()
+        for now in timestamps:
+            frame_times, fps = list_rebuild_fps(frame_times, now)
+        list_us = (time.perf_counter() - started) / len(timestamps) * 1e6
+
+        meter = RateMeter(window=1.0)
+        started = time.perf_counter()
+        for now in timestamps:
+            meter.add(1, now)
+            count = meter.count(now)
+        meter_us = (time.perf_counter() - started) / len(timestamps) * 1e6
+
+        assert abs(count - fps) <= 1, (count, fps)
+        estimate = meter.rate(timestamps[-1])
+        assert abs(estimate - events_per_s) <= 0.02 * events_per_s + 1, estimate
+        print(f"{events_per_s:>9} {list_us:>11.2f} us {meter_us:>9.2f} us {list_us / meter_us:>7.1f}x "
+              f"{estimate:>10.1f}")
+
+
+if __name__ == "__main__":
+    benchmark([int(arg) for arg in sys.argv[1:]] or (30, 120, 1000))
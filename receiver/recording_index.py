@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+SQLite index of the recordings in the recording directory
+
+get_latest_recording used to glob recording/, stat every file to find the
+newest and then read its info_*.json; with thousands of recordings that
+was the slowest part of an enhancement request. StreamReceiver.record adds
+a row per recording as it starts and updates it when the recording
+finishes; the enhancer marks it when an enhanced output is written. Each
+row holds the paths, duration, the decision at recording time (mode,
+mode_code, s11_mean, the full info) and the enhancement status.
+
+Lookups go through B-tree indexes, O(log n):
+    newest()                status + created
+    by_mode(mode_code)      mode_code + created
+    between(start, end)     created
+    unenhanced()            partial index on created where not enhanced
+
+The index lives next to the recordings (recording/recordings.sqlite3), in
+WAL mode so the receiver, the enhancement worker and the batch CLI can use
+it at once. Recordings made before it existed are added by a rebuild,
+which scans the directory once:
+    python recording_index.py rebuild [recording_dir] [--output-dir after_process]
+    python recording_index.py newest | unenhanced | mode 2 | range 20250101_000000 20250102_000000
+    python recording_index.py            # compares with globbing on 5000 synthetic recordings
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import sqlite3
+import datetime
+import argparse
+import threading
+
+INDEX_NAME = "recordings.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    status TEXT NOT NULL,
+    audio_path TEXT,
+    audio_ts_path TEXT,
+    video_path TEXT,
+    info_path TEXT,
+    duration REAL,
+    mode TEXT,
+    mode_code INTEGER,
+    s11_mean REAL,
+    info TEXT,
+    enhanced_path TEXT,
+    enhanced_at REAL,
+    enhanced_mode_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS recordings_status_created ON recordings(status, created);
+CREATE INDEX IF NOT EXISTS recordings_mode_created ON recordings(mode_code, created);
+CREATE INDEX IF NOT EXISTS recordings_created ON recordings(created);
+CREATE INDEX IF NOT EXISTS recordings_unenhanced ON recordings(created) WHERE enhanced_path IS NULL;
+"""
+
+
+def id_time(recording_id, default=None):
+    """Unix time of a YYYYmmdd_HHMMSS[_n] recording id"""
+    try:
+        return datetime.datetime.strptime(recording_id[:15], "%Y%m%d_%H%M%S").timestamp()
+    except ValueError:
+        return default
+
+
+def index_path(recording_dir):
+    return os.path.join(recording_dir, INDEX_NAME)
+
+
+def wav_duration(path):
+    """Seconds of audio in a WAV, None if it is missing or unreadable"""
+    try:
+        with wave.open(path, 'rb') as reader:
+            return reader.getnframes() / reader.getframerate()
+    except (wave.Error, EOFError, OSError):
+        return None
+
+
+def open_index(recording_dir):
+    """The index of recording_dir if one has been created, else None"""
+    path = index_path(recording_dir)
+    return RecordingIndex(path) if os.path.exists(path) else None
+
+
+class RecordingIndex:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # True when this opened a new, empty index; the owner should rebuild() it from the directory
+        self.created = not os.path.exists(path)
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        # With WAL, commits need not wait for fsync; a crash can only lose the last few rows, which a rebuild restores
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if self.created:
+            # WAL is stored in the file, so only a new index needs it
+            with self.lock, self.db:
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.executescript(SCHEMA)
+
+    def add(self, recording_id, paths, info, status, created=None, duration=None):
+        """Insert or replace the row of a recording
+
+        Args:
+            paths: {'audio', 'audio_ts', 'video', 'info'} as in Recording.paths
+            info: the decision info written to info_<id>.json
+        """
+        info = info or {}
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO recordings (id, created, status, audio_path, audio_ts_path, video_path, "
+                "info_path, duration, mode, mode_code, s11_mean, info) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (recording_id, created if created is not None else time.time(), status, paths.get('audio'),
+                 paths.get('audio_ts'), paths.get('video'), paths.get('info'), duration, info.get('mode'),
+                 info.get('mode_code'), info.get('s11_mean'), json.dumps(info)))
+
+    def finish(self, recording_id, status, duration=None):
+        with self.lock, self.db:
+            self.db.execute("UPDATE recordings SET status = ?, duration = COALESCE(?, duration) WHERE id = ?",
+                            (status, duration, recording_id))
+
+    def mark_enhanced(self, audio_path, enhanced_path, mode_code=None):
+        """Record the enhanced output of the recording whose WAV is audio_path; False if it is not indexed"""
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "UPDATE recordings SET enhanced_path = ?, enhanced_at = ?, enhanced_mode_code = ? WHERE audio_path = ?",
+                (enhanced_path, time.time(), mode_code, os.path.abspath(audio_path)))
+            if cursor.rowcount:
+                return True
+            # Paths stored by another working directory: match on the recording id instead
+            recording_id = os.path.basename(audio_path)[len("audio_"):-len(".wav")]
+            cursor = self.db.execute(
+                "UPDATE recordings SET enhanced_path = ?, enhanced_at = ?, enhanced_mode_code = ? WHERE id = ?",
+                (enhanced_path, time.time(), mode_code, recording_id))
+            return bool(cursor.rowcount)
+
+    def _query(self, sql, args=()):
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, args)]
+
+    def get(self, recording_id):
+        rows = self._query("SELECT * FROM recordings WHERE id = ?", (recording_id,))
+        return rows[0] if rows else None
+
+    def newest(self, status='done'):
+        """Most recent recording with the given status (done: its WAV is ready)"""
+        rows = self._query("SELECT * FROM recordings WHERE status = ? ORDER BY created DESC LIMIT 1", (status,))
+        return rows[0] if rows else None
+
+    def by_mode(self, mode_code, limit=100):
+        """Newest first"""
+        return self._query("SELECT * FROM recordings WHERE mode_code = ? ORDER BY created DESC LIMIT ?",
+                           (mode_code, limit))
+
+    def between(self, start, end, limit=1000):
+        """Recordings started in [start, end) (unix time), oldest first"""
+        return self._query("SELECT * FROM recordings WHERE created >= ? AND created < ? ORDER BY created LIMIT ?",
+                           (start, end, limit))
+
+    def unenhanced(self, limit=1000):
+        """Finished recordings without an enhanced output, oldest first (limit -1: all)"""
+        return self._query("SELECT * FROM recordings INDEXED BY recordings_unenhanced WHERE enhanced_path IS NULL "
+                           "AND status = 'done' ORDER BY created LIMIT ?", (limit,))
+
+    def count(self, enhanced=None):
+        """All recordings, or only those with (True) or without (False) an enhanced output"""
+        condition = {None: "", True: " WHERE enhanced_path IS NOT NULL", False: " WHERE enhanced_path IS NULL"}[enhanced]
+        return self._query("SELECT COUNT(*) AS n FROM recordings" + condition)[0]['n']
+
+    def query_plan(self, sql, args=()):
+        return [row['detail'] for row in self._query("EXPLAIN QUERY PLAN " + sql, args)]
+
+    def rebuild(self, recording_dir, output_dir=None):
+        """Replace the index with one scan of recording_dir (and of output_dir for enhanced outputs)"""
+        recording_dir = os.path.abspath(recording_dir)
+        names = set(os.listdir(recording_dir))
+        enhanced = {}
+        if output_dir and os.path.isdir(output_dir):
+            for name in sorted(os.listdir(output_dir)):
+                if "_enhanced_mode" in name and name.endswith(".wav"):
+                    original, rest = name.split("_enhanced_mode", 1)
+                    try:
+                        mode_code = int(rest.split("_", 1)[0])
+                    except ValueError:
+                        mode_code = None
+                    # Sorted by name, so the newest output of a recording wins
+                    enhanced[original] = (os.path.join(os.path.abspath(output_dir), name), mode_code)
+
+        ids = set()
+        for name in names:
+            if (name.startswith("info_") and name.endswith(".json")) or \
+                    (name.startswith("audio_") and name.endswith((".wav", ".ts"))):
+                ids.add(name.split("_", 1)[1].rsplit(".", 1)[0])
+
+        records = []
+        for recording_id in sorted(ids):
+            paths = {'audio': os.path.join(recording_dir, f"audio_{recording_id}.wav"),
+                     'audio_ts': os.path.join(recording_dir, f"audio_{recording_id}.ts"),
+                     'video': os.path.join(recording_dir, f"video_{recording_id}.h264"),
+                     'info': os.path.join(recording_dir, f"info_{recording_id}.json")}
+            info = {}
+            if f"info_{recording_id}.json" in names:
+                try:
+                    with open(paths['info']) as f:
+                        info = json.load(f)
+                except (OSError, ValueError):
+                    pass
+            duration = wav_duration(paths['audio']) if f"audio_{recording_id}.wav" in names else None
+            status = 'failed' if duration is None else 'done'
+            created = id_time(recording_id)
+            if created is None:
+                existing = next((p for p in paths.values() if os.path.basename(p) in names), None)
+                created = os.path.getmtime(existing) if existing else 0.0
+            output = enhanced.get(f"audio_{recording_id}")
+            records.append((recording_id, created, status, paths['audio'], paths['audio_ts'], paths['video'],
+                            paths['info'], duration, info.get('mode'), info.get('mode_code'), info.get('s11_mean'),
+                            json.dumps(info), output[0] if output else None,
+                            os.path.getmtime(output[0]) if output else None, output[1] if output else None))
+
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM recordings")
+            self.db.executemany("INSERT INTO recordings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+        with self.lock:
+            # Fold the rebuilt table into the main file so later connections open a small WAL
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return len(records)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def self_check(count=5000):
+    """Globbing get_latest_recording against the index on count synthetic recordings"""
+    import tempfile
+    import shutil
+    import audio_enhancer
+
+    directory = tempfile.mkdtemp(prefix="recording_index_")
+    recording_dir = os.path.join(directory, "recording")
+    os.makedirs(recording_dir)
+    start = datetime.datetime(2025, 1, 1)
+    for index in range(count):
+        recording_id = (start + datetime.timedelta(minutes=index)).strftime("%Y%m%d_%H%M%S")
+        with wave.open(os.path.join(recording_dir, f"audio_{recording_id}.wav"), 'wb') as writer:
+            writer.setnchannels(1)
+            writer.setsampwidth(2)
+            writer.setframerate(16000)
+            writer.writeframes(bytes(2 * 16000 * (1 + index % 3)))
+        with open(os.path.join(recording_dir, f"info_{recording_id}.json"), 'w') as f:
+            json.dump({'timestamp': recording_id, 'mode': "Light AV Mode", 'mode_code': index % 5,
+                       's11_mean': -10.0 - index % 7}, f)
+    newest_id = recording_id
+
+    started = time.perf_counter()
+    index = RecordingIndex(index_path(recording_dir))
+    rebuilt = index.rebuild(recording_dir)
+    rebuild_seconds = time.perf_counter() - started
+
+    def timed(function, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = function()
+        return result, (time.perf_counter() - started) / repeat * 1000
+
+    # The old lookup; audio_enhancer uses the index once it exists, so hide it for the comparison
+    os.rename(index_path(recording_dir), index_path(recording_dir) + ".hidden")
+    (glob_path, glob_info), glob_ms = timed(lambda: audio_enhancer.get_latest_recording(recording_dir), 5)
+    os.rename(index_path(recording_dir) + ".hidden", index_path(recording_dir))
+    (index_path_, index_info), index_ms = timed(lambda: audio_enhancer.get_latest_recording(recording_dir), 50)
+    _, newest_ms = timed(index.newest, 200)
+    by_mode, mode_ms = timed(lambda: index.by_mode(3, limit=10), 200)
+    window = id_time(newest_id) - 3600
+    in_range, range_ms = timed(lambda: index.between(window, window + 3600), 200)
+    index.mark_enhanced(glob_path, os.path.join(directory, "enhanced.wav"), 2)
+    unenhanced, unenhanced_ms = timed(lambda: index.unenhanced(limit=10), 200)
+
+    print(f"Rebuilt the index of {rebuilt} recordings in {rebuild_seconds:.2f} s")
+    print(f"get_latest_recording: glob + ctime {glob_ms:.1f} ms, index {index_ms:.2f} ms")
+    print(f"newest {newest_ms:.3f} ms, by mode {mode_ms:.3f} ms, last hour {range_ms:.3f} ms ({len(in_range)} rows), "
+          f"unenhanced {unenhanced_ms:.3f} ms")
+    plans = {
+        'newest': index.query_plan("SELECT * FROM recordings WHERE status = ? ORDER BY created DESC LIMIT 1",
+                                   ('done',)),
+        'by_mode': index.query_plan("SELECT * FROM recordings WHERE mode_code = ? ORDER BY created DESC LIMIT 10",
+                                    (3,)),
+        'between': index.query_plan("SELECT * FROM recordings WHERE created >= ? AND created < ? ORDER BY created",
+                                    (0, 1)),
+        'unenhanced': index.query_plan("SELECT * FROM recordings INDEXED BY recordings_unenhanced "
+                                       "WHERE enhanced_path IS NULL AND status = 'done' ORDER BY created LIMIT 10"),
+    }
+    for name, plan in plans.items():
+        print(f"  {name}: {'; '.join(plan)}")
+    index.close()
+    shutil.rmtree(directory)
+
+    ok = (rebuilt == count and os.path.basename(index_path_) == os.path.basename(glob_path) == f"audio_{newest_id}.wav"
+          and index_info == glob_info and all(row['mode_code'] == 3 for row in by_mode) and len(in_range) == 60
+          and unenhanced[0]['id'] != newest_id and all('USING' in ' '.join(plan) for plan in plans.values()))
+    print("OK" if ok else "MISMATCH")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recording index")
+    parser.add_argument("command", nargs="?", choices=['rebuild', 'newest', 'unenhanced', 'mode', 'range', 'check'],
+                        default='check')
+    parser.add_argument("args", nargs="*")
+    parser.add_argument("--recording-dir", default=os.path.join(os.getcwd(), "recording"))
+    parser.add_argument("--output-dir", default=os.path.join(os.getcwd(), "after_process"))
+    options = parser.parse_args()
+
+    if options.command == 'check':
+        return self_check()
+    if options.command == 'rebuild':
+        recording_dir = options.args[0] if options.args else options.recording_dir
+        started = time.perf_counter()
+        count = RecordingIndex(index_path(recording_dir)).rebuild(recording_dir, options.output_dir)
+        print(f"Indexed {count} recordings from {recording_dir} in {time.perf_counter() - started:.2f} s")
+        return True
+
+    index = open_index(options.recording_dir)
+    if index is None:
+        print(f"No index in {options.recording_dir}; run: python recording_index.py rebuild")
+        return False
+    if options.command == 'newest':
+        rows = [index.newest()]
+    elif options.command == 'unenhanced':
+        rows = index.unenhanced()
+    elif options.command == 'mode':
+        rows = index.by_mode(int(options.args[0]))
+    else:
+        rows = index.between(id_time(options.args[0], 0), id_time(options.args[1], time.time()))
+    for row in rows:
+        if row:
+            enhanced = os.path.basename(row['enhanced_path']) if row['enhanced_path'] else "not enhanced"
+            print(f"{row['id']}  {row['status']:<9} mode {row['mode_code']}  "
+                  f"{row['duration'] or 0:6.1f} s  {enhanced}")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+In-process RTT probing against the sender's timestamp port
+
+Replaces the ping subprocess the network monitor used to spawn whenever the
+timestamp query failed. RTTProber runs on its own thread at a configurable
+rate and sends small UDP probes to the timestamp service: binary
+FRAME_REQUESTs when the sender speaks the binary protocol (the RTT then
+excludes the sender's processing time and every exchange also feeds
+ClockSync), otherwise the legacy TIMESTAMP command.
+
+After each probe the window statistics are recomputed and published as one
+immutable tuple, so readers such as the metrics loop never wait on the
+probe thread.
+
+python rtt_prober.py probes a local stand-in sender.
+"""
+
+import sys
+import time
+import socket
+import threading
+from collections import deque, namedtuple
+import timestamp_protocol
+from clock_sync import exchange
+
+# RTTs in milliseconds over the current window; loss is the fraction of unanswered probes
+RTTStats = namedtuple('RTTStats', ['count', 'last', 'min', 'p50', 'p90', 'p99', 'max', 'loss', 'updated'])
+EMPTY_STATS = RTTStats(0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+
+def percentile(ordered, p):
+    return ordered[min(int(p / 100.0 * len(ordered)), len(ordered) - 1)]
+
+
+class RTTProber:
+    def __init__(self, sender_ip, port=5102, rate=2.0, window=60, timeout=0.5, clock_sync=None, log=print):
+        """
+        Args:
+            rate: probes per second
+            window: number of recent probes the statistics cover
+            timeout: seconds before a probe counts as lost
+            clock_sync: optional ClockSync fed with every binary exchange
+        """
+        self.addr = (sender_ip, port)
+        self.rate = rate
+        self.timeout = timeout
+        self.clock_sync = clock_sync
+        self.log = log
+        # RTT in ms, or None for a lost probe
+        self.samples = deque(maxlen=window)
+        self.stats = EMPTY_STATS
+        self.version = 0
+        self.sent = 0
+        self.lost = 0
+        self.running = False
+        self.thread = None
+
+    def negotiate(self, sock):
+        sock.sendto(timestamp_protocol.pack_hello(), self.addr)
+        try:
+            while True:
+                data, _ = sock.recvfrom(1024)
+                if timestamp_protocol.is_binary(data):
+                    version, msg_type, _ = timestamp_protocol.unpack(data)
+                    if msg_type == timestamp_protocol.MSG_HELLO_ACK:
+                        return version
+        except (socket.timeout, ValueError):
+            return 0
+        except OSError:
+            # e.g. ICMP port unreachable on Windows while the sender is down
+            return 0
+
+    def probe(self, sock):
+        """One probe; returns the RTT in ms or None if it was lost"""
+        try:
+            if self.version:
+                sample = exchange(sock, self.addr, version=self.version)
+                if self.clock_sync is not None:
+                    self.clock_sync.add(sample)
+                return ((sample.t4 - sample.t1) - (sample.t3 - sample.t2)) / 1e6
+
+            started = time.perf_counter()
+            sock.sendto(b'TIMESTAMP', self.addr)
+            while True:
+                data, _ = sock.recvfrom(1024)
+                if not timestamp_protocol.is_binary(data):
+                    return (time.perf_counter() - started) * 1000
+        except (socket.timeout, OSError):
+            return None
+
+    def publish(self):
+        answered = sorted(rtt for rtt in self.samples if rtt is not None)
+        loss = 1.0 - len(answered) / len(self.samples) if self.samples else 0.0
+        if not answered:
+            self.stats = EMPTY_STATS._replace(loss=loss, updated=time.time())
+            return
+        last = next((rtt for rtt in reversed(self.samples) if rtt is not None), 0.0)
+        self.stats = RTTStats(len(answered), last, answered[0], percentile(answered, 50),
+                              percentile(answered, 90), percentile(answered, 99), answered[-1], loss, time.time())
+
+    def run(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(self.timeout)
+        interval = 1.0 / self.rate
+        try:
+            self.version = self.negotiate(sock)
+            self.log(f"RTT prober started for {self.addr[0]}:{self.addr[1]} at {self.rate:g} Hz "
+                     f"({'binary v%d' % self.version if self.version else 'legacy text'})")
+            next_probe = time.monotonic()
+            while self.running:
+                rtt = self.probe(sock)
+                self.sent += 1
+                if rtt is None:
+                    self.lost += 1
+                    if self.lost % 10 == 0:
+                        # The sender may have come back (or been upgraded) since we negotiated
+                        self.version = self.negotiate(sock)
+                self.samples.append(rtt)
+                self.publish()
+
+                next_probe += interval
+                delay = next_probe - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_probe = time.monotonic()
+        except Exception as e:
+            self.log(f"RTT prober error: {str(e)}")
+        finally:
+            sock.close()
+
+    def latest(self):
+        """Most recent window statistics; never blocks"""
+        return self.stats
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=self.timeout + 1.0 / self.rate + 1)
+
+
+def demo(duration=5.0, rate=20.0, port=15124):
+    """Probe a local stand-in sender with up to 2 x 4 ms of random queueing delay"""
+    from clock_sync import ClockSync, SkewedSender
+
+    sender = SkewedSender(port)
+    threading.Thread(target=sender.serve, daemon=True).start()
+    sync = ClockSync()
+    prober = RTTProber('127.0.0.1', port, rate=rate, clock_sync=sync)
+    prober.start()
+    time.sleep(duration)
+
+    # Reading the statistics is a plain attribute load
+    started = time.perf_counter()
+    for _ in range(100000):
+        stats = prober.latest()
+    read_us = (time.perf_counter() - started) / 100000 * 1e6
+    prober.stop()
+    sender.running = False
+
+    print(f"{prober.sent} probes, {prober.lost} lost; RTT ms p50 {stats.p50:.3f} p90 {stats.p90:.3f} "
+          f"p99 {stats.p99:.3f} (min {stats.min:.3f}, max {stats.max:.3f})")
+    print(f"Clock offset estimate {sync.offset_at() / 1e6:.3f} ms (true {sender.offset_ns / 1e6:.0f} ms plus drift); "
+          f"latest() takes {read_us:.3f} us")
+
+    # A port nobody answers: every probe times out and counts as lost
+    silent = RTTProber('127.0.0.1', port + 1, rate=rate, timeout=0.1)
+    silent.start()
+    time.sleep(1.0)
+    silent.stop()
+    print(f"Silent port: {silent.sent} probes, loss {silent.latest().loss:.0%}")
+
+
+if __name__ == "__main__":
+    demo(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0)
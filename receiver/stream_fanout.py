@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Single ingest for the media multicast streams, fanned out to subscribers
+
+Every consumer used to open the multicast group itself: ffplay for
+playback, an ffmpeg per recording, ffprobe for stream info, so each
+datagram was received and demuxed several times. Now StreamSniffer reads
+each socket once and StreamFanout hands every datagram to the subscribers
+of that stream:
+
+- analyzers (NALScanner, TSAnalyzer, FrameLatencyMonitor) stay synchronous
+  sniffer handlers, they only look at a few bytes;
+- everything slower gets a Subscriber with a bounded queue that drops the
+  oldest datagrams when the consumer falls behind, so a stalled player or
+  recorder never blocks the ingest thread or the other subscribers;
+- PipeSubscriber feeds a queue into the stdin of a process (ffplay,
+  ffmpeg), replacing its udp:// input.
+
+The datagram is copied once per arrival and the same bytes object is shared
+by all subscribers. Subscribers attach and detach at runtime.
+
+python stream_fanout.py attaches and detaches subscribers while a synthetic
+stream is replayed on loopback.
+"""
+
+import sys
+import time
+import threading
+import subprocess
+from collections import deque
+
+
+class Subscriber:
+    def __init__(self, name, maxlen=1024):
+        """
+        Args:
+            maxlen: datagrams buffered before the oldest are dropped (1024 x 1400 B is about 1.4 MB)
+        """
+        self.name = name
+        self.queue = deque(maxlen=maxlen)
+        self.ready = threading.Event()
+        self.received = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, data, received_ns):
+        """Called on the ingest thread; never blocks"""
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append((data, received_ns))
+        self.received += 1
+        self.ready.set()
+
+    def get_batch(self, timeout=1.0):
+        """Every queued (data, received_ns), waiting up to timeout for the first one"""
+        if not self.queue:
+            self.ready.wait(timeout)
+        # Clear before draining: a put() after this point sets the event again
+        self.ready.clear()
+        batch = []
+        queue = self.queue
+        while queue:
+            batch.append(queue.popleft())
+        return batch
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    def stats(self):
+        return {'received': self.received, 'dropped': self.dropped, 'queued': len(self.queue)}
+
+
+class PipeSubscriber(Subscriber):
+    """Writes the stream into the stdin of a child process, e.g. ffplay -i pipe:0"""
+
+    def __init__(self, name, cmd, log=print, maxlen=1024, on_exit=None):
+        super().__init__(name, maxlen)
+        self.cmd = cmd
+        self.log = log
+        self.on_exit = on_exit
+        self.process = None
+        self.thread = None
+
+    def start(self, **popen_args):
+        self.process = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, **popen_args)
+        self.thread = threading.Thread(target=self.pump, daemon=True)
+        self.thread.start()
+        return self.process
+
+    def pump(self):
+        try:
+            while self.process.poll() is None:
+                batch = self.get_batch()
+                if batch:
+                    self.process.stdin.write(b''.join(data for data, _ in batch))
+                    self.process.stdin.flush()
+                elif self.closed:
+                    # Detached and drained; closing stdin lets the process finish its output
+                    break
+        except (BrokenPipeError, OSError, ValueError):
+            # The process exited (e.g. ffmpeg reached -t) or stdin was closed by stop()
+            pass
+        finally:
+            self.closed = True
+            try:
+                self.process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+            if self.on_exit:
+                self.on_exit(self)
+
+    def stop(self, timeout=5):
+        self.close()
+        if self.thread:
+            self.thread.join(timeout=2)
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class StreamFanout:
+    def __init__(self, sniffer, log=print):
+        self.sniffer = sniffer
+        self.log = log
+        # Replaced, never mutated, so the ingest thread can iterate without a lock
+        self.subscribers = {name: () for name in sniffer.streams}
+        self.lock = threading.Lock()
+        for name in sniffer.streams:
+            sniffer.add_handler(name, self.make_handler(name))
+
+    def make_handler(self, name):
+        def handler(view, received_ns):
+            subscribers = self.subscribers[name]
+            if subscribers:
+                data = bytes(view)
+                for subscriber in subscribers:
+                    subscriber.put(data, received_ns)
+        return handler
+
+    def attach(self, name, subscriber):
+        with self.lock:
+            if subscriber.closed:
+                # Already finished (e.g. its process exited); it would never be detached again
+                return subscriber
+            self.subscribers[name] = self.subscribers[name] + (subscriber,)
+        self.log(f"Attached {subscriber.name} to the {name} stream")
+        return subscriber
+
+    def detach(self, name, subscriber):
+        with self.lock:
+            if subscriber not in self.subscribers[name]:
+                return
+            self.subscribers[name] = tuple(s for s in self.subscribers[name] if s is not subscriber)
+        subscriber.close()
+        self.log(f"Detached {subscriber.name} from the {name} stream "
+                 f"({subscriber.received} datagrams, {subscriber.dropped} dropped)")
+
+    def attach_pipe(self, name, subscriber_name, cmd, **popen_args):
+        """Start cmd with the stream on its stdin; it detaches itself when the process exits"""
+        subscriber = PipeSubscriber(subscriber_name, cmd, log=self.log,
+                                    on_exit=lambda s: self.detach(name, s))
+        # Attach before starting, so an immediate exit detaches a subscriber that is really attached
+        self.attach(name, subscriber)
+        try:
+            subscriber.start(**popen_args)
+        except Exception:
+            self.detach(name, subscriber)
+            raise
+        return subscriber
+
+    def close(self):
+        for name, subscribers in list(self.subscribers.items()):
+            for subscriber in subscribers:
+                self.detach(name, subscriber)
+                if isinstance(subscriber, PipeSubscriber):
+                    subscriber.stop()
+
+    def snapshot(self):
+        return {name: {s.name: s.stats() for s in subscribers} for name, subscribers in self.subscribers.items()}
+
+
+def demo(group='239.0.0.1', video_port=15110, audio_port=15111, duration=4.0):
+    from stream_sniffer import StreamSniffer, replay
+
+    sniffer = StreamSniffer(group, {'video': (video_port, False), 'audio': (audio_port, True)})
+    fanout = StreamFanout(sniffer)
+    sniffer.start()
+    time.sleep(0.5)
+
+    # A child process that counts the bytes it reads, standing in for ffplay / ffmpeg
+    counter_cmd = [sys.executable, '-c',
+                   "import sys; n = 0\n"
+                   "for chunk in iter(lambda: sys.stdin.buffer.read(65536), b''): n += len(chunk)\n"
+                   "print(n)"]
+    player = fanout.attach_pipe('video', 'player', counter_cmd, stdout=subprocess.PIPE)
+    collector = fanout.attach('audio', Subscriber('collector'))
+    # A subscriber nobody reads: bounded, drops the oldest datagrams
+    stalled = fanout.attach('audio', Subscriber('stalled', maxlen=16))
+
+    replayer = threading.Thread(target=replay, args=(group, video_port, audio_port, duration))
+    replayer.start()
+
+    # A recorder attaching halfway through and leaving a second later
+    time.sleep(duration / 2)
+    late = fanout.attach('video', Subscriber('late recorder'))
+    time.sleep(1.0)
+    fanout.detach('video', late)
+    replayer.join()
+    time.sleep(0.5)
+
+    audio_bytes = sum(len(data) for data, _ in collector.get_batch(0))
+    snapshot = fanout.snapshot()
+    fanout.detach('video', player)
+    player.thread.join(timeout=5)
+    piped = int(player.process.stdout.read() or 0)
+    player.process.wait(timeout=5)
+    fanout.close()
+    sniffer.stop()
+
+    totals = sniffer.snapshot()
+    print(f"Sniffer: video {totals['video']['bytes']} bytes, audio {totals['audio']['bytes']} bytes (one socket each)")
+    print(f"Player process read {piped} bytes, collector {audio_bytes} bytes")
+    print(f"Late recorder got {late.received} datagrams while attached; stalled subscriber {snapshot['audio']['stalled']}")
+    ok = piped == totals['video']['bytes'] and audio_bytes == totals['audio']['bytes'] \
+        and 0 < late.received < totals['video']['packets'] and stalled.dropped > 0 and len(stalled.queue) <= 16
+    print("OK" if ok else "MISMATCH")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if demo() else 1)
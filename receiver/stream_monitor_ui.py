@@ -6,14 +6,13 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import time
 import sys
-import os
-import threading
-import subprocess
 from stream_receiver import StreamReceiver
+from recording import DONE
+from enhancement_service import EnhancementService
 from stream_monitor_utils import check_ffmpeg_installation
 
 class StreamMonitorUI:
-    def __init__(self, sender_ip=""):
+    def __init__(self, sender_ip="", enhancer_backend='registry', live_enhancement=None):
         self.sender_ip = sender_ip
         self.root = tk.Tk()
         self.root.title("Audio/Video Stream Quality Monitor")
@@ -23,12 +22,15 @@ class StreamMonitorUI:
         if not ffmpeg_available:
             print("WARNING: FFmpeg not found. Recording disabled.")
         
-        self.receiver = StreamReceiver(sender_ip)
+        self.receiver = StreamReceiver(sender_ip, live_enhancement=live_enhancement)
         self.receiver.set_callbacks(
             log_callback=self.update_log,
             metrics_callback=self.update_metrics,
             decision_callback=self.update_decision
         )
+        # 常驻增强进程，模型只加载一次；启动时即在后台预热
+        self.enhancement_service = EnhancementService(enhancer_backend, log=lambda message: self.root.after(0, self.update_log, message))
+        self.enhancement_service.start()
         self.setup_ui()
     
     def setup_ui(self):
@@ -94,6 +96,15 @@ class StreamMonitorUI:
         self.connection_status_label = ttk.Label(metrics_frame, text="Not Connected")
         self.connection_status_label.grid(row=row, column=3, sticky=tk.W, padx=5, pady=2)
         
+        row += 1
+        ttk.Label(metrics_frame, text="Audio Jitter:").grid(row=row, column=0, sticky=tk.W, padx=5, pady=2)
+        self.jitter_label = ttk.Label(metrics_frame, text="0.0 ms")
+        self.jitter_label.grid(row=row, column=1, sticky=tk.W, padx=5, pady=2)
+        
+        ttk.Label(metrics_frame, text="Loss Bursts:").grid(row=row, column=2, sticky=tk.W, padx=5, pady=2)
+        self.loss_bursts_label = ttk.Label(metrics_frame, text="0")
+        self.loss_bursts_label.grid(row=row, column=3, sticky=tk.W, padx=5, pady=2)
+        
         decision_frame = ttk.LabelFrame(self.root, text="Processing Mode Decision", padding=10)
         decision_frame.pack(fill=tk.X, padx=10, pady=5)
         
@@ -181,6 +192,9 @@ class StreamMonitorUI:
             self.video_latency_label.config(text=f"{metrics['video_latency']} ms")
             self.audio_latency_label.config(text=f"{metrics['audio_latency']} ms")
             self.packet_loss_label.config(text=f"{metrics['packet_loss']:.1f} %")
+            self.jitter_label.config(text=f"{metrics['jitter']:.1f} ms")
+            bursts = metrics['loss_bursts']
+            self.loss_bursts_label.config(text=f"{bursts['events']} (max {bursts['max']} packets)")
             
             self.connection_status_label.config(text="Connected" if metrics['connected'] else "Not Connected")
             self.record_button.state(['!disabled'] if metrics['connected'] else ['disabled'])
@@ -299,14 +313,20 @@ class StreamMonitorUI:
             self.update_log("Error: Start receiving first")
             return False
         
-        self.record_button.state(['disabled'])
-        success = self.receiver.record(3)
-        if success:
-            self.root.after(4000, lambda: self.record_button.state(['!disabled']))
-            self.root.after(3500, lambda: self.update_log("Recording completed"))
+        # record() returns at once; callbacks arrive on worker threads and are passed to Tk with root.after
+        recording = self.receiver.record(3)
+        if not recording:
+            self.update_log("Error: Recording could not start")
+            return False
+        self.update_log(f"Recording {recording.id} saved from the last {recording.duration} s")
+        recording.add_done_callback(lambda r: self.root.after(0, self.recording_finished, r))
+        return True
+    
+    def recording_finished(self, recording):
+        if recording.status == DONE:
+            self.update_log(f"Recording completed: {recording.id} ({recording.bytes} bytes)")
         else:
-            self.record_button.state(['!disabled'])
-        return success
+            self.update_log(f"Recording {recording.id} {recording.status}" + (f": {recording.error}" if recording.error else ""))
     
     def enhance_latest_audio(self):
         """Enhance the latest recorded audio file using the Denoiser model"""
@@ -315,55 +335,42 @@ class StreamMonitorUI:
         # Disable the enhance button to prevent multiple clicks
         self.enhance_button.state(['disabled'])
         
-        # Create and start enhancement thread
-        enhance_thread = threading.Thread(
-            target=self._run_enhancer_process,
-            daemon=True
-        )
-        enhance_thread.start()
+        # submit() only queues the job, so no extra thread is needed
+        self._run_enhancer_process()
     
     def _run_enhancer_process(self):
-        """Run the enhancer process in a separate thread"""
-        print(f"Run the enhancer process")
+        """Hand the job to the warm enhancement service and report back on the Tk thread"""
         try:
-            # Get the current directory
-            current_dir = os.getcwd()
-            enhancer_script = os.path.join(current_dir, "audio_enhancer.py")
-            recording_dir = self.receiver.recording_dir
-            
-            # Run the enhancer script as a subprocess
-            process = subprocess.Popen(
-                [sys.executable, enhancer_script, recording_dir],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1
-            )
-            
-            # Read stdout in real-time and schedule UI updates in the main thread
-            for line in process.stdout:
-                try:
-                    line_text = line.strip()
-                    self.root.after(0, lambda msg=line_text: self.update_log(msg))
-                except Exception as e:
-                    print(f"Error scheduling log update: {str(e)}")
-            
-            # Check for errors
-            stderr = process.stderr.read()
-            if stderr:
-                self.root.after(0, lambda: self.update_log(f"Error: {stderr}"))
-            
-            process.wait()
-            if process.returncode != 0:
-                self.root.after(0, lambda: self.update_log(f"Enhancement process failed with code {process.returncode}"))
-            
-            # Re-enable the enhance button
-            self.root.after(0, lambda: self.enhance_button.state(['!disabled']))
+            future = self.enhancement_service.submit(
+                recording_dir=self.receiver.recording_dir,
+                on_progress=lambda message: self.root.after(0, self.enhancement_progress, message))
+            future.add_done_callback(lambda f: self.root.after(0, self.enhancement_finished, f))
         except Exception as e:
-            print(f"Enhancement thread error: {str(e)}")
-            self.root.after(0, lambda: self.update_log(f"Error: {str(e)}"))
+            msg = str(e)
+            print(f"Enhancement error: {msg}")
+            # e is unbound once the except block ends, before the callback runs
+            self.root.after(0, lambda msg=msg: self.update_log(f"Error: {msg}"))
             self.root.after(0, lambda: self.enhance_button.state(['!disabled']))
     
+    def enhancement_progress(self, message):
+        # 只在阶段变化时记录，避免逐块进度刷屏
+        if message['message']:
+            self.update_log(message['message'])
+        elif message['stage'] != getattr(self, 'enhancement_stage', None):
+            self.update_log(f"Enhancement {message['stage']}...")
+        self.enhancement_stage = message['stage']
+    
+    def enhancement_finished(self, future):
+        try:
+            result = future.result()
+            self.update_log(f"Successfully enhanced audio: {result['output_path']} ({result['seconds']:.1f} s)")
+            if result['info']:
+                self.update_log(f"Using enhancement mode: {result['info']['mode']} (code: {result['info']['mode_code']})")
+        except Exception as e:
+            self.update_log(f"Enhancement failed: {str(e)}")
+        # Re-enable the enhance button
+        self.enhance_button.state(['!disabled'])
+    
     def run(self):
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.root.mainloop()
@@ -371,12 +378,16 @@ class StreamMonitorUI:
     def on_closing(self):
         if self.receiver.running:
             self.stop()
+        self.enhancement_service.stop()
         self.root.destroy()
 
 if __name__ == "__main__":
     sender_ip = sys.argv[1] if len(sys.argv) > 1 else "192.168.1.1"
+    # Optional second argument: live enhancement of the played audio:
+    # 'mode' (model follows the decision mode), or a fixed 'stub', 'dns48', 'dns64' or 'passthrough'
+    live_enhancement = sys.argv[2] if len(sys.argv) > 2 else None
     try:
-        monitor = StreamMonitorUI(sender_ip)
+        monitor = StreamMonitorUI(sender_ip, live_enhancement=live_enhancement)
         monitor.run()
     except ImportError as e:
         print(f"Error: {e}\nInstall dependencies: pip install matplotlib numpy psutil")
@@ -1,7 +1,5 @@
 #!/usr/bin/env python3
 import os
-import sys
-import re
 import subprocess
 
 def check_directory_permissions(directory_path, log_function=None):
@@ -30,22 +28,6 @@ def check_directory_permissions(directory_path, log_function=None):
                 log_function(f"Failed to fix permissions: {str(e)}")
             return False
 
-def measure_latency(target_ip, log_function=None):
-    try:
-        ping_cmd = ['ping', '-n', '1', '-w', '1000'] if sys.platform.startswith('win') else ['ping', '-c', '1', '-W', '1']
-        ping_cmd.append(target_ip)
-        result = subprocess.run(ping_cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            match = re.search(r'time[=<](\d+)ms' if sys.platform.startswith('win') else r'time=([\d.]+) ms', result.stdout)
-            if match:
-                return float(match.group(1))
-        return 999
-    except Exception as e:
-        if log_function:
-            log_function(f"Latency measurement error: {str(e)}")
-        return 999
-
 def check_ffmpeg_installation(log_function=None):
     try:
         result = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
@@ -4,13 +4,26 @@ import threading
 import time
 import datetime
 import socket
-import psutil
 import json
 import os
 import queue
 import re
 from collections import deque
-from stream_monitor_utils import measure_latency, check_directory_permissions
+from concurrent.futures import ThreadPoolExecutor
+from stream_monitor_utils import check_directory_permissions
+import timestamp_protocol
+from clock_sync import ClockSync, exchange
+from frame_latency import FrameLatencyMonitor
+from stream_sniffer import StreamSniffer, RateTracker
+from stream_fanout import StreamFanout
+from live_enhancer import FFmpegAudioDecoder, PlayerSink, LiveEnhancer, load_processor, processor_for
+from model_registry import ModelRegistry
+from recording_index import RecordingIndex, index_path, wav_duration
+from rtt_prober import RTTProber
+from rate_meter import RateMeter
+from nal_scanner import NALScanner
+from prerecord_buffer import PreRecordBuffer
+from recording import Recording, CONVERTING, DONE, FAILED, CANCELLED
 
 # 全局调试设置 - 设置为True启用详细日志，False禁用大多数日志
 DEBUG = False
@@ -83,21 +96,27 @@ class ThreadSafeLogger:
                 print(f"Log processing error: {str(e)}")
 
 class StreamReceiver:
-    def __init__(self, sender_ip, multicast_addr='239.0.0.1', video_port=5100, audio_port=5101, timestamp_port=5102, decision_port=5103):
+    def __init__(self, sender_ip, multicast_addr='239.0.0.1', video_port=5100, audio_port=5101, timestamp_port=5102, decision_port=5103,
+                 decision_multicast_port=5104, pre_record_seconds=10, live_enhancement=None):
         self.sender_ip = sender_ip
         self.multicast_addr = multicast_addr
         self.video_port = video_port
         self.audio_port = audio_port
         self.timestamp_port = timestamp_port
         self.decision_port = decision_port
+        self.decision_multicast_port = decision_multicast_port
         
         self.video_process = None
         self.audio_process = None
-        self.monitor_process = None
+        # 实时增强: None 时直接播放组播音频; 'mode' 按决策模式切换模型, 否则为固定的 'stub' / 'dns48' / 'dns64' / 'passthrough'
+        self.live_enhancement = live_enhancement
+        self.live_enhancer = None
+        self.model_registry = None
+        if live_enhancement == 'mode':
+            self.model_registry = ModelRegistry(log=lambda message: self.log(message, force=True))
         self.decision_socket = None
         self.decision_thread = None
-        self.record_process_video = None
-        self.record_process_audio = None
+        self.decision_listener_thread = None
         
         # Callbacks
         self.log_callback = None
@@ -107,10 +126,19 @@ class StreamReceiver:
         # Initialize thread-safe logger
         self.thread_safe_logger = ThreadSafeLogger(file_path="stream_monitor.log")
         
-        # Recording
-        self.recording = False
+        # Recording; several may run at once, each tracked by its Recording handle
+        self.recordings = {}
+        self.recording_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="recording")
         self.recording_dir = os.path.join(os.getcwd(), "recording")
         os.makedirs(self.recording_dir, exist_ok=True)
+        # 录制索引: 增强器按索引查找最新/未增强的录制，无需扫描目录
+        self.recording_index = RecordingIndex(index_path(self.recording_dir))
+        if self.recording_index.created or (self.recording_index.count() == 0 and any(
+                name.startswith("audio_") for name in os.listdir(self.recording_dir))):
+            # 新建(或仍为空)的索引: 先扫描一次目录，收录索引建立之前的录制
+            indexed = self.recording_index.rebuild(self.recording_dir, os.path.join(os.getcwd(), "after_process"))
+            if indexed:
+                self.log(f"Indexed {indexed} existing recordings in {self.recording_dir}", force=True)
         
         # Metrics
         self.video_bitrate = 0
@@ -119,6 +147,7 @@ class StreamReceiver:
         self.video_latency = 0
         self.audio_latency = 0
         self.packet_loss = 0
+        self.jitter = 0
         
         # Decision data
         self.processing_mode = "Unknown"
@@ -127,16 +156,48 @@ class StreamReceiver:
         self.defuzzified_value = 0
         self.last_decision_time = 0
         
+        # Multicast decision push; the TCP poll only runs while this is stale
+        self.decision_seq = None
+        self.decision_sent_at = 0
+        self.decision_gaps = 0
+        self.last_multicast_decision_time = 0
+        self.decision_stale_after = 15
+        
         # History
         self.window_size = 30
         self.bitrate_history = deque(maxlen=self.window_size)
         self.latency_history = deque(maxlen=self.window_size)
         self.s11_history = deque(maxlen=self.window_size)
+        self.packet_loss_history = deque(maxlen=self.window_size)
+        self.jitter_history = deque(maxlen=self.window_size)
         self.timestamps = deque(maxlen=self.window_size)
         
         self.start_timestamp = time.time()
-        self.frame_times = []
+        self.decision_meter = RateMeter(window=60.0)
         self.timestamp_socket = None
+        self.timestamp_protocol_version = 0
+        # 发送端/接收端时钟偏移估计，无需 chronyd 同步
+        self.clock_sync = ClockSync()
+        # 从视频流中的 SEI 帧时间戳计算逐帧延迟
+        self.frame_latency = FrameLatencyMonitor(multicast_addr, video_port, clock_sync=self.clock_sync,
+                                                 log=lambda message: self.log(message, force=True))
+        # 进程内监听组播流，按流统计码率并根据 TS 连续计数器计算丢包
+        self.stream_sniffer = StreamSniffer(multicast_addr, {'video': (video_port, False), 'audio': (audio_port, True)},
+                                            log=lambda message: self.log(message, force=True))
+        self.stream_sniffer.add_handler('video', self.frame_latency.handle_datagram)
+        # 进程内解析 H.264 NAL 单元统计帧率、GOP 和帧大小，替代 ffprobe 帧计数子进程
+        self.nal_scanner = NALScanner()
+        # 持续缓存最近 pre_record_seconds 秒的原始数据包，录制时立即写盘；NAL 解析由视频缓存驱动
+        self.video_buffer = PreRecordBuffer('video', pre_record_seconds, scanner=self.nal_scanner,
+                                            log=lambda message: self.log(message, force=True))
+        self.audio_buffer = PreRecordBuffer('audio', pre_record_seconds, log=lambda message: self.log(message, force=True))
+        self.stream_sniffer.add_handler('video', self.video_buffer.feed)
+        self.stream_sniffer.add_handler('audio', self.audio_buffer.feed)
+        # 每个组播套接字只接收一次，播放、录制等消费者通过有界队列订阅，可随时挂载/卸载
+        self.stream_fanout = StreamFanout(self.stream_sniffer, log=lambda message: self.log(message, force=True))
+        # 独立线程按固定频率探测到发送端时间戳端口的 RTT，替代 ping 子进程
+        self.rtt_prober = RTTProber(sender_ip, timestamp_port, rate=2.0, clock_sync=self.clock_sync,
+                                    log=lambda message: self.log(message, force=True))
         self.running = False
     
     def set_callbacks(self, log_callback=None, metrics_callback=None, decision_callback=None):
@@ -162,14 +223,19 @@ class StreamReceiver:
             '-autoexit',
             '-window_title', f"Video from {self.sender_ip}",
             '-loglevel', 'warning',  # 将日志级别从verbose改为warning，减少输出
-            f'udp://{self.multicast_addr}:{self.video_port}?timeout=5000000&buffer_size=65536'
+            '-f', 'h264',
+            'pipe:0'
         ]
         self.log(f"Starting video receiver with command: {' '.join(cmd)}", force=True)
-        self.video_process = subprocess.Popen(cmd, stderr=subprocess.PIPE, text=True)
+        player = self.stream_fanout.attach_pipe('video', 'video player', cmd, stderr=subprocess.PIPE)
+        self.video_process = player.process
         threading.Thread(target=self.log_process_errors, args=(self.video_process, "Video Receiver"), daemon=True).start()
         self.log(f"Video receiver started on {self.multicast_addr}:{self.video_port}", force=True)
     
     def start_audio_receiver(self):
+        if self.live_enhancement:
+            self.start_live_enhancer()
+            return
         cmd = [
             'ffplay',
             '-fflags', 'nobuffer',
@@ -179,20 +245,55 @@ class StreamReceiver:
             '-nodisp',
             '-autoexit',
             '-loglevel', 'warning',  # 将日志级别从verbose改为warning，减少输出
-            f'udp://{self.multicast_addr}:{self.audio_port}?timeout=5000000&buffer_size=65536'
+            '-f', 'mpegts',
+            'pipe:0'
         ]
         self.log(f"Starting audio receiver with command: {' '.join(cmd)}", force=True)
-        self.audio_process = subprocess.Popen(cmd, stderr=subprocess.PIPE, text=True)
+        player = self.stream_fanout.attach_pipe('audio', 'audio player', cmd, stderr=subprocess.PIPE)
+        self.audio_process = player.process
         threading.Thread(target=self.log_process_errors, args=(self.audio_process, "Audio Receiver"), daemon=True).start()
         self.log(f"Audio receiver started on {self.multicast_addr}:{self.audio_port}", force=True)
     
+    def start_live_enhancer(self):
+        """Decode the audio multicast, enhance it block by block and play the result"""
+        log = lambda message: self.log(message, force=True)
+        try:
+            # In 'mode' the processor follows the decisions (switch_live_model); passthrough until the first one
+            processor = None if self.model_registry else load_processor(self.live_enhancement)
+        except Exception as e:
+            self.log(f"Live enhancer {self.live_enhancement} failed to load, playing unenhanced: {str(e)}", force=True)
+            processor = None
+        decoder = FFmpegAudioDecoder(self.stream_fanout, log=log).start()
+        sink = PlayerSink(log=log)
+        self.audio_process = sink.process
+        self.live_enhancer = LiveEnhancer(decoder, sink, processor, log=log).start()
+        self.log(f"Live enhancement ({self.live_enhancement}) started on {self.multicast_addr}:{self.audio_port}", force=True)
+        if self.model_registry and self.mode_code >= 0:
+            self.switch_live_model(self.mode_code)
+    
+    def switch_live_model(self, mode_code):
+        """Load the model of mode_code in the background and hand it to the live enhancer"""
+        def switch(future):
+            # A newer decision has already asked for another mode
+            if mode_code != self.mode_code or not self.live_enhancer:
+                return
+            try:
+                warm = future.result()
+            except Exception as e:
+                self.log(f"Live model for mode {mode_code} failed: {str(e)}", force=True)
+                return
+            self.live_enhancer.set_processor(processor_for(warm))
+            self.log(f"Live enhancement switched to {warm.name if warm else 'passthrough'} (mode {mode_code})", force=True)
+        
+        self.model_registry.get_async(mode_code).add_done_callback(switch)
+    
     def log_process_errors(self, process, name):
         """
         处理进程的stderr输出，并过滤掉不必要的FFmpeg状态更新信息
         """
         for line in process.stderr:
-            # 过滤掉FFmpeg频繁的状态更新信息
-            line_text = line.strip()
+            # 过滤掉FFmpeg频繁的状态更新信息；经管道输入的进程 stdin 为二进制，stderr 也是 bytes
+            line_text = (line.decode(errors='replace') if isinstance(line, bytes) else line).strip()
             
             # 忽略这些模式的输出
             skip_patterns = [
@@ -219,6 +320,57 @@ class StreamReceiver:
             if not skip_line:
                 self.log(f"{name} output: {line_text}", force=True)  # 强制记录错误
     
+    def negotiate_timestamp_protocol(self, timeout=0.5):
+        """Ask the sender for the binary timestamp protocol; 0 means legacy text commands"""
+        self.timestamp_socket.sendto(timestamp_protocol.pack_hello(), (self.sender_ip, self.timestamp_port))
+        previous_timeout = self.timestamp_socket.gettimeout()
+        # One deadline for the whole wait, so a steady stream of other datagrams cannot keep it open
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.timestamp_socket.settimeout(remaining)
+                data, _ = self.timestamp_socket.recvfrom(1024)
+                if timestamp_protocol.is_binary(data):
+                    try:
+                        version, msg_type, _ = timestamp_protocol.unpack(data)
+                    except ValueError:
+                        continue
+                    if msg_type == timestamp_protocol.MSG_HELLO_ACK:
+                        return version
+        except socket.timeout:
+            pass
+        finally:
+            self.timestamp_socket.settimeout(previous_timeout)
+        # Legacy senders ignore HELLO
+        return 0
+    
+    def request_latest_frame(self):
+        """Return (frame_timestamp_seconds, local_response_time) or None if no frame is available
+
+        On the binary protocol the frame timestamp is converted to the local
+        clock using the offset estimated from every exchange.
+        """
+        if self.timestamp_protocol_version:
+            sample = exchange(self.timestamp_socket, (self.sender_ip, self.timestamp_port),
+                              version=self.timestamp_protocol_version)
+            self.clock_sync.add(sample)
+            if sample.status != timestamp_protocol.STATUS_OK:
+                return None
+            return self.clock_sync.to_local_ns(sample.frame_ns, sample.t4) / 1e9, sample.t4 / 1e9
+        
+        # 旧版文本协议
+        self.timestamp_socket.sendto(b'LATEST_FRAME', (self.sender_ip, self.timestamp_port))
+        data, _ = self.timestamp_socket.recvfrom(1024)
+        local_response_time = time.time()
+        if data == b'NO_FRAMES_AVAILABLE':
+            return None
+        frame_data = json.loads(data.decode())
+        frame_timestamp = datetime.datetime.strptime(frame_data['timestamp'], "%Y-%m-%d %H:%M:%S.%f").timestamp()
+        return frame_timestamp, local_response_time
+    
     def measure_timestamp_latency(self):
         """测量时间戳延迟，抑制频繁日志"""
         try:
@@ -230,20 +382,17 @@ class StreamReceiver:
                 self.timestamp_socket.bind(('', self.timestamp_port))
                 mreq = socket.inet_aton(self.multicast_addr) + socket.inet_aton('0.0.0.0')
                 self.timestamp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-                self.log("Timestamp socket initialized", force=True)
+                self.timestamp_protocol_version = self.negotiate_timestamp_protocol()
+                self.log(f"Timestamp socket initialized (protocol: "
+                         f"{'binary v%d' % self.timestamp_protocol_version if self.timestamp_protocol_version else 'legacy text'})", force=True)
             
             # 不记录每次请求的日志
-            local_request_time = time.time()
-            self.timestamp_socket.sendto(b'LATEST_FRAME', (self.sender_ip, self.timestamp_port))
-            data, _ = self.timestamp_socket.recvfrom(1024)
-            local_response_time = time.time()
-            
-            if data == b'NO_FRAMES_AVAILABLE':
+            result = self.request_latest_frame()
+            if result is None:
                 return 0
             
             # 不记录原始时间戳数据
-            frame_data = json.loads(data.decode())
-            frame_timestamp = datetime.datetime.strptime(frame_data['timestamp'], "%Y-%m-%d %H:%M:%S.%f").timestamp()
+            frame_timestamp, local_response_time = result
             latency = (local_response_time - frame_timestamp) * 1000
             
             # 只有在延迟变化明显时才记录
@@ -254,6 +403,9 @@ class StreamReceiver:
             else:
                 self.last_reported_latency = latency
                 self.log(f"Initial latency: {latency:.2f} ms", force=True)
+                if self.clock_sync.synchronized:
+                    self.log(f"Clock offset to sender: {self.clock_sync.offset_at() / 1e6:.2f} ms "
+                             f"(RTT {self.clock_sync.min_rtt_ns / 1e6:.2f} ms)", force=True)
                 
             return latency if 0 <= latency <= 5000 else 0
         except socket.timeout:
@@ -262,9 +414,98 @@ class StreamReceiver:
             self.log(f"Timestamp latency error: {str(e)}", force=True)
             return 0
     
+    def apply_decision(self, decision_data):
+        """Update decision state from a decision dict received over TCP or multicast"""
+        old_mode = self.processing_mode
+        old_code = self.mode_code
+        
+        self.processing_mode = decision_data.get("mode", "Unknown")
+        self.mode_code = decision_data.get("mode_code", -1)
+        self.s11_mean = decision_data.get("s11_mean", 0)
+        self.defuzzified_value = decision_data.get("defuzzified_value", 0)
+        self.last_decision_time = time.time()
+        self.decision_meter.add()
+        self.s11_history.append(self.s11_mean)
+        
+        if self.model_registry:
+            # 决策值趋向另一模式时提前加载其模型
+            self.model_registry.observe(decision_data)
+            if old_code != self.mode_code and self.live_enhancer:
+                self.switch_live_model(self.mode_code)
+        
+        # 只在模式发生变化时记录日志
+        if old_mode != self.processing_mode or old_code != self.mode_code:
+            self.log(f"Decision changed: {self.processing_mode} (S11: {self.s11_mean:.2f} dB)", force=True)
+        
+        if self.decision_callback:
+            # Use a try block to safely call the callback
+            try:
+                self.decision_callback(decision_data)
+            except Exception as e:
+                print(f"Error in decision callback: {str(e)}")
+    
+    def multicast_decision_fresh(self):
+        return time.time() - self.last_multicast_decision_time < self.decision_stale_after
+    
+    def start_decision_listener(self):
+        """Subscribe to decisions pushed by the sender on the multicast group"""
+        def decision_listener_thread():
+            sock = None
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(('', self.decision_multicast_port))
+                mreq = socket.inet_aton(self.multicast_addr) + socket.inet_aton('0.0.0.0')
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+                sock.settimeout(1.0)
+                self.log(f"Listening for decisions on {self.multicast_addr}:{self.decision_multicast_port}", force=True)
+                
+                while self.running:
+                    try:
+                        data, _ = sock.recvfrom(1024)
+                        decision_data = json.loads(data.decode())
+                    except socket.timeout:
+                        continue
+                    except ValueError as e:
+                        self.log(f"Malformed decision datagram: {str(e)}", force=True)
+                        continue
+                    
+                    seq = decision_data.get("seq")
+                    sent_at = decision_data.get("timestamp", 0)
+                    if seq is not None and self.decision_seq is not None:
+                        if seq <= self.decision_seq:
+                            if sent_at <= self.decision_sent_at:
+                                # Duplicate or reordered datagram; keep the newer decision
+                                continue
+                            self.log("Decision sequence restarted, sender was restarted", force=True)
+                        elif seq > self.decision_seq + 1:
+                            missed = seq - self.decision_seq - 1
+                            self.decision_gaps += missed
+                            self.log(f"Missed {missed} decision update(s) (seq {self.decision_seq} -> {seq})", force=True)
+                    self.decision_seq = seq
+                    self.decision_sent_at = sent_at
+                    self.last_multicast_decision_time = time.time()
+                    self.apply_decision(decision_data)
+            except Exception as e:
+                self.log(f"Decision listener error: {str(e)}", force=True)
+            finally:
+                if sock:
+                    sock.close()
+        
+        self.decision_listener_thread = threading.Thread(target=decision_listener_thread, daemon=True)
+        self.decision_listener_thread.start()
+    
     def start_decision_receiver(self):
         def decision_receiver_thread():
             while self.running:
+                # Decisions are arriving over multicast; no need to poll
+                if self.multicast_decision_fresh():
+                    if self.decision_socket:
+                        self.decision_socket.close()
+                        self.decision_socket = None
+                    time.sleep(2)
+                    continue
+                
                 try:
                     if not self.decision_socket:
                         self.decision_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -276,27 +517,7 @@ class StreamReceiver:
                     self.decision_socket.sendall(b'GET_DECISION')
                     response = self.decision_socket.recv(1024)
                     if response:
-                        decision_data = json.loads(response.decode())
-                        old_mode = self.processing_mode
-                        old_code = self.mode_code
-                        
-                        self.processing_mode = decision_data.get("mode", "Unknown")
-                        self.mode_code = decision_data.get("mode_code", -1)
-                        self.s11_mean = decision_data.get("s11_mean", 0)
-                        self.defuzzified_value = decision_data.get("defuzzified_value", 0)
-                        self.last_decision_time = time.time()
-                        self.s11_history.append(self.s11_mean)
-                        
-                        # 只在模式发生变化时记录日志
-                        if old_mode != self.processing_mode or old_code != self.mode_code:
-                            self.log(f"Decision changed: {self.processing_mode} (S11: {self.s11_mean:.2f} dB)", force=True)
-                        
-                        if self.decision_callback:
-                            # Use a try block to safely call the callback
-                            try:
-                                self.decision_callback(decision_data)
-                            except Exception as e:
-                                print(f"Error in decision callback: {str(e)}")
+                        self.apply_decision(json.loads(response.decode()))
                     else:
                         self.log("No decision data received", force=True)
                         self.decision_socket.close()
@@ -312,126 +533,59 @@ class StreamReceiver:
         self.decision_thread = threading.Thread(target=decision_receiver_thread, daemon=True)
         self.decision_thread.start()
     
-    def get_stream_info(self):
-        try:
-            cmd = [
-                'ffprobe',
-                '-v', 'quiet',
-                '-probesize', '1000000',
-                '-analyzeduration', '2000000',
-                '-select_streams', 'v:0',
-                '-show_entries', 'stream=r_frame_rate,avg_frame_rate',
-                '-of', 'json',
-                f'udp://{self.multicast_addr}:{self.video_port}?timeout=5000000'
-            ]
-            self.log(f"Running ffprobe: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                if 'streams' in data and data['streams']:
-                    r_frame_rate = data['streams'][0].get('r_frame_rate', '0/1')
-                    num, den = map(int, r_frame_rate.split('/'))
-                    if den != 0:
-                        self.video_fps = int(num / den)
-                        self.log(f"Detected framerate: {self.video_fps} fps", force=True)
-                else:
-                    self.log("No stream info available", force=True)
-            else:
-                self.log(f"ffprobe failed: {result.stderr}", force=True)
-        except subprocess.TimeoutExpired:
-            self.log("ffprobe timed out", force=True)
-        except Exception as e:
-            self.log(f"Stream info error: {str(e)}", force=True)
-    
-    def start_frame_counter(self):
-        cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-probesize', '1000000',
-            '-analyzeduration', '2000000',
-            '-show_entries', 'frame=pkt_size,pkt_pts_time',
-            '-of', 'csv',
-            f'udp://{self.multicast_addr}:{self.video_port}?timeout=5000000'
-        ]
-        self.log(f"Starting frame counter with: {' '.join(cmd)}")
-        self.monitor_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
-        threading.Thread(target=self.read_frame_data, args=(self.monitor_process.stdout,), daemon=True).start()
-        threading.Thread(target=self.log_process_errors, args=(self.monitor_process, "Frame Counter"), daemon=True).start()
-    
-    def read_frame_data(self, stdout):
-        """读取帧数据，只在重大变化时记录日志"""
-        last_fps = 0
-        frame_log_interval = 60  # 每60秒只记录一次帧率
-        last_frame_log = 0
-        
-        while self.running and self.monitor_process and self.monitor_process.poll() is None:
-            try:
-                line = stdout.readline().strip()
-                if line:
-                    current_time = time.time()
-                    self.frame_times.append(current_time)
-                    self.frame_times = [t for t in self.frame_times if current_time - t <= 1.0]
-                    self.video_fps = len(self.frame_times)
-                    
-                    # 只在帧率有重大变化(超过5帧)或者经过了日志间隔时间时才记录
-                    fps_changed = abs(self.video_fps - last_fps) > 5
-                    time_to_log = current_time - last_frame_log >= frame_log_interval
-                    
-                    if fps_changed or time_to_log:
-                        self.log(f"Frame rate update: {self.video_fps} FPS", force=True)
-                        last_fps = self.video_fps
-                        last_frame_log = current_time
-            except Exception as e:
-                self.log(f"Frame data error: {str(e)}", force=True)
-                time.sleep(0.1)
-    
     def start_quality_monitor(self):
-        self.get_stream_info()
-        self.start_frame_counter()
         threading.Thread(target=self.start_network_monitor, daemon=True).start()
     
     def start_network_monitor(self):
-        net_io_counters_start = psutil.net_io_counters()
-        start_time = time.time()
+        rate_tracker = RateTracker(self.stream_sniffer)
         last_timestamp_check = 0
         log_interval = 60  # 降低网络日志记录间隔到60秒
         last_network_log = 0
+        last_fps = 0
         
         while self.running:
             time.sleep(1)
             current_time = time.time()
-            elapsed = current_time - start_time
             elapsed_since_start = current_time - self.start_timestamp
             
-            net_io_counters = psutil.net_io_counters()
-            bytes_recv = net_io_counters.bytes_recv - net_io_counters_start.bytes_recv
-            recv_rate = (bytes_recv * 8) / (1024 * elapsed)
-            self.video_bitrate = int(recv_rate * 0.9)
-            self.audio_bitrate = int(recv_rate * 0.1)
-            net_io_counters_start = net_io_counters
-            start_time = current_time
+            rates = rate_tracker.update()
+            self.video_bitrate = int(rates['video']['kbps'])
+            self.audio_bitrate = int(rates['audio']['kbps'])
+            self.packet_loss = rates['audio']['loss_percent']
+            audio_ts = self.stream_sniffer.streams['audio'].ts.snapshot()
+            self.jitter = audio_ts['pcr_jitter_ms']
+            video_frames = self.nal_scanner.snapshot()
+            self.video_fps = video_frames['fps']
             
-            # 降低网络状态日志输出频率
-            if current_time - last_network_log >= log_interval:
-                self.log(f"Network stats - Video bitrate: {self.video_bitrate} kbps, Audio bitrate: {self.audio_bitrate} kbps", force=True)
+            # 降低网络状态日志输出频率；帧率只在重大变化(超过5帧)时额外记录
+            if current_time - last_network_log >= log_interval or abs(self.video_fps - last_fps) > 5:
+                self.log(f"Network stats - Video bitrate: {self.video_bitrate} kbps, Audio bitrate: {self.audio_bitrate} kbps, "
+                         f"{self.video_fps} FPS, GOP {video_frames['gop_last']}", force=True)
                 last_network_log = current_time
+                last_fps = self.video_fps
             
             if current_time - last_timestamp_check >= 2:
+                # 始终轮询时间戳服务，用于维持时钟偏移估计
                 timestamp_latency = self.measure_timestamp_latency()
-                if timestamp_latency > 0:
+                if self.frame_latency.fresh():
+                    # 优先使用逐帧 SEI 延迟（最近窗口的中位数）
+                    self.video_latency = self.frame_latency.histogram.recent_percentile(50)
+                    self.audio_latency = self.video_latency
+                elif timestamp_latency > 0:
                     self.video_latency = timestamp_latency
                     self.audio_latency = timestamp_latency
                 else:
-                    ping_latency = measure_latency(self.sender_ip, None)  # 不记录ping日志
-                    if ping_latency > 0:
-                        self.video_latency = ping_latency
-                        self.audio_latency = ping_latency
-                    self.packet_loss = 0 if ping_latency < 999 else 100
+                    rtt = self.rtt_prober.latest()
+                    if rtt.count:
+                        self.video_latency = rtt.p50
+                        self.audio_latency = rtt.p50
                 last_timestamp_check = current_time
             
             self.timestamps.append(elapsed_since_start)
             self.bitrate_history.append(self.video_bitrate + self.audio_bitrate)
             self.latency_history.append(self.video_latency)
+            self.packet_loss_history.append(self.packet_loss)
+            self.jitter_history.append(self.jitter)
             
             if self.metrics_callback:
                 metrics = {
@@ -439,138 +593,196 @@ class StreamReceiver:
                     'audio_bitrate': self.audio_bitrate,
                     'total_bitrate': self.video_bitrate + self.audio_bitrate,
                     'video_fps': self.video_fps,
+                    'video_frames': video_frames['frames'],
+                    'idr_frames': video_frames['idr_frames'],
+                    'gop_length': video_frames['gop_mean'],
+                    'frame_size': video_frames['frame_size'],
+                    'idr_frame_size': video_frames['idr_size'],
                     'video_latency': self.video_latency,
                     'audio_latency': self.audio_latency,
                     'packet_loss': self.packet_loss,
+                    'video_packet_rate': rates['video']['packets_per_s'],
+                    'audio_packet_rate': rates['audio']['packets_per_s'],
+                    'ts_packets_lost': rates['audio']['ts_lost'],
+                    'jitter': self.jitter,
+                    'rtt': self.rtt_prober.latest()._asdict(),
+                    'decisions_per_minute': self.decision_meter.count(),
+                    'ts_loss_by_pid': audio_ts['pids'],
+                    'loss_bursts': audio_ts['bursts'],
+                    'clock_offset_ms': self.clock_sync.offset_at() / 1e6,
+                    'clock_rtt_ms': (self.clock_sync.min_rtt_ns or 0) / 1e6,
+                    'frame_latency': self.frame_latency.histogram.summary(),
+                    'frame_latency_histogram': list(self.frame_latency.histogram.counts),
+                    'frames_lost': self.frame_latency.lost_frames,
+                    'pre_record': {'video': self.video_buffer.stats(), 'audio': self.audio_buffer.stats()},
+                    'live_enhancement': self.live_enhancer.stats() if self.live_enhancer else None,
+                    'model_registry': self.model_registry.stats() if self.model_registry else None,
                     'connected': self.video_process and self.video_process.poll() is None,
                     'timestamps': list(self.timestamps),
                     'bitrate_history': list(self.bitrate_history),
                     'latency_history': list(self.latency_history),
-                    's11_history': list(self.s11_history)
+                    's11_history': list(self.s11_history),
+                    'packet_loss_history': list(self.packet_loss_history),
+                    'jitter_history': list(self.jitter_history)
                 }
                 try:
                     self.metrics_callback(metrics)
                 except Exception as e:
                     print(f"Error in metrics callback: {str(e)}")
     
-    def record(self, duration=3):
-        if self.recording:
-            self.log("Already recording", force=True)
-            return False
+    def record(self, duration=3, follow=0, convert=True):
+        """Start a recording and return its Recording handle at once (None if it could not start)
         
+        The last `duration` seconds are written from the pre-record buffers
+        immediately, `follow` seconds more are appended live in the background,
+        then the audio is converted to WAV for the enhancer unless convert is False.
+        """
         if not self.running:
             self.log("Receiver not running", force=True)
-            return False
+            return None
+        
+        if not check_directory_permissions(self.recording_dir, None):  # 不记录检查日志
+            self.log("Recording aborted: directory not writable", force=True)
+            return None
         
-        self.recording = True
+        # 允许多个录制重叠，同一秒内的录制加序号区分
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        video_filename = os.path.join(self.recording_dir, f"video_{timestamp}.mp4")
-        audio_filename = os.path.join(self.recording_dir, f"audio_{timestamp}.wav")
-        info_filename = os.path.join(self.recording_dir, f"info_{timestamp}.json")
+        recording_id = timestamp
+        suffix = 1
+        while recording_id in self.recordings or os.path.exists(os.path.join(self.recording_dir, f"info_{recording_id}.json")):
+            suffix += 1
+            recording_id = f"{timestamp}_{suffix}"
+        paths = {
+            'video': os.path.join(self.recording_dir, f"video_{recording_id}.h264"),
+            'audio_ts': os.path.join(self.recording_dir, f"audio_{recording_id}.ts"),
+            'audio': os.path.join(self.recording_dir, f"audio_{recording_id}.wav"),
+            'info': os.path.join(self.recording_dir, f"info_{recording_id}.json"),
+        }
+        recording = Recording(recording_id, duration, follow, paths, log=lambda message: self.log(message, force=True))
         
-        self.log(f"Starting recording to {video_filename} and {audio_filename}", force=True)
+        # 直接写出内存中已缓存的最近数据，视频从 IDR 帧开始，无需启动 ffmpeg
+        parts = []
+        try:
+            for buffer, path in ((self.video_buffer, paths['video']), (self.audio_buffer, paths['audio_ts'])):
+                parts.append(buffer.flush(path, duration, follow, cancel=recording.cancel_event,
+                                          on_progress=lambda _: recording.update(parts)))
+        except Exception as e:
+            self.log(f"Recording error: {str(e)}", force=True)
+            recording.cancel_event.set()
+            return None
+        recording.update(parts)
+        self.log(f"Recording {recording_id}: {parts[0]['seconds']:.1f} s of buffered video ({parts[0]['bytes']} bytes) "
+                 f"and {parts[1]['seconds']:.1f} s of audio written"
+                 + (f", following for {follow} s" if follow else ""))
         
         # Save the current enhancement mode information
         enhancement_info = {
-            "timestamp": timestamp,
+            "timestamp": recording_id,
             "mode": self.processing_mode,
             "mode_code": self.mode_code, 
             "s11_mean": self.s11_mean,
-            "defuzzified_value": self.defuzzified_value
+            "defuzzified_value": self.defuzzified_value,
+            "video_file": os.path.basename(paths['video']),
+            "audio_file": os.path.basename(paths['audio']),
+            "pre_record_seconds": duration,
+            "follow_seconds": follow
         }
         
         try:
-            with open(info_filename, 'w') as f:
+            with open(paths['info'], 'w') as f:
                 json.dump(enhancement_info, f, indent=4)
-            self.log(f"Saved enhancement info to {info_filename}", force=True)
+            self.log(f"Saved enhancement info to {paths['info']}")
         except Exception as e:
             self.log(f"Error saving enhancement info: {str(e)}", force=True)
         
-        video_thread = threading.Thread(
-            target=self.record_video_stream,
-            args=(video_filename, duration, self.multicast_addr, self.video_port),
-            daemon=True
-        )
-        audio_thread = threading.Thread(
-            target=self.record_audio_stream,
-            args=(audio_filename, duration, self.multicast_addr, self.audio_port),
-            daemon=True
-        )
-        video_thread.start()
-        audio_thread.start()
-        
-        # Wait for recording to complete
-        time.sleep(duration + 1)
-        self.recording = False
-        return True
-    
-    def record_video_stream(self, output_file, duration, multicast_addr, video_port):
-        if not check_directory_permissions(os.path.dirname(output_file), None):  # 不记录检查日志
-            self.log("Video recording aborted: directory not writable", force=True)
-            self.recording = False
-            return
+        try:
+            self.recording_index.add(recording_id, paths, enhancement_info, recording.status, created=recording.created)
+        except Exception as e:
+            self.log(f"Error adding {recording_id} to the recording index: {str(e)}", force=True)
         
-        cmd = [
-            'ffmpeg',
-            '-y',
-            '-i', f'udp://{multicast_addr}:{video_port}?timeout=5000000&buffer_size=65536',
-            '-t', str(duration),
-            '-c:v', 'copy',
-            '-an',
-            '-fflags', '+genpts',
-            '-avoid_negative_ts', 'make_zero',
-            '-loglevel', 'warning',  # 降低日志级别
-            output_file
-        ]
-        self.log(f"Starting video recording with command: {' '.join(cmd)}", force=True)
-        self.record_process_video = subprocess.Popen(cmd, stderr=subprocess.PIPE, text=True)
-        threading.Thread(target=self.log_process_errors, args=(self.record_process_video, "Video Recording"), daemon=True).start()
-        self.log(f"Started video recording to {output_file}", force=True)
-        self.record_process_video.wait()
-        if self.record_process_video.returncode == 0:
-            self.log(f"Video recording completed: {output_file}", force=True)
-        else:
-            self.log(f"Video recording failed with exit code {self.record_process_video.returncode}", force=True)
-        self.recording = False
+        self.recordings[recording_id] = recording
+        recording.future = self.recording_executor.submit(self.finish_recording, recording, parts, convert)
+        recording.add_done_callback(self.recording_finished)
+        return recording
     
-    def record_audio_stream(self, output_file, duration, multicast_addr, audio_port):
-        if not check_directory_permissions(os.path.dirname(output_file), None):  # 不记录检查日志
-            self.log("Audio recording aborted: directory not writable", force=True)
-            self.recording = False
-            return
-        
-        cmd = [
-            'ffmpeg',
-            '-y',
-            '-i', f'udp://{multicast_addr}:{audio_port}?timeout=5000000&buffer_size=65536',
-            '-t', str(duration),
-            '-vn',
-            '-ar', '16000',
-            '-ac', '1',
-            '-acodec', 'pcm_s16le',
-            '-fflags', '+genpts',
-            '-loglevel', 'warning',  # 降低日志级别
-            output_file
-        ]
-        self.log(f"Starting audio recording with command: {' '.join(cmd)}", force=True)
-        self.record_process_audio = subprocess.Popen(cmd, stderr=subprocess.PIPE, text=True)
-        threading.Thread(target=self.log_process_errors, args=(self.record_process_audio, "Audio Recording"), daemon=True).start()
-        self.log(f"Started audio recording to {output_file}", force=True)
-        self.record_process_audio.wait()
-        if self.record_process_audio.returncode == 0:
-            self.log(f"Audio recording completed: {output_file}", force=True)
-        else:
-            self.log(f"Audio recording failed with exit code {self.record_process_audio.returncode}", force=True)
+    def recording_finished(self, recording):
+        self.recordings.pop(recording.id, None)
+        try:
+            # recording.seconds is the IDR-aligned video span; the enhancer sorts on the length of the WAV
+            duration = wav_duration(recording.paths['audio']) if recording.status == DONE else None
+            self.recording_index.finish(recording.id, recording.status, duration)
+        except Exception as e:
+            self.log(f"Error updating {recording.id} in the recording index: {str(e)}", force=True)
+    
+    def finish_recording(self, recording, parts, convert):
+        """Wait for the live part, then convert the captured MPEG-TS audio to the 16 kHz WAV the enhancer reads"""
+        try:
+            for part in parts:
+                if part['thread']:
+                    part['thread'].join()
+            recording.update(parts)
+            errors = [part['error'] for part in parts if part.get('error')]
+            if errors:
+                recording.error = "; ".join(errors)
+                recording.report(FAILED)
+                self.log(f"Recording {recording.id} failed: {recording.error}", force=True)
+                return recording
+            if recording.cancelled:
+                recording.report(CANCELLED)
+                self.log(f"Recording {recording.id} cancelled after {recording.seconds:.1f} s", force=True)
+                return recording
+            self.log(f"Recording {recording.id} captured: {recording.seconds:.1f} s, {recording.bytes} bytes", force=True)
+            if not convert:
+                recording.report(DONE, 1.0)
+                return recording
+            
+            # 离线转换已写入磁盘的文件，不影响采集
+            recording.report(CONVERTING)
+            cmd = [
+                'ffmpeg',
+                '-y',
+                '-i', recording.paths['audio_ts'],
+                '-vn',
+                '-ar', '16000',
+                '-ac', '1',
+                '-acodec', 'pcm_s16le',
+                '-loglevel', 'warning',  # 降低日志级别
+                recording.paths['audio']
+            ]
+            recording.process = subprocess.Popen(cmd, stderr=subprocess.PIPE, text=True)
+            threading.Thread(target=self.log_process_errors, args=(recording.process, "Audio Conversion"), daemon=True).start()
+            recording.process.wait()
+            if recording.cancelled:
+                recording.report(CANCELLED)
+            elif recording.process.returncode == 0:
+                self.log(f"Audio recording completed: {recording.paths['audio']}", force=True)
+                recording.report(DONE, 1.0)
+            else:
+                recording.error = f"audio conversion exited with code {recording.process.returncode}"
+                self.log(f"Audio conversion failed with exit code {recording.process.returncode}", force=True)
+                recording.report(FAILED)
+        except Exception as e:
+            recording.error = str(e)
+            self.log(f"Recording {recording.id} error: {str(e)}", force=True)
+            recording.report(FAILED)
+        return recording
+    
+    def active_recordings(self):
+        return [recording for recording in list(self.recordings.values()) if not recording.done()]
     
     def start(self):
         self.running = True
         self.start_timestamp = time.time()
         self.log("Starting StreamReceiver", force=True)
+        # 先启动组播接收，播放器和录制器都从它订阅数据
+        self.stream_sniffer.start()
         threading.Thread(target=self.start_video_receiver, daemon=True).start()
         time.sleep(1)
         threading.Thread(target=self.start_audio_receiver, daemon=True).start()
         time.sleep(1)
+        self.start_decision_listener()
         self.start_decision_receiver()
+        self.rtt_prober.start()
         self.start_quality_monitor()
     
     def stop(self):
@@ -582,8 +794,17 @@ class StreamReceiver:
         
         if self.timestamp_socket:
             self.timestamp_socket.close()
+        for recording in self.active_recordings():
+            recording.cancel()
+        if self.live_enhancer:
+            self.live_enhancer.stop()
+        if self.model_registry:
+            self.model_registry.close()
+        self.stream_fanout.close()
+        self.stream_sniffer.stop()
+        self.rtt_prober.stop()
         
-        for process in [self.video_process, self.audio_process, self.monitor_process, self.record_process_video, self.record_process_audio]:
+        for process in [self.video_process, self.audio_process]:
             if process and process.poll() is None:
                 self.log(f"Terminating process {process.pid}", force=True)
                 process.terminate()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+In-process listener on the media multicast groups for per-stream traffic counters
+
+StreamSniffer is the only reader of the video and audio groups (players are
+fed through StreamFanout, recordings come from PreRecordBuffer) and counts
+the bytes and datagrams of each stream, so bitrates no longer depend on
+system-wide NIC counters. The MPEG-TS audio stream also goes through a
+TSAnalyzer for continuity-counter loss and PCR jitter.
+
+All sockets are non-blocking and served by one thread: when a socket becomes
+readable it is drained with recv_into into a single reusable buffer until
+it would block (Python has no recvmmsg, this is the closest batched read).
+Handlers registered with add_handler() see each datagram as a memoryview of
+that buffer, only valid for the duration of the call. Consumers that need
+the data on another thread (player, recorder) attach through StreamFanout.
+
+Local test without a sender (multicast on loopback, or --group 127.0.0.1):
+    python stream_sniffer.py --replay --loss 0.02
+"""
+
+import sys
+import time
+import socket
+import argparse
+import selectors
+import threading
+from ts_analyzer import TSAnalyzer, TS_PACKET_SIZE, ts_packet
+from rate_meter import RateMeter
+
+
+
+def is_multicast(addr):
+    return 224 <= int(addr.split('.')[0]) <= 239
+
+
+class StreamCounters:
+    """Running totals for one stream; read them with snapshot()"""
+
+    def __init__(self, name, port, mpegts=False):
+        self.name = name
+        self.port = port
+        self.mpegts = mpegts
+        self.bytes = 0
+        self.packets = 0
+        self.ts = TSAnalyzer() if mpegts else None
+        self.last_packet_time = 0.0
+
+    def snapshot(self):
+        return {
+            'bytes': self.bytes,
+            'packets': self.packets,
+            'ts_packets': self.ts.packets if self.ts else 0,
+            'ts_lost': self.ts.lost if self.ts else 0,
+            'last_packet_time': self.last_packet_time,
+        }
+
+
+class StreamSniffer:
+    def __init__(self, multicast_addr='239.0.0.1', streams=None, log=print, buffer_size=65536):
+        """
+        Args:
+            streams: {name: (port, is_mpegts)}; defaults to video 5100 (raw H.264) and audio 5101 (MPEG-TS)
+        """
+        self.multicast_addr = multicast_addr
+        if streams is None:
+            streams = {'video': (5100, False), 'audio': (5101, True)}
+        self.streams = {name: StreamCounters(name, port, mpegts) for name, (port, mpegts) in streams.items()}
+        self.handlers = {name: [] for name in self.streams}
+        self.log = log
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.selector = None
+        self.running = False
+        self.thread = None
+
+    def add_handler(self, name, handler):
+        """Call handler(view, received_ns) for every datagram of stream `name`; safe while running"""
+        # Replace the list instead of mutating it so drain() never iterates a list being modified
+        self.handlers[name] = self.handlers[name] + [handler]
+
+    def remove_handler(self, name, handler):
+        self.handlers[name] = [h for h in self.handlers[name] if h != handler]
+
+    def open_socket(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        if is_multicast(self.multicast_addr):
+            sock.bind(('', port))
+            mreq = socket.inet_aton(self.multicast_addr) + socket.inet_aton('0.0.0.0')
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        else:
+            sock.bind((self.multicast_addr, port))
+        sock.setblocking(False)
+        return sock
+
+    def drain(self, sock, counters):
+        """Read every queued datagram from a readable socket"""
+        handlers = self.handlers[counters.name]
+        while True:
+            try:
+                nbytes = sock.recv_into(self.buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionResetError:
+                # Windows reports ICMP port unreachable on UDP sockets; not fatal
+                continue
+            received_ns = time.time_ns()
+            counters.bytes += nbytes
+            counters.packets += 1
+            if counters.ts:
+                counters.ts.feed(self.view, nbytes, received_ns)
+            if handlers:
+                view = self.view[:nbytes]
+                for handler in handlers:
+                    handler(view, received_ns)
+                view.release()
+            counters.last_packet_time = received_ns / 1e9
+
+    def run(self):
+        sockets = []
+        try:
+            self.selector = selectors.DefaultSelector()
+            for counters in self.streams.values():
+                sock = self.open_socket(counters.port)
+                sockets.append(sock)
+                self.selector.register(sock, selectors.EVENT_READ, counters)
+            self.log(f"Stream sniffer listening on {self.multicast_addr} ports "
+                     f"{', '.join(str(c.port) for c in self.streams.values())}")
+
+            while self.running:
+                for key, _ in self.selector.select(timeout=1.0):
+                    try:
+                        self.drain(key.fileobj, key.data)
+                    except Exception as e:
+                        self.log(f"Stream sniffer handler error: {str(e)}")
+        except Exception as e:
+            self.log(f"Stream sniffer error: {str(e)}")
+        finally:
+            for sock in sockets:
+                sock.close()
+            if self.selector:
+                self.selector.close()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def snapshot(self):
+        return {name: counters.snapshot() for name, counters in self.streams.items()}
+
+
+class RateTracker:
+    """Turns successive sniffer snapshots into per-stream kbps, packet rate and TS loss over a sliding window"""
+
+    def __init__(self, sniffer, window=2.0):
+        self.sniffer = sniffer
+        self.previous = sniffer.snapshot()
+        now = time.monotonic()
+        self.meters = {}
+        for name in self.previous:
+            meters = self.meters[name] = {key: RateMeter(window) for key in ('bytes', 'packets', 'ts_packets', 'ts_lost')}
+            for meter in meters.values():
+                meter.reset(now)
+
+    def update(self):
+        current = self.sniffer.snapshot()
+        now = time.monotonic()
+        rates = {}
+        for name, stats in current.items():
+            before = self.previous[name]
+            meters = self.meters[name]
+            for key, meter in meters.items():
+                meter.add(stats[key] - before[key], now)
+            ts_packets = meters['ts_packets'].count(now)
+            ts_lost = meters['ts_lost'].count(now)
+            rates[name] = {
+                # kbps with the same 1024 divisor the psutil-based estimate used
+                'kbps': meters['bytes'].rate(now) * 8 / 1024,
+                'packets_per_s': meters['packets'].rate(now),
+                'loss_percent': 100.0 * ts_lost / (ts_packets + ts_lost) if ts_packets + ts_lost else 0.0,
+                'ts_lost': stats['ts_lost'] - before['ts_lost'],
+                'idle': time.time() - stats['last_packet_time'],
+            }
+        self.previous = current
+        return rates
+
+
+def ts_datagrams(pid=0x100, packets_per_datagram=7):
+    """Endless MPEG-TS datagrams (7 x 188 bytes, as ffmpeg sends) with correct continuity counters"""
+    cc = 0
+    while True:
+        datagram = bytearray()
+        for _ in range(packets_per_datagram):
+            datagram += ts_packet(pid, cc)
+            cc = (cc + 1) & 0x0F
+        yield bytes(datagram)
+
+
+def replay(group='239.0.0.1', video_port=5100, audio_port=5101, duration=5.0, loss=0.0,
+           video_kbps=1000, audio_kbps=128, seed=0):
+    """Send synthetic video and TS audio at fixed bitrates, dropping a fraction of TS datagrams
+
+    Never drops two datagrams in a row (a 4-bit counter cannot see gaps of 16
+    packets or more) and returns the number of TS packets dropped before the
+    last one sent, i.e. the loss a receiver can detect.
+    """
+    import random
+    rng = random.Random(seed)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+    video_datagram = bytes(1400)
+    audio = ts_datagrams()
+    video_interval = len(video_datagram) * 8 / (video_kbps * 1024)
+    audio_interval = 7 * TS_PACKET_SIZE * 8 / (audio_kbps * 1024)
+    started = time.perf_counter()
+    next_video = next_audio = started
+    dropped = 0
+    last_dropped = False
+    while time.perf_counter() - started < duration:
+        now = time.perf_counter()
+        if now >= next_video:
+            sock.sendto(video_datagram, (group, video_port))
+            next_video += video_interval
+        if now >= next_audio:
+            datagram = next(audio)
+            if not last_dropped and rng.random() < loss:
+                dropped += 7
+                last_dropped = True
+            else:
+                sock.sendto(datagram, (group, audio_port))
+                last_dropped = False
+            next_audio += audio_interval
+        time.sleep(max(min(next_video, next_audio) - time.perf_counter(), 0))
+    sock.close()
+    return dropped - 7 if last_dropped else dropped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stream bitrate and TS loss from the media multicast groups")
+    parser.add_argument('--group', default='239.0.0.1', help="multicast group, or a unicast address to bind")
+    parser.add_argument('--video-port', type=int, default=5100)
+    parser.add_argument('--audio-port', type=int, default=5101)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--replay', action='store_true', help="also send a synthetic stream to the group")
+    parser.add_argument('--loss', type=float, default=0.0, help="fraction of TS datagrams the replayer drops")
+    args = parser.parse_args(argv)
+
+    sniffer = StreamSniffer(args.group, {'video': (args.video_port, False), 'audio': (args.audio_port, True)})
+    sniffer.start()
+    time.sleep(0.5)
+    tracker = RateTracker(sniffer)
+
+    result = {}
+    if args.replay:
+        replayer = threading.Thread(target=lambda: result.update(dropped=replay(
+            args.group, args.video_port, args.audio_port, args.duration, args.loss)))
+        replayer.start()
+
+    started = time.time()
+    while time.time() - started < args.duration:
+        time.sleep(1)
+        rates = tracker.update()
+        print("  ".join(f"{name}: {r['kbps']:7.1f} kbps {r['packets_per_s']:6.0f} pkt/s {r['loss_percent']:5.2f}% loss"
+                        for name, r in rates.items()))
+
+    if args.replay:
+        replayer.join()
+    dropped = result.get('dropped')
+    time.sleep(0.5)
+    sniffer.stop()
+
+    totals = sniffer.snapshot()
+    print("Totals: " + ", ".join(f"{name} {s['packets']} datagrams / {s['bytes']} bytes"
+                                   for name, s in totals.items()))
+    print(f"TS packets lost: measured {totals['audio']['ts_lost']}"
+          + (f", dropped by replayer {dropped}" if dropped is not None else ""))
+    if dropped is not None:
+        return 0 if totals['audio']['ts_lost'] == dropped else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
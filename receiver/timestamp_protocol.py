@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact binary protocol for the timestamp service (UDP port 5102)
+
+Identical copies live in sender/ and receiver/; keep them in sync.
+
+Every binary datagram starts with a 4-byte header: the magic b'TP', the
+protocol version and the message type. Legacy text commands (TIMESTAMP,
+GET_FRAME_<id>, LATEST_FRAME) never start with the magic, so both formats
+share the port. Clients negotiate with HELLO: an up-to-date server answers
+HELLO_ACK carrying the version it will speak, a legacy server stays silent
+and the client falls back to the text commands.
+
+All times are integer nanoseconds since the epoch (time.time_ns()).
+
+Version 2 adds the server receive time to FRAME_RESPONSE so the client has
+all four NTP-style timestamps (client send, server receive, server send,
+client receive) and can estimate clock offset and round-trip time.
+"""
+
+import struct
+
+MAGIC = b'TP'
+VERSION = 2
+
+MSG_HELLO = 1
+MSG_HELLO_ACK = 2
+MSG_FRAME_REQUEST = 3
+MSG_FRAME_RESPONSE = 4
+
+STATUS_OK = 0
+STATUS_FRAME_NOT_FOUND = 1
+STATUS_NO_FRAMES = 2
+
+# frame_id of -1 asks for the latest frame
+LATEST_FRAME = -1
+
+HEADER = struct.Struct('!2sBB')
+# frame_id, client send time
+FRAME_REQUEST = struct.Struct('!qq')
+# status, frame_id, frame capture time, echoed client send time, server send time
+FRAME_RESPONSE_V1 = struct.Struct('!Bqqqq')
+# status, frame_id, frame capture time, echoed client send time, server receive time, server send time
+FRAME_RESPONSE_V2 = struct.Struct('!Bqqqqq')
+
+
+def is_binary(data):
+    return data[:2] == MAGIC and len(data) >= HEADER.size
+
+
+def pack_hello(version=VERSION):
+    """HELLO carries the highest version the client understands"""
+    return HEADER.pack(MAGIC, version, MSG_HELLO)
+
+
+def pack_hello_ack(version):
+    return HEADER.pack(MAGIC, version, MSG_HELLO_ACK)
+
+
+def pack_frame_request(frame_id, client_ns, version=VERSION):
+    return HEADER.pack(MAGIC, version, MSG_FRAME_REQUEST) + FRAME_REQUEST.pack(frame_id, client_ns)
+
+
+def pack_frame_response(status, frame_id, frame_ns, client_ns, server_recv_ns, server_send_ns, version=VERSION):
+    """Pack a reply in the requested version; v1 drops the server receive time"""
+    header = HEADER.pack(MAGIC, version, MSG_FRAME_RESPONSE)
+    if version < 2:
+        return header + FRAME_RESPONSE_V1.pack(status, frame_id, frame_ns, client_ns, server_send_ns)
+    return header + FRAME_RESPONSE_V2.pack(status, frame_id, frame_ns, client_ns, server_recv_ns, server_send_ns)
+
+
+def unpack(data):
+    """Parse a binary datagram into (version, msg_type, fields)
+
+    `fields` is a tuple matching the message body, or () for HELLO/HELLO_ACK.
+    Version 1 frame responses are widened to the version 2 layout with the
+    server receive time equal to the send time. Raises ValueError for
+    malformed or truncated datagrams.
+    """
+    if not is_binary(data):
+        raise ValueError("Not a binary timestamp datagram")
+    _, version, msg_type = HEADER.unpack_from(data)
+    if msg_type == MSG_FRAME_RESPONSE and version < 2:
+        if len(data) < HEADER.size + FRAME_RESPONSE_V1.size:
+            raise ValueError("Truncated timestamp datagram")
+        status, frame_id, frame_ns, client_ns, server_ns = FRAME_RESPONSE_V1.unpack_from(data, HEADER.size)
+        return version, msg_type, (status, frame_id, frame_ns, client_ns, server_ns, server_ns)
+    body = {
+        MSG_FRAME_REQUEST: FRAME_REQUEST,
+        MSG_FRAME_RESPONSE: FRAME_RESPONSE_V2,
+    }.get(msg_type)
+    if body is None:
+        if msg_type in (MSG_HELLO, MSG_HELLO_ACK):
+            return version, msg_type, ()
+        raise ValueError(f"Unknown message type {msg_type}")
+    if len(data) < HEADER.size + body.size:
+        raise ValueError("Truncated timestamp datagram")
+    return version, msg_type, body.unpack_from(data, HEADER.size)
+
+
+def negotiate(client_version, server_version=VERSION):
+    """Version both sides speak"""
+    return min(client_version, server_version)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+MPEG-TS loss and jitter analysis for the audio stream
+
+The sender's ffmpeg sends the audio as MPEG-TS, seven 188-byte packets per
+datagram. Every packet carries a 4-bit continuity counter per PID and some
+carry a PCR (the sender's 27 MHz clock). TSAnalyzer reads both straight
+from the receive buffer through a memoryview, without copying packets:
+
+- per-PID loss from continuity counter gaps (duplicates and signalled
+  discontinuities are not losses),
+- loss bursts: every gap is one loss event whose length is the number of
+  packets missing,
+- PCR arrival jitter, the RFC 3550 interarrival jitter estimator applied to
+  PCR values instead of RTP timestamps.
+
+python ts_analyzer.py runs it over a synthetic stream with known loss and
+jitter.
+"""
+
+import sys
+from collections import deque
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+TS_NULL_PID = 0x1FFF
+PCR_HZ = 27000000
+PCR_WRAP = (1 << 33) * 300
+
+# Transit changes larger than this are a PCR discontinuity, not jitter
+MAX_TRANSIT_STEP_NS = 1000000000
+
+
+class PIDStats:
+    def __init__(self):
+        self.packets = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.discontinuities = 0
+        self.last_cc = None
+        self.duplicate_seen = False
+
+
+class TSAnalyzer:
+    def __init__(self, burst_window=100):
+        """
+        Args:
+            burst_window: number of recent loss bursts kept for the windowed statistics
+        """
+        self.pids = {}
+        self.packets = 0
+        self.lost = 0
+        self.sync_errors = 0
+        self.loss_events = 0
+        self.max_burst = 0
+        self.bursts = deque(maxlen=burst_window)
+
+        # RFC 3550 section 6.4.1 estimator, kept in nanoseconds
+        self.jitter_ns = 0.0
+        self.pcr_pid = None
+        self.last_transit_ns = None
+        self.last_pcr = None
+        self.pcr_unwrapped = 0
+        self.pcr_count = 0
+
+    def feed(self, view, nbytes, received_ns):
+        """Analyze the TS packets in the first nbytes of a buffer received at received_ns"""
+        for offset in range(0, nbytes - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+            if view[offset] != TS_SYNC_BYTE:
+                self.sync_errors += 1
+                continue
+            self.packets += 1
+            pid = ((view[offset + 1] & 0x1F) << 8) | view[offset + 2]
+            if pid == TS_NULL_PID:
+                continue
+            flags = view[offset + 3]
+            adaptation = flags & 0x20
+            discontinuity = False
+            if adaptation and view[offset + 4] > 0:
+                af_flags = view[offset + 5]
+                discontinuity = bool(af_flags & 0x80)
+                if af_flags & 0x10:
+                    self.handle_pcr(pid, view, offset + 6, received_ns, discontinuity)
+
+            stats = self.pids.get(pid)
+            if stats is None:
+                stats = self.pids[pid] = PIDStats()
+            stats.packets += 1
+            if not flags & 0x10:
+                # Continuity counter only advances on packets with payload
+                continue
+            cc = flags & 0x0F
+            if stats.last_cc is not None and not discontinuity:
+                if cc == stats.last_cc:
+                    # One duplicate is allowed; a second repeat means 16 packets were lost
+                    if not stats.duplicate_seen:
+                        stats.duplicates += 1
+                        stats.duplicate_seen = True
+                        continue
+                    self.record_loss(stats, 16)
+                else:
+                    missing = (cc - stats.last_cc - 1) & 0x0F
+                    if missing:
+                        self.record_loss(stats, missing)
+            elif discontinuity:
+                stats.discontinuities += 1
+            stats.last_cc = cc
+            stats.duplicate_seen = False
+
+    def record_loss(self, stats, missing):
+        stats.lost += missing
+        self.lost += missing
+        self.loss_events += 1
+        self.max_burst = max(self.max_burst, missing)
+        self.bursts.append(missing)
+
+    def handle_pcr(self, pid, view, offset, received_ns, discontinuity):
+        if self.pcr_pid is None:
+            self.pcr_pid = pid
+        elif pid != self.pcr_pid:
+            return
+        base = (view[offset] << 25) | (view[offset + 1] << 17) | (view[offset + 2] << 9) \
+            | (view[offset + 3] << 1) | (view[offset + 4] >> 7)
+        extension = ((view[offset + 4] & 0x01) << 8) | view[offset + 5]
+        pcr = base * 300 + extension
+
+        if self.last_pcr is not None and not discontinuity:
+            self.pcr_unwrapped += (pcr - self.last_pcr) % PCR_WRAP
+        else:
+            self.last_transit_ns = None
+        self.last_pcr = pcr
+        self.pcr_count += 1
+
+        transit_ns = received_ns - self.pcr_unwrapped * 1000 // 27
+        if self.last_transit_ns is not None:
+            d = abs(transit_ns - self.last_transit_ns)
+            if d > MAX_TRANSIT_STEP_NS:
+                # Sender restarted or PCR jumped without the discontinuity flag
+                self.last_transit_ns = transit_ns
+                return
+            self.jitter_ns += (d - self.jitter_ns) / 16.0
+        self.last_transit_ns = transit_ns
+
+    @property
+    def jitter_ms(self):
+        return self.jitter_ns / 1e6
+
+    def loss_percent(self):
+        total = self.packets + self.lost
+        return 100.0 * self.lost / total if total else 0.0
+
+    def burst_stats(self):
+        """Loss burst statistics over the whole run and the recent window"""
+        recent = list(self.bursts)
+        return {
+            'events': self.loss_events,
+            'max': self.max_burst,
+            'mean': self.lost / self.loss_events if self.loss_events else 0.0,
+            'recent_mean': sum(recent) / len(recent) if recent else 0.0,
+            'recent_max': max(recent) if recent else 0,
+        }
+
+    def snapshot(self):
+        return {
+            'packets': self.packets,
+            'lost': self.lost,
+            'sync_errors': self.sync_errors,
+            'loss_percent': self.loss_percent(),
+            'pcr_jitter_ms': self.jitter_ms,
+            'bursts': self.burst_stats(),
+            'pids': {pid: {'packets': s.packets, 'lost': s.lost, 'duplicates': s.duplicates}
+                     for pid, s in list(self.pids.items())},
+        }
+
+
+def ts_packet(pid, cc, pcr=None, payload=True):
+    """One 188-byte TS packet, with an adaptation field carrying `pcr` if given"""
+    flags = (0x10 if payload else 0) | (0x20 if pcr is not None else 0) | cc
+    packet = bytearray([TS_SYNC_BYTE, 0x40 | (pid >> 8), pid & 0xFF, flags])
+    if pcr is not None:
+        base, extension = divmod(pcr % PCR_WRAP, 300)
+        packet += bytes([7, 0x10,
+                         (base >> 25) & 0xFF, (base >> 17) & 0xFF, (base >> 9) & 0xFF, (base >> 1) & 0xFF,
+                         ((base & 1) << 7) | 0x7E | (extension >> 8), extension & 0xFF])
+    packet += b'\xff' * (TS_PACKET_SIZE - len(packet))
+    return bytes(packet)
+
+
+def synthetic_stream(datagrams=20000, interval_ms=8.0, jitter_ms=2.0, loss=0.01, max_burst=2,
+                     pid=0x100, pcr_start=PCR_WRAP - PCR_HZ, seed=0):
+    """Yield (datagram, received_ns) with Gaussian arrival jitter and dropped runs of datagrams
+
+    Loss comes in bursts of 1..max_burst consecutive datagrams (two datagrams
+    are 14 packets; 16 or more would alias on the 4-bit counter). Every
+    datagram starts with a PCR packet; the PCR starts a second before the
+    33-bit wrap. Returns the true number of lost packets via StopIteration.value.
+    """
+    import random
+    rng = random.Random(seed)
+    cc = 0
+    lost = 0
+    drop = 0
+    for index in range(datagrams):
+        pcr = pcr_start + int(index * interval_ms * PCR_HZ / 1000)
+        packets = []
+        for n in range(7):
+            packets.append(ts_packet(pid, cc, pcr if n == 0 else None))
+            cc = (cc + 1) & 0x0F
+        if not drop and 0 < index < datagrams - 1 and rng.random() < loss:
+            drop = rng.randint(1, max_burst)
+        if drop and index < datagrams - 1:
+            drop -= 1
+            lost += 7
+            continue
+        received_ns = int((1e9 + index * interval_ms * 1e6 + rng.gauss(0, jitter_ms) * 1e6))
+        yield b''.join(packets), received_ns
+    return lost
+
+
+def self_check(jitter_ms=2.0):
+    import math
+    analyzer = TSAnalyzer()
+    stream = synthetic_stream(jitter_ms=jitter_ms)
+    try:
+        while True:
+            datagram, received_ns = next(stream)
+            analyzer.feed(memoryview(datagram), len(datagram), received_ns)
+    except StopIteration as stop:
+        true_lost = stop.value
+
+    # With N(0, s) arrival noise D ~ N(0, s * sqrt(2)), so the jitter converges to E|D| = 2s / sqrt(pi)
+    expected_jitter = 2 * jitter_ms / math.sqrt(math.pi)
+    snapshot = analyzer.snapshot()
+    print(f"Packets {snapshot['packets']}, lost {snapshot['lost']} (true {true_lost}), "
+          f"{snapshot['loss_percent']:.2f}% loss, sync errors {snapshot['sync_errors']}")
+    print(f"Bursts: {snapshot['bursts']}")
+    print(f"PCR jitter {snapshot['pcr_jitter_ms']:.3f} ms (expected about {expected_jitter:.3f} ms "
+          f"for {jitter_ms} ms Gaussian arrival noise, {analyzer.pcr_count} PCRs across the 33-bit wrap)")
+    return snapshot['lost'] == true_lost and abs(snapshot['pcr_jitter_ms'] - expected_jitter) < 0.25 * expected_jitter
+
+
+if __name__ == "__main__":
+    sys.exit(0 if self_check() else 1)
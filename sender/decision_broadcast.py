@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Processing mode decision broadcast over UDP multicast
+"""
+
+import socket
+
+
+class DecisionBroadcaster:
+    """Pushes every published decision snapshot to the multicast group
+
+    Each datagram is the snapshot's compact JSON payload, which carries a
+    monotonically increasing `seq` so receivers can detect lost decisions.
+    Sender cost is one sendto per sample regardless of how many receivers
+    have joined the group.
+    """
+
+    def __init__(self, multicast_addr='239.0.0.1', port=5104, bind_ip=None, ttl=1):
+        self.multicast_addr = multicast_addr
+        self.port = port
+        self.sent_count = 0
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        if bind_ip:
+            # Send on the same interface as the media streams
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(bind_ip))
+
+    def publish(self, snapshot):
+        """Send one DecisionSnapshot; usable directly as a DecisionSampler listener"""
+        try:
+            self.sock.sendto(snapshot.payload, (self.multicast_addr, self.port))
+            self.sent_count += 1
+        except OSError as e:
+            print(f"Decision broadcast error: {e}")
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Background S11 sampler publishing the latest processing mode decision
+"""
+
+import threading
+import time
+import json
+from collections import namedtuple
+
+# Immutable view of one published decision. `payload` is the JSON reply sent
+# to decision clients, serialised once when the snapshot is published.
+DecisionSnapshot = namedtuple('DecisionSnapshot', ['seq', 'timestamp', 'decision', 'payload'])
+
+
+def make_snapshot(seq, decision, timestamp=None):
+    """Build a snapshot from a decision dict without keeping a reference to it"""
+    timestamp = time.time() if timestamp is None else timestamp
+    decision = dict(decision, seq=seq, timestamp=timestamp)
+    return DecisionSnapshot(seq, timestamp, decision, json.dumps(decision, separators=(',', ':')).encode())
+
+
+class DecisionSampler:
+    """Single owner of the VNA: scans on a fixed interval and publishes snapshots
+
+    Readers call latest() and never touch the device, so the number of scans
+    per second depends only on the interval, not on how many clients ask.
+    """
+
+    def __init__(self, monitor, interval=5.0, smoother=None):
+        self.monitor = monitor
+        self.interval = interval
+        self.smoother = smoother
+        self.scan_count = 0
+        self.listeners = []
+
+        self._snapshot = None
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        """Register callback(snapshot), called from the sampler thread on every publish"""
+        self.listeners.append(callback)
+
+    def latest(self):
+        """Return the most recent DecisionSnapshot, or None before the first scan"""
+        # Reading a single attribute is atomic; the snapshot itself is never mutated
+        return self._snapshot
+
+    def wait_ready(self, timeout=None):
+        """Block until the first snapshot has been published"""
+        return self._ready.wait(timeout)
+
+    def publish(self, decision):
+        """Swap in a new snapshot for the given decision and notify listeners"""
+        with self._lock:
+            self._seq += 1
+            snapshot = make_snapshot(self._seq, decision)
+            self._snapshot = snapshot
+        self._ready.set()
+
+        for callback in self.listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"Decision listener error: {e}")
+        return snapshot
+
+    def sample_once(self):
+        """Take one S11 reading and publish the resulting decision"""
+        decision = self.monitor.get_current_status()
+        self.scan_count += 1
+        if self.smoother is not None:
+            decision = self.smoother.update(decision)
+        return self.publish(decision)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.sample_once()
+            except Exception as e:
+                print(f"S11 sampler error: {e}")
+            # Keep a steady cadence regardless of how long the scan took
+            self._stop_event.wait(max(0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        """Start the sampler thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop sampling and wait for an in-flight scan to finish"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+class _FakeMonitor:
+    """Stand-in for S11Monitor that sleeps for the duration of a VNA scan"""
+
+    def __init__(self, scan_time=0.2):
+        self.scan_time = scan_time
+
+    def get_current_status(self):
+        time.sleep(self.scan_time)
+        return {"mode": "Light AV Mode", "mode_code": 2, "s11_mean": -50.0, "defuzzified_value": 15.0}
+
+    def default_decision(self):
+        return {"mode": "Advanced AV Mode", "mode_code": 4, "s11_mean": -30, "defuzzified_value": 40}
+
+    def close(self):
+        pass
+
+
+def load_test(client_counts=(1, 4, 16, 64), duration=5.0, interval=0.5, port=15103):
+    """Hammer the decision server with N clients and report scan and request rates"""
+    import socket
+    from streamer_UDP import MediaStreamer
+
+    print(f"{'clients':>8} {'scans/s':>8} {'requests/s':>11} {'median reply':>13}")
+    for index, count in enumerate(client_counts):
+        streamer = MediaStreamer(bind_ip='127.0.0.1', decision_port=port + index,
+                                 s11_monitor=_FakeMonitor(), decision_interval=interval)
+        streamer.running = True
+        threading.Thread(target=streamer.start_decision_server, daemon=True).start()
+        streamer.decision_sampler.start()
+        streamer.decision_sampler.wait_ready()
+        time.sleep(0.2)
+
+        replies = []
+        stop_at = time.monotonic() + duration
+        scans_before = streamer.decision_sampler.scan_count
+
+        def client():
+            sock = socket.create_connection(('127.0.0.1', port + index))
+            try:
+                while time.monotonic() < stop_at:
+                    started = time.perf_counter()
+                    sock.sendall(b'GET_DECISION')
+                    if not sock.recv(1024):
+                        break
+                    replies.append(time.perf_counter() - started)
+            finally:
+                sock.close()
+
+        clients = [threading.Thread(target=client) for _ in range(count)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+
+        scans = streamer.decision_sampler.scan_count - scans_before
+        streamer.running = False
+        streamer.decision_sampler.stop()
+
+        replies.sort()
+        median_us = replies[len(replies) // 2] * 1e6 if replies else 0
+        print(f"{count:>8} {scans / duration:>8.2f} {len(replies) / duration:>11.0f} {median_us:>10.0f} us")
+
+
+if __name__ == "__main__":
+    load_test()
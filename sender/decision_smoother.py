@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decision smoothing between S11Monitor and the decision server
+
+Raw decisions flip whenever the mean S11 hovers near a mode boundary, and
+every flip makes the receiver swap enhancement models. The smoother applies,
+in order:
+
+1. an EMA or median filter on s11_mean,
+2. hysteresis bands around each defuzzified-value threshold,
+3. a minimum dwell time before another mode change is allowed.
+"""
+
+from collections import deque
+import time
+import numpy as np
+from fuzzy_table import CompiledFuzzyController, MODE_THRESHOLDS, MODE_NAMES
+
+
+class DecisionSmoother:
+    def __init__(self, filter='ema', alpha=0.5, window=5, hysteresis=1.0, min_dwell=10.0, controller=None):
+        """
+        Args:
+            filter: 'ema', 'median' or None to use the raw s11_mean
+            alpha: EMA weight of the newest sample
+            window: number of samples in the median filter
+            hysteresis: band (in defuzzified-value units) applied on each side of every
+                threshold; a float for all thresholds or a dict {threshold: band}
+            min_dwell: seconds a mode must be held before switching again
+        """
+        if filter not in ('ema', 'median', None):
+            raise ValueError(f"Unknown filter: {filter}")
+        self.filter = filter
+        self.alpha = alpha
+        self.window = window
+        self.min_dwell = min_dwell
+        self.controller = controller or CompiledFuzzyController()
+
+        if isinstance(hysteresis, dict):
+            self.bands = {t: hysteresis.get(t, 0.0) for t, _ in MODE_THRESHOLDS}
+        else:
+            self.bands = {t: hysteresis for t, _ in MODE_THRESHOLDS}
+
+        self.reset()
+
+    def reset(self):
+        self.filtered = None
+        self.samples = deque(maxlen=self.window)
+        self.mode_code = None
+        self.defuzzified_value = None
+        self.last_switch_time = None
+        self.suppressed = 0
+
+    def filter_s11(self, s11_mean):
+        """Feed one raw s11_mean and return the filtered value"""
+        if self.filter == 'ema':
+            if self.filtered is None:
+                self.filtered = s11_mean
+            else:
+                self.filtered += self.alpha * (s11_mean - self.filtered)
+        elif self.filter == 'median':
+            self.samples.append(s11_mean)
+            self.filtered = float(np.median(self.samples))
+        else:
+            self.filtered = s11_mean
+        return self.filtered
+
+    def _code_with_offset(self, value, sign):
+        for threshold, code in MODE_THRESHOLDS:
+            if value >= threshold + sign * self.bands[threshold]:
+                return code
+        return 0
+
+    def hysteresis_mode(self, value):
+        """Mode for `value` given the current mode, only crossing a threshold past its band"""
+        if self.mode_code is None:
+            return self._code_with_offset(value, 0)
+        up = self._code_with_offset(value, +1)
+        if up > self.mode_code:
+            return up
+        down = self._code_with_offset(value, -1)
+        if down < self.mode_code:
+            return down
+        return self.mode_code
+
+    def step(self, s11_mean, now):
+        """Advance the smoother by one sample and return the held mode code"""
+        value, code = self.controller.evaluate(self.filter_s11(s11_mean))
+        if code < 0:
+            # No rule fires; keep whatever is currently held
+            return self.mode_code if self.mode_code is not None else MODE_THRESHOLDS[0][1]
+        self.defuzzified_value = value
+
+        candidate = self.hysteresis_mode(value)
+        if self.mode_code is None:
+            self.mode_code = candidate
+            self.last_switch_time = now
+        elif candidate != self.mode_code:
+            if now - self.last_switch_time >= self.min_dwell:
+                self.mode_code = candidate
+                self.last_switch_time = now
+            else:
+                self.suppressed += 1
+        return self.mode_code
+
+    def update(self, decision, now=None):
+        """Smooth one decision dict from S11Monitor.get_current_status()
+
+        Decisions produced without a measurement (the monitor's failure
+        default) are passed through untouched and do not feed the filter.
+        """
+        if not decision.get("measured", True):
+            return decision
+
+        now = time.monotonic() if now is None else now
+        code = self.step(decision["s11_mean"], now)
+        value = self.defuzzified_value if self.defuzzified_value is not None else decision["defuzzified_value"]
+        return dict(decision,
+                    mode=MODE_NAMES[code],
+                    mode_code=code,
+                    s11_mean=self.filtered,
+                    s11_raw=decision["s11_mean"],
+                    defuzzified_value=value)
+
+    def apply(self, times, s11_means):
+        """Reset the smoother and run a whole trace through it; returns mode codes"""
+        self.reset()
+        codes = np.empty(len(s11_means), dtype=np.int8)
+        for i, (t, s11_mean) in enumerate(zip(times, s11_means)):
+            codes[i] = self.step(float(s11_mean), float(t))
+        return codes
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixed-capacity ring of (frame_id, capture time in ns) for the timestamp service
+
+One writer (the frame counter) appends increasing frame ids; any number of
+reader threads (the timestamp server) look frames up concurrently. Each slot
+holds a single (frame_id, ns) tuple, so publishing an entry is one list item
+assignment and readers can never see a frame id paired with another frame's
+time. A reader that finds a different id in the slot knows the frame was
+overwritten. No lock is needed on either side.
+
+Run `python frame_ring.py` for the wraparound and concurrent-reader checks.
+"""
+
+import time
+import threading
+
+
+class FrameTimestampRing:
+    def __init__(self, capacity=128):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._latest = None
+
+    def append(self, frame_id, timestamp_ns):
+        """Record a frame; only one thread may call this"""
+        entry = (frame_id, timestamp_ns)
+        self._slots[frame_id % self.capacity] = entry
+        self._latest = entry
+
+    def latest(self):
+        """(frame_id, timestamp_ns) of the newest frame, or None if empty"""
+        return self._latest
+
+    def get(self, frame_id):
+        """Capture time of `frame_id`, or None if unknown or already overwritten"""
+        entry = self._slots[frame_id % self.capacity]
+        if entry is not None and entry[0] == frame_id:
+            return entry[1]
+        return None
+
+    def __contains__(self, frame_id):
+        return self.get(frame_id) is not None
+
+    def __len__(self):
+        latest = self._latest
+        if latest is None:
+            return 0
+        return min(latest[0], self.capacity)
+
+    def __bool__(self):
+        return self._latest is not None
+
+
+def check_wraparound(capacity=8):
+    ring = FrameTimestampRing(capacity)
+    assert ring.latest() is None and not ring and ring.get(1) is None
+
+    for frame_id in range(1, 3 * capacity + 4):
+        ring.append(frame_id, frame_id * 1000)
+        assert ring.latest() == (frame_id, frame_id * 1000)
+        assert len(ring) == min(frame_id, capacity)
+
+    newest = 3 * capacity + 3
+    # Everything within the last `capacity` frames is retrievable, older ones are gone
+    for frame_id in range(1, newest + 1):
+        expected = frame_id * 1000 if frame_id > newest - capacity else None
+        assert ring.get(frame_id) == expected, (frame_id, ring.get(frame_id))
+    assert ring.get(newest + 1) is None
+    print(f"Wraparound: ok (capacity {capacity}, {newest} frames)")
+
+
+def check_concurrent_readers(readers=4, duration=1.0, capacity=16):
+    """Readers must only ever see the timestamp written for the id they asked for"""
+    ring = FrameTimestampRing(capacity)
+    stop = threading.Event()
+    errors = []
+    lookups = [0] * readers
+
+    def writer():
+        frame_id = 0
+        while not stop.is_set():
+            frame_id += 1
+            ring.append(frame_id, frame_id * 7)
+
+    def reader(index):
+        while not stop.is_set():
+            latest = ring.latest()
+            if latest is None:
+                continue
+            frame_id, ns = latest
+            if ns != frame_id * 7:
+                errors.append(("latest", latest))
+            for wanted in (frame_id, frame_id - capacity // 2, frame_id - capacity - 1):
+                found = ring.get(wanted)
+                if found is not None and found != wanted * 7:
+                    errors.append(("get", wanted, found))
+            lookups[index] += 1
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors[:5]
+    print(f"Concurrent readers: ok ({readers} readers, {sum(lookups)} lookups, "
+          f"{ring.latest()[0]} frames written)")
+
+
+def benchmark(frames=100000, history=100):
+    """Compare with the old dict + min() eviction"""
+    table = {}
+    started = time.perf_counter()
+    for frame_id in range(1, frames + 1):
+        if len(table) > history:
+            del table[min(table.keys())]
+        table[frame_id] = frame_id
+        max(table.keys())
+    dict_time = time.perf_counter() - started
+
+    ring = FrameTimestampRing(history)
+    started = time.perf_counter()
+    for frame_id in range(1, frames + 1):
+        ring.append(frame_id, frame_id)
+        ring.latest()
+    ring_time = time.perf_counter() - started
+
+    print(f"Append + latest, {history} frames of history: dict {dict_time / frames * 1e6:.2f} us, "
+          f"ring {ring_time / frames * 1e6:.2f} us ({dict_time / ring_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    check_wraparound()
+    check_wraparound(capacity=1)
+    check_concurrent_readers()
+    benchmark()
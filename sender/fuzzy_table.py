@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Precompiled fuzzy inference for S11-based processing mode selection
+
+The controller has a single scalar input (mean S11 in dB) on a fixed domain,
+so the whole Mamdani pipeline (fuzzification, min/max rules and centroid
+defuzzification) is evaluated once over a fine grid at start-up. Queries are
+then a table interpolation instead of a full inference pass, and scikit-fuzzy
+is only needed to validate the table, not at runtime.
+"""
+
+import sys
+import numpy as np
+
+# Universes of discourse, identical to the ones S11Monitor has always used
+CL_UNIVERSE = (-85, -25, 0.1)
+SE_UNIVERSE = (0, 46, 1)
+
+# CL (Channel Loss) membership functions
+CL_SETS = {
+    "low": [-85, -75, -65, -60],
+    "mid": [-55, -50, -45, -40],
+    "high": [-35, -30, -25, -20],
+}
+
+# SE (Speech Enhancement) membership functions
+SE_SETS = {
+    "not": [0, 0, 5, 10],
+    "little": [5, 10, 15, 20],
+    "mid": [15, 20, 25, 30],
+    "high": [25, 30, 35, 40],
+    "veryHigh": [35, 40, 45, 50],
+}
+
+# Rule base: IF CL is <key> THEN SE is <value>
+RULES = [("low", "not"), ("mid", "little"), ("high", "high")]
+
+# Lower bound of the defuzzified value for each mode, highest first
+MODE_THRESHOLDS = [(39, 4), (25, 3), (12, 2), (9, 1)]
+MODE_NAMES = {
+    4: "Advanced AV Mode",
+    3: "Standard AV Mode",
+    2: "Light AV Mode",
+    1: "Audio-Only Enhancement Mode",
+    0: "No Enhancement Mode",
+}
+
+# Maximum absolute difference from the scikit-fuzzy result the table may have
+TOLERANCE = 0.05
+
+
+def trapmf(x, abcd):
+    """Trapezoidal membership function, equivalent to skfuzzy.trapmf"""
+    a, b, c, d = abcd
+    x = np.asarray(x, dtype=float)
+    y = np.ones(len(x))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rising = np.where(b > a, (x - a) / (b - a), 1.0)
+        falling = np.where(d > c, (d - x) / (d - c), 1.0)
+    y = np.where(x <= b, rising, y)
+    y = np.where(x >= c, falling, y)
+    y[(x < a) | (x > d)] = 0.0
+    # skfuzzy evaluates the shoulders with trimf, which gives 1 at the peak
+    y[x == b] = 1.0
+    y[x == c] = 1.0
+    return y
+
+
+def mode_from_value(value):
+    """Map a defuzzified value to its mode code"""
+    for threshold, code in MODE_THRESHOLDS:
+        if value >= threshold:
+            return code
+    return 0
+
+
+def mode_codes(values):
+    """Vectorized mode_from_value; NaN inputs map to -1"""
+    values = np.asarray(values, dtype=float)
+    codes = np.zeros(values.shape, dtype=np.int8)
+    for threshold, code in reversed(MODE_THRESHOLDS):
+        codes[values >= threshold] = code
+    codes[np.isnan(values)] = -1
+    return codes
+
+
+class FuzzySets:
+    """Sampled membership functions on the CL and SE universes"""
+
+    def __init__(self):
+        self.x_CL = np.arange(*CL_UNIVERSE)
+        self.y_SE = np.arange(*SE_UNIVERSE)
+        self.CL = {name: trapmf(self.x_CL, abcd) for name, abcd in CL_SETS.items()}
+        self.SE = {name: trapmf(self.y_SE, abcd) for name, abcd in SE_SETS.items()}
+
+    def infer(self, s11_values):
+        """Run the full inference for an array of inputs; NaN where no rule fires"""
+        s11_values = np.atleast_1d(np.asarray(s11_values, dtype=float))
+        out_SE = np.zeros((len(s11_values), len(self.y_SE)))
+        for cl_name, se_name in RULES:
+            # Outside the universe memberships are zero, as in skfuzzy.interp_membership
+            fit = np.interp(s11_values, self.x_CL, self.CL[cl_name], left=0.0, right=0.0)
+            np.fmax(out_SE, np.fmin(fit[:, None], self.SE[se_name]), out=out_SE)
+        return self.centroid(out_SE)
+
+    def centroid(self, out_SE):
+        """Row-wise centroid of piecewise-linear membership functions"""
+        x1, x2 = self.y_SE[:-1], self.y_SE[1:]
+        y1, y2 = out_SE[:, :-1], out_SE[:, 1:]
+        height = y1 + y2
+        area = 0.5 * (x2 - x1) * height
+        with np.errstate(divide='ignore', invalid='ignore'):
+            moment = np.where(height > 0, 2.0 / 3.0 * (x2 - x1) * (y2 + 0.5 * y1) / height, 0.0) + x1
+            total_area = area.sum(axis=1)
+            values = (moment * area).sum(axis=1) / total_area
+        values[total_area <= 0] = np.nan
+        return values
+
+
+class CompiledFuzzyController:
+    """O(1) lookup of the defuzzified value and mode code for a mean S11"""
+
+    def __init__(self, resolution=0.01):
+        self.sets = FuzzySets()
+        self.x_min = float(self.sets.x_CL[0])
+        self.x_max = float(self.sets.x_CL[-1])
+        self.size = int(round((self.x_max - self.x_min) / resolution)) + 1
+        self.grid = np.linspace(self.x_min, self.x_max, self.size)
+        self.step = (self.x_max - self.x_min) / (self.size - 1)
+        self.table = self.sets.infer(self.grid)
+
+    def defuzzify(self, s11_mean):
+        """Defuzzified value for one input, or NaN if no rule fires"""
+        if not self.x_min <= s11_mean <= self.x_max:
+            return float('nan')
+        position = (s11_mean - self.x_min) / self.step
+        index = min(int(position), self.size - 2)
+        frac = position - index
+        low, high = self.table[index], self.table[index + 1]
+        if (low != low) != (high != high):
+            # Cell straddles the edge of a region where no rule fires; infer exactly
+            return float(self.sets.infer(s11_mean)[0])
+        return float(low * (1 - frac) + high * frac)
+
+    def evaluate(self, s11_mean):
+        """Return (defuzzified_value, mode_code); mode_code is -1 if no rule fires"""
+        value = self.defuzzify(s11_mean)
+        if value != value:
+            return value, -1
+        return value, mode_from_value(value)
+
+    def evaluate_batch(self, s11_means):
+        """Vectorized evaluate over an array; returns (defuzzified, mode_codes)
+
+        Pure function of its input. Samples where no rule fires get a NaN
+        value and mode code -1.
+        """
+        s11_means = np.asarray(s11_means, dtype=float)
+        values = np.interp(s11_means, self.grid, self.table, left=np.nan, right=np.nan)
+
+        # Same exact fallback as defuzzify() for cells on the edge of an empty region
+        position = (s11_means - self.x_min) / self.step
+        inside = (position >= 0) & (position <= self.size - 1)
+        index = np.minimum(np.where(inside, position, 0).astype(np.intp), self.size - 2)
+        empty = np.isnan(self.table)
+        edge = inside & (empty[index] != empty[index + 1])
+        if edge.any():
+            values[edge] = self.sets.infer(s11_means[edge])
+
+        return values, mode_codes(values)
+
+
+def hold_last(codes, initial=4):
+    """Forward-fill -1 codes with the previous valid one, as S11Monitor does online"""
+    codes = np.asarray(codes)
+    valid = codes >= 0
+    index = np.where(valid, np.arange(len(codes)), -1)
+    np.maximum.accumulate(index, out=index)
+    held = np.where(index >= 0, codes[np.maximum(index, 0)], initial)
+    return held.astype(codes.dtype)
+
+
+def validate(controller=None, samples=20000, seed=0):
+    """Compare the compiled table with scikit-fuzzy on random and grid inputs"""
+    import skfuzzy as fuzz
+
+    controller = controller or CompiledFuzzyController()
+    sets = controller.sets
+    x_CL, y_SE = sets.x_CL, sets.y_SE
+    CL = {name: fuzz.trapmf(x_CL, abcd) for name, abcd in CL_SETS.items()}
+    SE = {name: fuzz.trapmf(y_SE, abcd) for name, abcd in SE_SETS.items()}
+
+    rng = np.random.default_rng(seed)
+    inputs = np.concatenate([rng.uniform(-90, -20, samples), x_CL])
+
+    max_error = 0.0
+    mode_mismatches = 0
+    empty_mismatches = 0
+    for s11_mean in inputs:
+        out_SE = np.zeros_like(y_SE, dtype=float)
+        for cl_name, se_name in RULES:
+            fit = fuzz.interp_membership(x_CL, CL[cl_name], s11_mean)
+            out_SE = np.fmax(out_SE, np.fmin(fit, SE[se_name]))
+
+        value, code = controller.evaluate(s11_mean)
+        try:
+            expected = fuzz.defuzz(y_SE, out_SE, 'centroid')
+        except Exception:
+            # skfuzzy refuses to defuzzify an empty output set
+            empty_mismatches += value == value
+            continue
+
+        if value != value:
+            empty_mismatches += 1
+            continue
+        error = abs(value - expected)
+        max_error = max(max_error, error)
+        if code != mode_from_value(expected) and error > 0:
+            # Only acceptable when the expected value sits within tolerance of a threshold
+            if min(abs(expected - t) for t, _ in MODE_THRESHOLDS) > TOLERANCE:
+                mode_mismatches += 1
+
+    print(f"Validated {len(inputs)} inputs: max |error| = {max_error:.5f} (tolerance {TOLERANCE}), "
+          f"mode mismatches = {mode_mismatches}, empty-set mismatches = {empty_mismatches}")
+    return max_error <= TOLERANCE and mode_mismatches == 0 and empty_mismatches == 0
+
+
+if __name__ == "__main__":
+    ok = validate()
+    sys.exit(0 if ok else 1)
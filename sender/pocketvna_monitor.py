@@ -12,12 +12,12 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'pocketvna_api'))
 import pocketvna
 
 import numpy as np
-import math
 import time
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 import skfuzzy as fuzz
 from skfuzzy import control as ctrl
+from sweep_stats import SweepStatistics
 
 # Set matplotlib to display text
 plt.rcParams['font.sans-serif'] = ['WenQuanYi Zen Hei', 'WenQuanYi Micro Hei', 'DejaVu Sans']
@@ -40,6 +40,9 @@ class PocketVNAMonitor:
         self.x_CL = np.arange(-85, -25, 0.1)
         self.y_SE = np.arange(0, 46, 1)
         
+        # Frequency grid and dB buffers are built once and reused per sweep
+        self.sweep = SweepStatistics(self.start_freq, self.end_freq, self.num_of_points)
+        
         # 添加调试信息 - 显示当前工作目录和PocketVNA API版本信息
         print(f"当前工作目录: {os.getcwd()}")
         print(f"PocketVNA API版本: {getattr(pocketvna, 'version', '未知')}")
@@ -182,26 +185,21 @@ class PocketVNAMonitor:
             else:
                 print('连接有效，准备进行测量')
             
-            # Calculate frequency range
-            freq = [self.start_freq + i * (self.end_freq - self.start_freq) / (self.num_of_points - 1) 
-                    for i in range(self.num_of_points)]
-            
             print(f"正在扫描频率范围: {self.start_freq/1e9}GHz 至 {self.end_freq/1e9}GHz，共 {self.num_of_points} 个点")
             
             # Execute S11 scan
             print("开始S11扫描...")
-            s11, _, _, _ = driver.scan(freq, 10, pocketvna.NetworkParams.S11)
+            s11, _, _, _ = driver.scan(self.sweep.freq, 10, pocketvna.NetworkParams.S11)
             print(f"扫描完成，获取了 {len(s11)} 个数据点")
             
-            # Convert S11 to dB
-            s11_db = [20 * math.log10(math.sqrt(s.real**2 + s.imag**2)) for s in s11]
-            
-            # Calculate minimum, maximum and average values
-            self.s11_min = min(s11_db)
-            self.s11_max = max(s11_db)
-            self.s11_mean = sum(s11_db) / len(s11_db)
+            # Convert S11 to dB and calculate sweep statistics
+            stats = self.sweep.compute(s11)
+            self.s11_min = stats["min"]
+            self.s11_max = stats["max"]
+            self.s11_mean = stats["mean"]
             
             print(f"S11统计: 最小值 = {self.s11_min:.2f}dB, 最大值 = {self.s11_max:.2f}dB, 平均值 = {self.s11_mean:.2f}dB")
+            print(f"谐振点: {stats['dip_freq']/1e9:.3f}GHz, 深度 = {stats['dip_depth']:.2f}dB, 标准差 = {stats['std']:.2f}dB")
             
             # Close connection
             driver.close()
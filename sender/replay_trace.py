@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay a recorded S11 trace through the mode decision logic
+
+Usage:
+    python replay_trace.py trace.csv [--interval 5]
+    python replay_trace.py trace.npy --smooth --filter median --min-dwell 20
+    python replay_trace.py --synthetic
+
+A trace is either a single column of mean S11 values in dB, sampled every
+--interval seconds, or two columns (timestamp in seconds, mean S11). CSV
+files may have a header; a column named s11_mean (and optionally timestamp)
+is picked up by name.
+
+--smooth also runs the trace through DecisionSmoother and compares switch
+counts; --synthetic does the same for generated noisy traces that hover
+around each mode boundary.
+"""
+
+import sys
+import argparse
+import numpy as np
+from fuzzy_table import CompiledFuzzyController, MODE_NAMES, hold_last
+from decision_smoother import DecisionSmoother
+
+
+def is_number(field):
+    """True for numeric CSV fields, including nan and inf; column names are not"""
+    try:
+        float(field)
+        return True
+    except ValueError:
+        return False
+
+
+def load_trace(path, interval=5.0):
+    """Load a trace file and return (times, s11_means) as float arrays"""
+    if path.endswith('.npy'):
+        data = np.load(path)
+    else:
+        with open(path) as f:
+            first = f.readline()
+        has_header = not all(is_number(field) for field in first.strip().split(','))
+        if has_header:
+            data = np.genfromtxt(path, delimiter=',', names=True)
+            names = data.dtype.names
+            s11_name = 's11_mean' if 's11_mean' in names else names[-1]
+            time_name = next((n for n in ('timestamp', 'time') if n in names), None)
+            s11 = np.asarray(data[s11_name], dtype=float)
+            if time_name:
+                return np.asarray(data[time_name], dtype=float), s11
+            return np.arange(len(s11)) * interval, s11
+        data = np.loadtxt(path, delimiter=',', ndmin=1)
+
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 2 and data.shape[1] >= 2:
+        return data[:, 0], data[:, 1]
+    data = data.reshape(-1)
+    return np.arange(len(data)) * interval, data
+
+
+def mode_segments(times, codes, interval=5.0):
+    """Split a mode code series into (code, start_time, dwell) runs"""
+    if len(codes) == 0:
+        return []
+    change = np.flatnonzero(np.diff(codes)) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(codes)]))
+    # The last sample is assumed to last as long as the previous one (interval for a single sample)
+    last = times[-1] - times[-2] if len(times) > 1 else interval
+    end_times = np.concatenate((times[1:], [times[-1] + last]))
+    return [(int(codes[s]), float(times[s]), float(end_times[e - 1] - times[s])) for s, e in zip(starts, ends)]
+
+
+def summarize(times, codes, interval=5.0):
+    """Return switch count and per-mode dwell statistics"""
+    segments = mode_segments(times, codes, interval)
+    stats = {}
+    for code, _, dwell in segments:
+        stats.setdefault(code, []).append(dwell)
+    total = sum(d for _, _, d in segments) or 1.0
+    summary = {
+        "samples": len(codes),
+        "switches": max(len(segments) - 1, 0),
+        "modes": {},
+    }
+    for code, dwells in sorted(stats.items()):
+        dwells = np.array(dwells)
+        summary["modes"][code] = {
+            "segments": len(dwells),
+            "total": float(dwells.sum()),
+            "share": float(dwells.sum() / total),
+            "mean": float(dwells.mean()),
+            "min": float(dwells.min()),
+            "max": float(dwells.max()),
+        }
+    return summary
+
+
+def print_summary(summary, title="Replay"):
+    print(f"{title}: {summary['samples']} samples, {summary['switches']} mode switches")
+    print(f"  {'mode':<30} {'segments':>8} {'total s':>10} {'share':>7} {'mean s':>9} {'min s':>8} {'max s':>9}")
+    for code, m in summary["modes"].items():
+        name = MODE_NAMES.get(code, "Unknown")
+        print(f"  {name:<30} {m['segments']:>8} {m['total']:>10.1f} {m['share']:>6.1%} "
+              f"{m['mean']:>9.1f} {m['min']:>8.1f} {m['max']:>9.1f}")
+
+
+def synthetic_traces(samples=2000, interval=5.0, noise=1.5, seed=0):
+    """Noisy S11 traces that sit on or slowly drift across mode boundaries"""
+    rng = np.random.default_rng(seed)
+    times = np.arange(samples) * interval
+    drift = np.sin(np.linspace(0, 4 * np.pi, samples))
+    return {
+        # Gap between the low and mid CL sets: No Enhancement <-> Light AV
+        "hover -57.5 dB": (times, -57.5 + rng.normal(0, noise, samples)),
+        # Gap between the mid and high CL sets: Light AV <-> Standard AV
+        "hover -37.5 dB": (times, -37.5 + rng.normal(0, noise, samples)),
+        # Slow drift through all three sets with measurement noise on top
+        "drift -70..-30 dB": (times, -50 + 20 * drift + rng.normal(0, noise, samples)),
+    }
+
+
+def compare(times, s11_means, smoother, interval=5.0, title="Trace"):
+    """Print raw versus smoothed switch counts for one trace; returns both counts"""
+    controller = smoother.controller
+    raw = hold_last(controller.evaluate_batch(s11_means)[1])
+    smoothed = smoother.apply(times, s11_means)
+    raw_summary = summarize(times, raw, interval)
+    smoothed_summary = summarize(times, smoothed, interval)
+    prevented = raw_summary["switches"] - smoothed_summary["switches"]
+    print(f"{title}: {raw_summary['switches']} raw switches -> {smoothed_summary['switches']} smoothed "
+          f"({prevented} prevented, {smoother.suppressed} suppressed by dwell time)")
+    return raw_summary["switches"], smoothed_summary["switches"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay an S11 trace through the mode decision logic")
+    parser.add_argument('trace', nargs='?', help="CSV or NPY file of mean S11 values")
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help="seconds between samples when the trace has no time column (default: 5)")
+    parser.add_argument('--smooth', action='store_true', help="compare against DecisionSmoother")
+    parser.add_argument('--synthetic', action='store_true', help="compare on generated noisy traces")
+    parser.add_argument('--filter', choices=['ema', 'median', 'none'], default='ema')
+    parser.add_argument('--alpha', type=float, default=0.5, help="EMA weight of the newest sample")
+    parser.add_argument('--window', type=int, default=5, help="median filter length in samples")
+    parser.add_argument('--hysteresis', type=float, default=1.0, help="band around each threshold")
+    parser.add_argument('--min-dwell', type=float, default=10.0, help="seconds between mode switches")
+    args = parser.parse_args(argv)
+
+    smoother = DecisionSmoother(filter=None if args.filter == 'none' else args.filter, alpha=args.alpha,
+                                window=args.window, hysteresis=args.hysteresis, min_dwell=args.min_dwell)
+
+    if args.synthetic:
+        failures = 0
+        for title, (times, s11_means) in synthetic_traces(interval=args.interval).items():
+            raw, smoothed = compare(times, s11_means, smoother, args.interval, title)
+            failures += smoothed > raw
+        return 1 if failures else 0
+
+    if not args.trace:
+        parser.error("a trace file is required unless --synthetic is given")
+
+    times, s11_means = load_trace(args.trace, args.interval)
+    controller = CompiledFuzzyController()
+    _, codes = controller.evaluate_batch(s11_means)
+
+    unmatched = int(np.count_nonzero(codes < 0))
+    if unmatched:
+        print(f"{unmatched} samples fired no rule and hold the previous mode")
+    codes = hold_last(codes)
+
+    print_summary(summarize(times, codes, args.interval))
+
+    if args.smooth:
+        print()
+        smoothed = smoother.apply(times, s11_means)
+        print_summary(summarize(times, smoothed, args.interval), title="Smoothed")
+        print(f"{smoother.suppressed} switches suppressed by the minimum dwell time")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,10 +10,10 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'pocketvna_api'))
 import pocketvna
 
-import numpy as np
-import math
 import time
-import skfuzzy as fuzz
+from vna_session import VNASession
+from sweep_stats import SweepStatistics
+from fuzzy_table import CompiledFuzzyController, MODE_NAMES, mode_from_value
 
 class S11Monitor:
     def __init__(self):
@@ -26,111 +26,57 @@ class S11Monitor:
         self.s11_min = 0
         self.s11_max = 0
         self.s11_mean = 0
+        self.s11_stats = {}
         self.mode = "Unknown"
         self.defuzzified_value = 0
         
-        # Initialize fuzzy logic system parameters
-        self.x_CL = np.arange(-85, -25, 0.1)
-        self.y_SE = np.arange(0, 46, 1)
+        # One device session for the lifetime of the monitor
+        self.session = VNASession()
         
-        # Create fuzzy membership functions
-        self.init_fuzzy_sets()
+        # Frequency grid and dB buffers are built once and reused per sweep
+        self.sweep = SweepStatistics(self.start_freq, self.end_freq, self.num_of_points)
         
-    def init_fuzzy_sets(self):
-        """Initialize fuzzy sets"""
-        # CL (Channel Loss) membership functions
-        self.CL_low = fuzz.trapmf(self.x_CL, [-85, -75, -65, -60])
-        self.CL_mid = fuzz.trapmf(self.x_CL, [-55, -50, -45, -40])
-        self.CL_high = fuzz.trapmf(self.x_CL, [-35, -30, -25, -20])
-        
-        # SE (Speech Enhancement) membership functions
-        self.SE_not = fuzz.trapmf(self.y_SE, [0, 0, 5, 10])
-        self.SE_little = fuzz.trapmf(self.y_SE, [5, 10, 15, 20])
-        self.SE_mid = fuzz.trapmf(self.y_SE, [15, 20, 25, 30])
-        self.SE_high = fuzz.trapmf(self.y_SE, [25, 30, 35, 40])
-        self.SE_veryHigh = fuzz.trapmf(self.y_SE, [35, 40, 45, 50])
+        # Whole fuzzy inference precomputed over the CL universe, queried by interpolation
+        self.controller = CompiledFuzzyController()
 
     def measure_s11(self):
         """Measure S11 value"""
         try:
-            # Create driver instance
-            driver = pocketvna.Driver()
-            
-            # Check device connection
-            if driver.count() < 1:
-                print('No device detected.')
-                return False
-            
-            # Connect to the first device
-            if not driver.connect_to_first(pocketvna.ConnectionInterfaceCode.CIface_HID):
-                print('HID connection failed')
-                return False
-            
-            # Validate connection
-            if not driver.valid():
-                print('Connection invalid. Device may be disconnected.')
+            # Execute S11 scan on the persistent device session
+            result = self.session.scan(self.sweep.freq, 10, pocketvna.NetworkParams.S11)
+            if result is None:
                 return False
             
-            # Calculate frequency range
-            freq = [self.start_freq + i * (self.end_freq - self.start_freq) / (self.num_of_points - 1) 
-                    for i in range(self.num_of_points)]
-            
-            # Execute S11 scan
-            s11, _, _, _ = driver.scan(freq, 10, pocketvna.NetworkParams.S11)
-            
-            # Convert S11 to dB
-            s11_db = [20 * math.log10(math.sqrt(s.real**2 + s.imag**2)) for s in s11]
-            
-            # Calculate minimum, maximum and average values
-            self.s11_min = min(s11_db)
-            self.s11_max = max(s11_db)
-            self.s11_mean = sum(s11_db) / len(s11_db)
-            
-            # Close connection
-            driver.close()
+            # Convert S11 to dB and calculate sweep statistics
+            self.s11_stats = self.sweep.compute(result[0])
+            self.s11_min = self.s11_stats["min"]
+            self.s11_max = self.s11_stats["max"]
+            self.s11_mean = self.s11_stats["mean"]
             
             return True
             
         except Exception as e:
             print(f"Measurement error: {e}")
             return False
-        finally:
-            pocketvna.close_api()
+
+    def close(self):
+        """Release the VNA and shut down the PocketVNA API"""
+        self.session.close()
 
     def evaluate_fuzzy_logic(self):
         """Execute fuzzy logic reasoning and return processing mode"""
-        # Fuzzification
-        CL_fit_low = fuzz.interp_membership(self.x_CL, self.CL_low, self.s11_mean)
-        CL_fit_mid = fuzz.interp_membership(self.x_CL, self.CL_mid, self.s11_mean)
-        CL_fit_high = fuzz.interp_membership(self.x_CL, self.CL_high, self.s11_mean)
-        
-        # Rule evaluation
-        rule1 = np.fmin(CL_fit_low, self.SE_not)
-        rule2 = np.fmin(CL_fit_mid, self.SE_little)
-        rule3 = np.fmin(CL_fit_high, self.SE_high)
-        
-        # Aggregate rule outputs
-        out_SE = np.fmax(np.fmax(rule1, rule2), rule3)
+        defuzzified_value, mode_code = self.controller.evaluate(self.s11_mean)
         
-        # Defuzzification
-        self.defuzzified_value = fuzz.defuzz(self.y_SE, out_SE, 'centroid')
+        if mode_code < 0:
+            # No rule fires for this S11 (e.g. between two CL sets); hold the last decision
+            if self.mode not in MODE_NAMES.values():
+                self.defuzzified_value = self.default_decision()["defuzzified_value"]
+            defuzzified_value = self.defuzzified_value
+            mode_code = mode_from_value(defuzzified_value)
+            print(f"S11 {self.s11_mean:.2f} dB outside all CL sets, keeping {MODE_NAMES[mode_code]}")
         
-        # Determine processing mode based on defuzzified value
-        if self.defuzzified_value >= 39:
-            self.mode = "Advanced AV Mode"
-            mode_code = 4
-        elif 25 <= self.defuzzified_value < 39:
-            self.mode = "Standard AV Mode"
-            mode_code = 3
-        elif 12 <= self.defuzzified_value < 25:
-            self.mode = "Light AV Mode"
-            mode_code = 2
-        elif 9 <= self.defuzzified_value < 12:
-            self.mode = "Audio-Only Enhancement Mode"
-            mode_code = 1
-        else:
-            self.mode = "No Enhancement Mode"
-            mode_code = 0
+        self.defuzzified_value = defuzzified_value
+        self.mode = MODE_NAMES[mode_code]
             
         return {
             "mode": self.mode,
@@ -140,6 +86,13 @@ class S11Monitor:
         }
 
     
+    def evaluate_batch(self, s11_means):
+        """Evaluate the fuzzy logic over an array of S11 means without touching monitor state
+
+        Returns (defuzzified, mode_codes); mode code -1 marks samples where no rule fires.
+        """
+        return self.controller.evaluate_batch(s11_means)
+
     def get_current_status(self):
         """Get current S11 measurement and processing mode decision"""
         if self.measure_s11():
@@ -149,10 +102,15 @@ class S11Monitor:
         else:
             # 当无法获取S11数据时，默认选择"Advanced AV Mode"
             print("S11 measurement failed, defaulting to Advanced AV Mode")
-            return {
-                "mode": "Advanced AV Mode",
-                "mode_code": 4,            # 对应Advanced AV Mode的代码
-                "s11_mean": -30,           # 设置一个较差的S11值，表示信道质量较差
-                "defuzzified_value": 40    # 高于39的值会触发Advanced AV Mode
-            }
+            return self.default_decision()
+
+    def default_decision(self):
+        """Decision used when no S11 reading is available"""
+        return {
+            "mode": "Advanced AV Mode",
+            "mode_code": 4,            # 对应Advanced AV Mode的代码
+            "s11_mean": -30,           # 设置一个较差的S11值，表示信道质量较差
+            "defuzzified_value": 40,   # 高于39的值会触发Advanced AV Mode
+            "measured": False          # Not a real reading; smoothing passes it through
+        }
  
\ No newline at end of file
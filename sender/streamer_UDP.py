@@ -13,25 +13,50 @@ import sys
 import datetime
 import socket
 import json
+import timestamp_protocol
 from s11_monitor import S11Monitor
+from decision_sampler import DecisionSampler
+from decision_broadcast import DecisionBroadcaster
+from decision_smoother import DecisionSmoother
+from frame_ring import FrameTimestampRing
+from video_passthrough import VideoPassthrough
+
+def format_timestamp_ns(timestamp_ns):
+    """Format an epoch-nanosecond time the way the legacy text protocol expects"""
+    return datetime.datetime.fromtimestamp(timestamp_ns / 1e9).strftime("%Y-%m-%d %H:%M:%S.%f")
 
 class MediaStreamer:
     def __init__(self, bind_ip='192.168.1.1', video_port=5100, audio_port=5101, 
-                 timestamp_port=5102, decision_port=5103):
+                 timestamp_port=5102, decision_port=5103, s11_monitor=None, decision_interval=5,
+                 decision_multicast_port=5104, smoothing=True, sync_clock=False,
+                 frame_history=128, sei_timestamps=True):
         self.bind_ip = bind_ip
         self.video_multicast_addr = '239.0.0.1'  # 多播地址
         self.video_port = video_port
         self.audio_port = audio_port
         self.timestamp_port = timestamp_port
         self.decision_port = decision_port
+        self.decision_multicast_port = decision_multicast_port
+        # 接收端通过时间戳协议 v2 自行估计时钟偏移，chronyd 同步改为可选
+        self.sync_clock = sync_clock
         self.video_process = None
         self.audio_process = None
         self.timestamp_server = None
         self.decision_server = None
-        self.s11_monitor = S11Monitor()
+        self.s11_monitor = s11_monitor if s11_monitor is not None else S11Monitor()
+        # smoothing: True for the default DecisionSmoother, a DecisionSmoother instance, or False to disable
+        if smoothing is True:
+            smoothing = DecisionSmoother()
+        self.decision_sampler = DecisionSampler(self.s11_monitor, interval=decision_interval,
+                                                smoother=smoothing or None)
+        self.decision_broadcaster = None
         self.running = False
         self.current_frame_id = 0
-        self.frame_timestamps = {}
+        # 最近 frame_history 帧的采集时间，单写多读，无需加锁
+        self.frame_timestamps = FrameTimestampRing(frame_history)
+        # sei_timestamps: 视频经 Python 转发并在每帧前插入帧号/时间 SEI；False 时由 libcamera-vid 直接发送
+        self.sei_timestamps = sei_timestamps
+        self.video_passthrough = None
         
     def start_video_stream(self):
         """启动视频流（UDP 多播）"""
@@ -46,10 +71,20 @@ class MediaStreamer:
             '--profile', 'baseline',
             '--intra', '5',
             '--bitrate', '1000000',
-            '-o', f'udp://{self.video_multicast_addr}:{self.video_port}?ttl=1&localaddr={self.bind_ip}'
         ]
         
-        self.video_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if self.sei_timestamps:
+            cmd += ['-o', '-']
+            # stderr 不读取时会写满管道阻塞编码器
+            self.video_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self.video_passthrough = VideoPassthrough(self.video_process.stdout,
+                                                      (self.video_multicast_addr, self.video_port),
+                                                      bind_ip=self.bind_ip,
+                                                      frame_timestamps=self.frame_timestamps)
+            self.video_passthrough.start()
+        else:
+            cmd += ['-o', f'udp://{self.video_multicast_addr}:{self.video_port}?ttl=1&localaddr={self.bind_ip}']
+            self.video_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         print(f"Video stream started, multicasting to: {self.video_multicast_addr}:{self.video_port}")
         
     def start_audio_stream(self):
@@ -73,25 +108,35 @@ class MediaStreamer:
         print(f"Audio stream started, multicasting to: {self.video_multicast_addr}:{self.audio_port}")
     
     def start_timestamp_server(self):
-        """启动时间戳UDP服务器（保持不变）"""
+        """启动时间戳UDP服务器（二进制协议，兼容旧的文本命令）"""
         try:
             server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             server_socket.bind((self.bind_ip, self.timestamp_port))
+            server_socket.settimeout(1.0)
             print(f"Timestamp service started, bound to: {self.bind_ip}:{self.timestamp_port}")
             
             while self.running:
-                data, addr = server_socket.recvfrom(1024)
+                try:
+                    data, addr = server_socket.recvfrom(1024)
+                    received_ns = time.time_ns()
+                except socket.timeout:
+                    continue
                 
-                if data == b'TIMESTAMP':
+                if timestamp_protocol.is_binary(data):
+                    response = self.handle_binary_timestamp_request(data, received_ns)
+                    if response:
+                        server_socket.sendto(response, addr)
+                elif data == b'TIMESTAMP':
                     current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
                     server_socket.sendto(current_time.encode(), addr)
                 elif data.startswith(b'GET_FRAME_'):
                     try:
                         frame_id = int(data.decode().split('_')[-1])
-                        if frame_id in self.frame_timestamps:
+                        frame_ns = self.frame_timestamps.get(frame_id)
+                        if frame_ns is not None:
                             response = json.dumps({
                                 'frame_id': frame_id,
-                                'timestamp': self.frame_timestamps[frame_id]
+                                'timestamp': format_timestamp_ns(frame_ns)
                             })
                             server_socket.sendto(response.encode(), addr)
                         else:
@@ -100,11 +145,12 @@ class MediaStreamer:
                         print(f"Frame ID parsing error: {e}")
                         server_socket.sendto(b'INVALID_FRAME_ID', addr)
                 elif data == b'LATEST_FRAME':
-                    if self.frame_timestamps:
-                        latest_frame_id = max(self.frame_timestamps.keys())
+                    latest = self.frame_timestamps.latest()
+                    if latest is not None:
+                        latest_frame_id, frame_ns = latest
                         response = json.dumps({
                             'frame_id': latest_frame_id,
-                            'timestamp': self.frame_timestamps[latest_frame_id]
+                            'timestamp': format_timestamp_ns(frame_ns)
                         })
                         server_socket.sendto(response.encode(), addr)
                     else:
@@ -116,6 +162,37 @@ class MediaStreamer:
             if 'server_socket' in locals():
                 server_socket.close()
     
+    def handle_binary_timestamp_request(self, data, received_ns):
+        """Answer one binary timestamp datagram; returns the reply or None to drop it"""
+        try:
+            version, msg_type, fields = timestamp_protocol.unpack(data)
+        except ValueError as e:
+            print(f"Invalid timestamp datagram: {e}")
+            return None
+        
+        if msg_type == timestamp_protocol.MSG_HELLO:
+            return timestamp_protocol.pack_hello_ack(timestamp_protocol.negotiate(version))
+        
+        if msg_type == timestamp_protocol.MSG_FRAME_REQUEST:
+            frame_id, client_ns = fields
+            if frame_id == timestamp_protocol.LATEST_FRAME:
+                latest = self.frame_timestamps.latest()
+                frame_id, frame_ns = latest if latest is not None else (None, None)
+            else:
+                frame_ns = self.frame_timestamps.get(frame_id)
+            
+            if frame_ns is not None:
+                status = timestamp_protocol.STATUS_OK
+            elif frame_id is None:
+                status, frame_id, frame_ns = timestamp_protocol.STATUS_NO_FRAMES, -1, 0
+            else:
+                status, frame_ns = timestamp_protocol.STATUS_FRAME_NOT_FOUND, 0
+            return timestamp_protocol.pack_frame_response(
+                status, frame_id, frame_ns, client_ns, received_ns, time.time_ns(),
+                version=timestamp_protocol.negotiate(version))
+        
+        return None
+    
     def start_decision_server(self):
         """启动处理模式决策TCP服务器（保持不变）"""
         try:
@@ -162,9 +239,13 @@ class MediaStreamer:
                         break
                     
                     if data == b'GET_DECISION':
-                        decision = self.s11_monitor.get_current_status()
-                        response = json.dumps(decision)
-                        client_socket.sendall(response.encode())
+                        # Answer from the sampler's snapshot; never scan on behalf of a client
+                        snapshot = self.decision_sampler.latest()
+                        if snapshot is not None:
+                            client_socket.sendall(snapshot.payload)
+                        else:
+                            response = json.dumps(self.s11_monitor.default_decision())
+                            client_socket.sendall(response.encode())
                         
                 except socket.timeout:
                     try:
@@ -181,21 +262,21 @@ class MediaStreamer:
             client_socket.close()
             print(f"Client {addr} disconnected")
     
-    def s11_decision_update(self):
-        """定期更新S11和处理模式决策（保持不变）"""
-        while self.running:
-            decision = self.s11_monitor.get_current_status()
-            time.sleep(5)
+    def start_decision_broadcast(self):
+        """Push each new decision to the multicast group; TCP stays available as a fallback"""
+        try:
+            self.decision_broadcaster = DecisionBroadcaster(
+                self.video_multicast_addr, self.decision_multicast_port, bind_ip=self.bind_ip)
+            self.decision_sampler.add_listener(self.decision_broadcaster.publish)
+            print(f"Decision broadcast started, multicasting to: {self.video_multicast_addr}:{self.decision_multicast_port}")
+        except Exception as e:
+            print(f"Decision broadcast unavailable, clients must poll over TCP: {e}")
     
     def update_frame_counter(self):
-        """更新帧计数器并记录时间戳（保持不变）"""
+        """更新帧计数器并记录时间戳（仅在未启用 SEI 帧时间戳时使用，按 30fps 估计）"""
         while self.running:
-            if len(self.frame_timestamps) > 100:
-                oldest_frame = min(self.frame_timestamps.keys())
-                del self.frame_timestamps[oldest_frame]
-                
             self.current_frame_id += 1
-            self.frame_timestamps[self.current_frame_id] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+            self.frame_timestamps.append(self.current_frame_id, time.time_ns())
             time.sleep(1/30)
     
     def detect_audio_device(self):
@@ -232,20 +313,19 @@ class MediaStreamer:
     def start(self):
         """启动所有流服务（保持不变）"""
         self.running = True
-        self.sync_time()
+        if self.sync_clock:
+            self.sync_time()
         
         video_thread = threading.Thread(target=self.start_video_stream)
         audio_thread = threading.Thread(target=self.start_audio_stream)
         timestamp_thread = threading.Thread(target=self.start_timestamp_server)
         decision_thread = threading.Thread(target=self.start_decision_server)
-        s11_update_thread = threading.Thread(target=self.s11_decision_update)
         frame_counter_thread = threading.Thread(target=self.update_frame_counter)
         
         video_thread.daemon = True
         audio_thread.daemon = True
         timestamp_thread.daemon = True
         decision_thread.daemon = True
-        s11_update_thread.daemon = True
         frame_counter_thread.daemon = True
         
         video_thread.start()
@@ -254,8 +334,11 @@ class MediaStreamer:
         audio_thread.start()
         timestamp_thread.start()
         decision_thread.start()
-        s11_update_thread.start()
-        frame_counter_thread.start()
+        self.start_decision_broadcast()
+        self.decision_sampler.start()
+        if not self.sei_timestamps:
+            # 使用 SEI 时帧号来自视频转发线程
+            frame_counter_thread.start()
         
         print("All media streaming services have been started")
         
@@ -273,11 +356,21 @@ class MediaStreamer:
             print("Stopping video stream...")
             self.video_process.terminate()
             self.video_process.wait()
+        if self.video_passthrough:
+            self.video_passthrough.stop()
             
         if self.audio_process:
             print("Stopping audio stream...")
             self.audio_process.terminate()
             self.audio_process.wait()
+        
+        print("Stopping S11 sampler...")
+        self.decision_sampler.stop()
+        if self.decision_broadcaster:
+            self.decision_broadcaster.close()
+        
+        print("Closing VNA session...")
+        self.s11_monitor.close()
             
         print("All streaming services stopped")
 
@@ -290,11 +383,15 @@ if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    sync_clock = '--sync-clock' in sys.argv[1:]
+    
     bind_ip = '192.168.1.1'
-    if len(sys.argv) > 1:
-        bind_ip = sys.argv[1]
+    if args:
+        bind_ip = args[0]
     
     streamer = MediaStreamer(bind_ip=bind_ip, video_port=5100, audio_port=5101, 
-                            timestamp_port=5102, decision_port=5103)
+                            timestamp_port=5102, decision_port=5103, decision_multicast_port=5104,
+                            sync_clock=sync_clock)
     print(f"Starting audio and video streaming service, binding to {bind_ip}...")
     streamer.start()
\ No newline at end of file
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized S11 sweep statistics shared by the S11 monitors
+"""
+
+import math
+import time
+import numpy as np
+
+
+class SweepStatistics:
+    """Frequency grid and dB statistics for a fixed S11 sweep
+
+    The grid is computed once and passed straight to Driver.scan. Magnitude
+    and dB conversion write into buffers allocated up front, so a reading
+    only allocates for the small result dict.
+    """
+
+    def __init__(self, start_freq, end_freq, num_of_points):
+        self.start_freq = start_freq
+        self.end_freq = end_freq
+        self.num_of_points = num_of_points
+        self.freq = np.linspace(start_freq, end_freq, num_of_points)
+
+        self._magnitude = np.empty(num_of_points)
+        self._db = np.empty(num_of_points)
+        self._floor = np.finfo(float).tiny
+
+    def to_db(self, s11):
+        """Convert complex S11 to dB in place; the returned array is reused by the next call"""
+        if len(s11) != self.num_of_points:
+            raise ValueError(f"Expected {self.num_of_points} points, got {len(s11)}")
+
+        np.abs(s11, out=self._magnitude)
+        # Clamp exact zeros so a dead port reads as a very deep dip, not -inf
+        np.maximum(self._magnitude, self._floor, out=self._magnitude)
+        np.log10(self._magnitude, out=self._db)
+        self._db *= 20
+        return self._db
+
+    def compute(self, s11):
+        """Return summary statistics of one sweep in dB"""
+        s11_db = self.to_db(s11)
+
+        dip_index = int(np.argmin(s11_db))
+        s11_min = float(s11_db[dip_index])
+        median = float(np.median(s11_db))
+
+        return {
+            "min": s11_min,
+            "max": float(s11_db.max()),
+            "mean": float(s11_db.mean()),
+            "median": median,
+            "std": float(s11_db.std()),
+            "dip_freq": float(self.freq[dip_index]),
+            "dip_depth": median - s11_min,   # how far the resonance sits below the baseline
+        }
+
+
+def legacy_stats(s11):
+    """Per-element implementation previously used in measure_s11, kept for comparison"""
+    s11_db = [20 * math.log10(math.sqrt(s.real**2 + s.imag**2)) for s in s11]
+    return min(s11_db), max(s11_db), sum(s11_db) / len(s11_db)
+
+
+def benchmark(point_counts=(100, 1000, 10000), repeats=200):
+    """Time the legacy loop against SweepStatistics.compute for several sweep sizes"""
+    rng = np.random.default_rng(0)
+    print(f"{'points':>8} {'legacy':>12} {'vectorized':>12} {'speedup':>8}")
+    for count in point_counts:
+        s11 = (rng.uniform(1e-4, 1e-2, count) * np.exp(1j * rng.uniform(0, 2 * np.pi, count))).astype(np.complex128)
+        sweep = SweepStatistics(1.5e9, 3e9, count)
+
+        # Warm up both paths so the first timed call does not pay for it
+        legacy = legacy_stats(s11)
+        sweep_mean = sweep.compute(s11)["mean"]
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            legacy = legacy_stats(s11)
+        legacy_time = (time.perf_counter() - start) / repeats
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            sweep_mean = sweep.compute(s11)["mean"]
+        vector_time = (time.perf_counter() - start) / repeats
+
+        assert abs(legacy[2] - sweep_mean) < 1e-9
+        print(f"{count:>8} {legacy_time * 1e6:>9.1f} us {vector_time * 1e6:>9.1f} us {legacy_time / vector_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Round-trip benchmark of the timestamp service: legacy text versus binary protocol
+
+Runs MediaStreamer's timestamp server on localhost with a stand-in S11
+monitor and the real frame counter, then measures LATEST_FRAME round trips
+per second for each protocol, including the client-side parsing.
+
+Usage: python timestamp_benchmark.py [seconds_per_protocol]
+"""
+
+import sys
+import time
+import json
+import socket
+import datetime
+import threading
+import timestamp_protocol
+from decision_sampler import _FakeMonitor
+from streamer_UDP import MediaStreamer
+
+
+def legacy_round_trip(sock, addr):
+    sock.sendto(b'LATEST_FRAME', addr)
+    data, _ = sock.recvfrom(1024)
+    frame_data = json.loads(data.decode())
+    return datetime.datetime.strptime(frame_data['timestamp'], "%Y-%m-%d %H:%M:%S.%f").timestamp()
+
+
+def binary_round_trip(sock, addr):
+    sock.sendto(timestamp_protocol.pack_frame_request(timestamp_protocol.LATEST_FRAME, time.time_ns()), addr)
+    data, _ = sock.recvfrom(1024)
+    _, _, fields = timestamp_protocol.unpack(data)
+    return fields[2] / 1e9
+
+
+def run(duration=3.0, port=15102):
+    streamer = MediaStreamer(bind_ip='127.0.0.1', timestamp_port=port, s11_monitor=_FakeMonitor())
+    streamer.running = True
+    threading.Thread(target=streamer.start_timestamp_server, daemon=True).start()
+    threading.Thread(target=streamer.update_frame_counter, daemon=True).start()
+    time.sleep(0.5)
+
+    addr = ('127.0.0.1', port)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1.0)
+    try:
+        sock.sendto(timestamp_protocol.pack_hello(), addr)
+        version, _, _ = timestamp_protocol.unpack(sock.recvfrom(1024)[0])
+        print(f"Negotiated binary protocol v{version}")
+
+        for name, round_trip in (("legacy text", legacy_round_trip), ("binary", binary_round_trip)):
+            count = 0
+            started = time.perf_counter()
+            while time.perf_counter() - started < duration:
+                round_trip(sock, addr)
+                count += 1
+            elapsed = time.perf_counter() - started
+            print(f"{name:>12}: {count / elapsed:10.0f} round trips/s ({elapsed / count * 1e6:.1f} us each)")
+    finally:
+        sock.close()
+        streamer.running = False
+
+
+if __name__ == "__main__":
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 3.0)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+H.264 passthrough from the encoder to the UDP socket with per-frame SEI timestamps
+
+libcamera-vid writes the Annex-B stream to stdout; VideoPassthrough reads it,
+inserts a SEI with the frame id and time before each frame (see h264_sei.py),
+registers the frame in the timestamp ring and sends the bytes on in UDP
+datagrams, as libcamera-vid's own udp:// output would.
+
+The embedded time is when the frame leaves the encoder, which is the
+earliest point the passthrough can observe.
+
+Replay mode for testing without a camera:
+    python video_passthrough.py --synthetic 300 --dest 127.0.0.1:15100
+    python video_passthrough.py recording.h264 --fps 30 --dest 127.0.0.1:15100
+    python video_passthrough.py --synthetic 300 --save synthetic.h264
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+from h264_sei import (SEIInjector, NALSplitter, START_CODE, NAL_SPS, NAL_PPS, NAL_IDR, NAL_SLICE,
+                      nal_header_offset, is_first_slice)
+from frame_ring import FrameTimestampRing
+
+# Same payload size libcamera-vid uses for its UDP output, below a 1500-byte MTU
+MAX_DATAGRAM = 1400
+
+
+class VideoPassthrough:
+    def __init__(self, source, dest_addr, bind_ip=None, frame_timestamps=None, ttl=1):
+        """
+        Args:
+            source: binary file object (encoder stdout or an .h264 file)
+            dest_addr: (ip, port) to send to, usually the video multicast group
+            frame_timestamps: FrameTimestampRing to register frames in; created if None
+        """
+        self.source = source
+        self.dest_addr = dest_addr
+        self.frame_timestamps = frame_timestamps if frame_timestamps is not None else FrameTimestampRing()
+        self.injector = SEIInjector(self.on_frame)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        if bind_ip:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(bind_ip))
+        self.running = False
+        self.thread = None
+        self.frames = 0
+        self.bytes_sent = 0
+
+    def on_frame(self, frame_id):
+        capture_ns = time.time_ns()
+        self.frame_timestamps.append(frame_id, capture_ns)
+        self.frames += 1
+        return capture_ns
+
+    def send(self, data):
+        for offset in range(0, len(data), MAX_DATAGRAM):
+            self.sock.sendto(data[offset:offset + MAX_DATAGRAM], self.dest_addr)
+        self.bytes_sent += len(data)
+
+    def run(self):
+        fd = self.source.fileno()
+        try:
+            while self.running:
+                # os.read returns as soon as the encoder has written anything
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                self.send(self.injector.feed(chunk))
+            self.send(self.injector.flush())
+        except OSError as e:
+            if self.running:
+                print(f"Video passthrough error: {e}")
+        finally:
+            self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+        self.sock.close()
+
+
+def synthetic_h264(frames=300, gop=5, frame_size=3000, seed=0):
+    """Structurally valid Annex-B stream (SPS/PPS/IDR/P slices) with random slice data
+
+    Not decodable, but has the NAL layout libcamera-vid produces with
+    --inline --intra <gop>. Yields one encoded frame (bytes) at a time.
+    """
+    import random
+    rng = random.Random(seed)
+
+    def nal(header, size):
+        body = bytearray(rng.getrandbits(8) for _ in range(size))
+        # first_mb_in_slice = 0, then no start code emulation anywhere in the body
+        body[0] |= 0x80
+        for i in range(2, len(body)):
+            if body[i - 2] == 0 and body[i - 1] == 0 and body[i] <= 3:
+                body[i] = 0x04
+        body[-1] = 0x80
+        return START_CODE + bytes([header]) + bytes(body)
+
+    sps = START_CODE + bytes([0x60 | NAL_SPS]) + bytes.fromhex('42c01edd80a03db0110000030001000003003c8f162e48')
+    pps = START_CODE + bytes([0x60 | NAL_PPS]) + bytes.fromhex('ce3c80')
+    for index in range(frames):
+        if index % gop == 0:
+            yield sps + pps + nal(0x60 | NAL_IDR, frame_size * 4)
+        else:
+            yield nal(0x40 | NAL_SLICE, frame_size)
+
+
+def replay(frames, dest_addr, fps=30.0):
+    """Send pre-split frames through the passthrough at a fixed frame rate over a pipe"""
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, 'rb', buffering=0) as source:
+        passthrough = VideoPassthrough(source, dest_addr)
+        passthrough.start()
+        started = time.perf_counter()
+        with os.fdopen(write_fd, 'wb', buffering=0) as sink:
+            for index, frame in enumerate(frames):
+                delay = started + index / fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sink.write(frame)
+        passthrough.thread.join(timeout=5)
+        passthrough.stop()
+    print(f"Replayed {passthrough.frames} frames ({passthrough.bytes_sent / 1024:.0f} KiB) to "
+          f"{dest_addr[0]}:{dest_addr[1]}")
+    return passthrough
+
+
+def split_frames(path):
+    """Split an .h264 file into frames, each starting at parameter sets or a first slice"""
+    splitter = NALSplitter()
+    with open(path, 'rb') as f:
+        nals = splitter.feed(f.read())
+    tail = splitter.flush()
+    if tail:
+        nals.append(tail)
+
+    frame = bytearray()
+    has_slice = False
+    for nal in nals:
+        header = nal[nal_header_offset(nal)]
+        # A new frame starts at parameter sets or a first slice once the current one has a slice
+        starts_frame = (header & 0x1F) in (NAL_SPS, NAL_PPS) or is_first_slice(header, nal[nal_header_offset(nal) + 1])
+        if has_slice and starts_frame:
+            yield bytes(frame)
+            frame = bytearray()
+            has_slice = False
+        frame += nal
+        has_slice = has_slice or (header & 0x1F) in (NAL_SLICE, NAL_IDR)
+    if frame:
+        yield bytes(frame)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay H.264 through the SEI timestamp passthrough")
+    parser.add_argument('file', nargs='?', help=".h264 Annex-B file to replay")
+    parser.add_argument('--synthetic', type=int, metavar='FRAMES', help="replay a generated stream instead")
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--dest', default='127.0.0.1:5100', help="ip:port to send to (default: 127.0.0.1:5100)")
+    parser.add_argument('--save', metavar='PATH', help="write the synthetic stream to an .h264 file instead of sending it")
+    args = parser.parse_args(argv)
+
+    if args.save:
+        if not args.synthetic:
+            parser.error("--save needs --synthetic FRAMES")
+        with open(args.save, 'wb') as f:
+            for frame in synthetic_h264(args.synthetic):
+                f.write(frame)
+        print(f"Wrote {args.synthetic} synthetic frames to {args.save}")
+        return 0
+
+    host, port = args.dest.rsplit(':', 1)
+    if args.synthetic:
+        frames = synthetic_h264(args.synthetic)
+    elif args.file:
+        frames = split_frames(args.file)
+    else:
+        parser.error("give an .h264 file or --synthetic FRAMES")
+    replay(frames, (host, int(port)), args.fps)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-lived PocketVNA device session shared by the S11 measurement loop
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'pocketvna_api'))
+import pocketvna
+
+import time
+
+
+class VNASession:
+    """Owns a single pocketvna.Driver handle for the lifetime of the sender.
+
+    The device is enumerated and connected once; every scan afterwards reuses
+    the open handle. When Driver.valid() reports the handle is gone (cable
+    pulled, device reset) the session reconnects, backing off exponentially
+    between failed attempts so a missing device does not stall the caller.
+    The API itself is only torn down in close().
+    """
+
+    def __init__(self, interface=pocketvna.ConnectionInterfaceCode.CIface_HID,
+                 use_simulator=False, min_backoff=0.5, max_backoff=30.0):
+        self.interface = interface
+        self.use_simulator = use_simulator
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.driver = None
+        self.backoff = 0
+        self.next_attempt_time = 0
+        self.reconnect_count = 0
+        self.closed = False
+
+    def connect(self):
+        """Enumerate devices and open a connection, reusing the Driver handle"""
+        if self.driver is None:
+            self.driver = pocketvna.Driver()
+        else:
+            # Re-enumerate so a re-plugged device is visible again
+            self.driver.enumerate()
+
+        if self.use_simulator:
+            return self.driver.connect_to_simulator()
+
+        if self.driver.count() < 1:
+            print('No device detected.')
+            return False
+
+        if not self.driver.connect_to_first(self.interface):
+            print('HID connection failed')
+            return False
+
+        return self.driver.valid()
+
+    def ensure_connected(self):
+        """Return True if the handle is usable, reconnecting with backoff if not"""
+        if self.closed:
+            return False
+
+        if self.driver is not None and self.driver.valid():
+            return True
+
+        now = time.monotonic()
+        if now < self.next_attempt_time:
+            return False
+
+        try:
+            connected = self.connect()
+        except Exception as e:
+            print(f"VNA connection error: {e}")
+            connected = False
+
+        if connected:
+            if self.backoff:
+                self.reconnect_count += 1
+                print(f"VNA reconnected (attempt backoff was {self.backoff:.1f}s)")
+            self.backoff = 0
+            self.next_attempt_time = 0
+            return True
+
+        self.backoff = min(self.max_backoff, max(self.min_backoff, self.backoff * 2))
+        self.next_attempt_time = now + self.backoff
+        print(f"VNA unavailable, next connection attempt in {self.backoff:.1f}s")
+        return False
+
+    def scan(self, freq, avg=10, params=pocketvna.NetworkParams.S11):
+        """Scan the given frequencies on the open handle
+
+        Returns the (s11, s21, s12, s22) tuple from Driver.scan, or None if
+        the device is not connected. A scan that invalidates the handle is
+        reported as None and the next call will reconnect.
+        """
+        if not self.ensure_connected():
+            return None
+
+        try:
+            return self.driver.scan(freq, avg, params)
+        except pocketvna.PocketVnaHandlerInvalid:
+            print('Connection invalid. Device may be disconnected.')
+            return None
+
+    def close(self):
+        """Release the device and shut down the PocketVNA API"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.driver is not None:
+                self.driver.close()
+        finally:
+            self.driver = None
+            pocketvna.close_api()
+
+
+def benchmark(iterations=20, num_of_points=100, avg=10):
+    """Compare per-measurement latency of connect-per-scan against a persistent session
+
+    Uses Driver.connect_to_simulator() so it runs without a physical device.
+    """
+    import numpy as np
+
+    freq = np.linspace(1.5e9, 3e9, num_of_points)
+
+    # Before: a fresh driver, connection and API teardown on every reading
+    per_call = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        driver = pocketvna.Driver()
+        driver.connect_to_simulator()
+        driver.scan(freq, avg, pocketvna.NetworkParams.S11)
+        driver.close()
+        pocketvna.close_api()
+        per_call.append(time.perf_counter() - start)
+
+    # After: one session, only the scan is paid per reading
+    session = VNASession(use_simulator=True)
+    session.ensure_connected()
+    persistent = []
+    try:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            session.scan(freq, avg)
+            persistent.append(time.perf_counter() - start)
+    finally:
+        session.close()
+
+    for name, samples in (("connect per scan", per_call), ("persistent session", persistent)):
+        samples = np.array(samples) * 1000
+        print(f"{name:>20}: mean {samples.mean():8.2f} ms | "
+              f"median {np.median(samples):8.2f} ms | max {samples.max():8.2f} ms")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"Benchmarking {iterations} S11 measurements on the PocketVNA simulator...")
+    benchmark(iterations)